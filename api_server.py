@@ -1,21 +1,35 @@
+import json
 import logging
 from enum import Enum
 from datetime import datetime, timedelta
 import time
-from flask import Flask, jsonify, Response, request, send_file
+from flask import Flask, g, jsonify, Response, request
 import threading
 import os
-import requests
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from urllib.parse import parse_qs
 from constants import (
+    API_SERVER_BACKEND,
+    API_SERVER_KEEP_ALIVE_TIMEOUT,
+    API_SERVER_MAX_CONNECTIONS,
+    API_SERVER_MAX_STREAMS,
+    API_SERVER_PORT,
+    API_SERVER_WORKERS,
     CACHE_FOLDER,
     LOG_FILENAME,
     LOGS_FOLDER,
     MAX_FOLDER_SIZE_BYTES,
     OUTPUT_FOLDER,
     VERSION,
+    VIDEO_STREAM_MAX_BYTES_PER_SECOND,
 )
 from storage.storage import Storage
+from storage.storage_index import StorageIndex
+from storage.storage_stats import StorageStats
+from storage.video_catalog import VideoCatalog
+from storage.video_streamer import VideoStreamer
+from utils.http_server import RequestMetrics, StreamLimiter, createServer
+from utils.log_reader import LogReader
 
 
 log = logging.getLogger("werkzeug")
@@ -33,17 +47,54 @@ class LightMode(Enum):
     DARK = "dark"
 
 
+class ChangeNotifier:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+
+    def notify(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    # Returns the current version once it differs from `version` or on timeout
+    def wait(self, version, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+class ObservableData:
+    # Fields that change on almost every update, they are not pushed on their
+    # own but go out with the next change or heartbeat
+    quietFields = ()
+
+    def setNotifier(self, notifier: ChangeNotifier):
+        object.__setattr__(self, "notifier", notifier)
+
+    def __setattr__(self, name, value):
+        previous = getattr(self, name, None)
+        super().__setattr__(name, value)
+        notifier = getattr(self, "notifier", None)
+        if notifier and name not in self.quietFields and previous != value:
+            notifier.notify()
+
+
 @dataclass
-class InferenceData:
+class InferenceData(ObservableData):
+    quietFields = ("fps", "recoveryPercent", "cleanupPercent", "stageTimings")
+
     status: str
     trafficLightColor: str
     recoveryPercent: int
     cleanupPercent: int
     fps: int
+    # Per stage busy/wait/blocked times of the pipelined inference
+    stageTimings: dict = None
 
 
 @dataclass
-class LightModeData:
+class LightModeData(ObservableData):
     lightMode: str
 
 
@@ -69,13 +120,72 @@ data = Data(
 
 
 class APIServer:
-    def __init__(self, data=data, activeClientThreshold=timedelta(seconds=3)):
+    def __init__(
+        self,
+        data=data,
+        activeClientThreshold=timedelta(seconds=3),
+        heartbeatInterval: float = 2,
+        backend: str = API_SERVER_BACKEND,
+        port: int = API_SERVER_PORT,
+        storageIndex: StorageIndex = None,
+        videoCatalog: VideoCatalog = None,
+        storage: Storage = None,
+        storageStats: StorageStats = None,
+    ):
         self.data = data
         self.lastCall = datetime.now()
         self.activeClientThreshold = activeClientThreshold
+        self.heartbeatInterval = heartbeatInterval
+        self.activeStreams = 0
+        self.streamsLock = threading.Lock()
+        self.changeNotifier = ChangeNotifier()
+        self.data.inferenceData.setNotifier(self.changeNotifier)
+        self.data.lightModeData.setNotifier(self.changeNotifier)
         self.app = Flask(__name__)
+        # Open event streams and followed logs, the server gets the wrapped app
+        self.streamLimiter = StreamLimiter(
+            self.app, API_SERVER_MAX_STREAMS, self.isStreamingRequest
+        )
+        self.backend = backend
+        self.port = port
+        self.server = None
         self.thread = None
-        self.storage = Storage(OUTPUT_FOLDER, CACHE_FOLDER)
+        self.requestMetrics = RequestMetrics()
+        self.videoCatalog = videoCatalog
+        if storageIndex is None:
+            storageIndex = StorageIndex(OUTPUT_FOLDER, CACHE_FOLDER)
+            storageIndex.load()
+            storageIndex.reconcile()
+        if storage is None:
+            storage = Storage(OUTPUT_FOLDER, CACHE_FOLDER, storageIndex, videoCatalog)
+        self.storage = storage
+        if storageStats is None:
+            storageStats = StorageStats(storageIndex, MAX_FOLDER_SIZE_BYTES)
+        self.storageStats = storageStats
+        self.quotaEnforcer = None
+        self.videoStreamer = VideoStreamer(
+            OUTPUT_FOLDER, maxBytesPerSecond=VIDEO_STREAM_MAX_BYTES_PER_SECOND
+        )
+        self.logReader = LogReader(os.path.join(LOGS_FOLDER, LOG_FILENAME))
+        self.stopEvent = threading.Event()
+        self.videoStreamer.stopEvent = self.stopEvent
+
+        @self.app.before_request
+        def startTimer():
+            g.startTime = time.perf_counter()
+
+        # Time until the response is ready, streamed bodies are not included
+        @self.app.after_request
+        def recordLatency(response):
+            startTime = g.get("startTime")
+            if startTime is not None:
+                route = request.url_rule.rule if request.url_rule else "<unmatched>"
+                self.requestMetrics.record(
+                    f"{request.method} {route}",
+                    response.status_code,
+                    time.perf_counter() - startTime,
+                )
+            return response
 
         @self.app.route("/", methods=["GET"])
         def getInferenceData():
@@ -87,6 +197,21 @@ class APIServer:
                 logging.error(e)
                 return Response(str(e), status=500)
 
+        # Pushes inferenceData and lightModeData events when they change, an
+        # open stream counts as an active client
+        @self.app.route("/events", methods=["GET"])
+        def getEvents():
+            try:
+                return Response(
+                    self.streamEvents(),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                )
+            except Exception as e:
+                print(e)
+                logging.error(e)
+                return Response(str(e), status=500)
+
         @self.app.route("/lightMode", methods=["GET"])
         def getLightModeData():
             try:
@@ -99,6 +224,9 @@ class APIServer:
         @self.app.route("/videos", methods=["GET"])
         def getVideos():
             try:
+                if self.videoCatalog:
+                    return jsonify({"videoNames": self.videoCatalog.getNames()})
+
                 if not os.path.exists(OUTPUT_FOLDER):
                     return jsonify({"videoNames": []})
 
@@ -109,10 +237,39 @@ class APIServer:
                 logging.error(e)
                 return Response(str(e), status=500)
 
+        @self.app.route("/catalog", methods=["GET"])
+        def getCatalog():
+            try:
+                if self.videoCatalog is None:
+                    return "Video catalog not available", 404
+
+                etag = self.videoCatalog.getETag()
+                ifNoneMatch = request.headers.get("If-None-Match", "")
+                tags = [tag.strip() for tag in ifNoneMatch.split(",")]
+                if etag in tags or "*" in tags or f"W/{etag}" in tags:
+                    return Response(status=304, headers={"ETag": etag})
+
+                videos, nextCursor = self.videoCatalog.query(
+                    limit=min(request.args.get("limit", 50, type=int), 500),
+                    cursor=request.args.get("cursor"),
+                    fromTimestamp=request.args.get("from", type=float),
+                    toTimestamp=request.args.get("to", type=float),
+                    newestFirst=request.args.get("order", "desc") != "asc",
+                )
+                response = jsonify({"videos": videos, "nextCursor": nextCursor})
+                response.headers["ETag"] = etag
+                return response
+            except Exception as e:
+                print(e)
+                logging.error(e)
+                return Response(str(e), status=500)
+
         @self.app.route("/videos/<videoName>/thumbnail", methods=["GET"])
         def getThumbnail(videoName):
             try:
-                image = self.storage.getVideoThumbnail(videoName)
+                image = self.storage.getVideoThumbnail(
+                    videoName, request.args.get("size", "large")
+                )
 
                 if image is None:
                     return "Video thumbnail not found", 404
@@ -123,14 +280,24 @@ class APIServer:
                 logging.error(e)
                 return Response(str(e), status=500)
 
+        @self.app.route("/videos/<videoName>/sprite", methods=["GET"])
+        def getSprite(videoName):
+            try:
+                image = self.storage.getVideoSprite(videoName)
+
+                if image is None:
+                    return "Video sprite not found", 404
+
+                return Response(image, mimetype="image/jpeg")
+            except Exception as e:
+                print(e)
+                logging.error(e)
+                return Response(str(e), status=500)
+
         @self.app.route("/videos/<videoName>", methods=["GET"])
         def getVideoSource(videoName):
             try:
-                video_path = os.path.join(OUTPUT_FOLDER, videoName)
-                if not os.path.exists(video_path):
-                    return "Video not found", 404
-
-                return send_file(video_path, mimetype="video/mkv")
+                return self.videoStreamer.createResponse(videoName, request)
             except Exception as e:
                 print(e)
                 logging.error(e)
@@ -139,43 +306,71 @@ class APIServer:
         @self.app.route("/info", methods=["GET"])
         def getInfo():
             try:
-                currentSize = 0
-                cacheSize = 0
-                if os.path.exists(OUTPUT_FOLDER):
-                    for dirpath, dirnames, filenames in os.walk(OUTPUT_FOLDER):
-                        for f in filenames:
-                            fp = os.path.join(dirpath, f)
-                            currentSize += os.path.getsize(fp)
-
-                if os.path.exists(CACHE_FOLDER):
-                    for dirpath, dirnames, filenames in os.walk(CACHE_FOLDER):
-                        for f in filenames:
-                            fp = os.path.join(dirpath, f)
-                            cacheSize += os.path.getsize(fp)
-
+                stats = self.storageStats.getStats()
                 info = {
                     "version": VERSION,
-                    "currentRecordingsSize": currentSize,
-                    "cacheSize": cacheSize,
-                    "maxRecordingsSize": MAX_FOLDER_SIZE_BYTES,
+                    "currentRecordingsSize": stats["recordingsSize"],
+                    "cacheSize": stats["cacheSize"],
+                    "maxRecordingsSize": stats["maxRecordingsSize"],
+                    "storage": stats,
                 }
+                if self.quotaEnforcer:
+                    info["cleanup"] = self.quotaEnforcer.getMetrics()
                 return jsonify(info)
             except Exception as e:
                 print(e)
                 logging.error(e)
                 return Response(str(e), status=500)
 
+        # /logs               whole log, streamed
+        # /logs?tail=N        last N lines
+        # /logs?offset=B      from byte B, optionally limited with &length=L
+        # /logs?follow=true   server-sent events with new lines, resumes from
+        #                     Last-Event-ID or offset, starts after tail if given
         @self.app.route("/logs", methods=["GET"])
         def getLogs():
             try:
-                log_file_path = os.path.join(LOGS_FOLDER, LOG_FILENAME)
-                if not os.path.exists(log_file_path):
+                if not self.logReader.exists():
                     return "Log file not found", 404
 
-                with open(log_file_path, "r") as log_file:
-                    log_contents = log_file.read()
-
-                return Response(log_contents, mimetype="text/plain")
+                tail = request.args.get("tail", type=int)
+                offset = request.args.get("offset", type=int)
+                length = request.args.get("length", type=int)
+                follow = request.args.get("follow", "false").lower() in ("1", "true")
+
+                if follow:
+                    lastEventId = request.headers.get("Last-Event-ID")
+                    if lastEventId and lastEventId.isdigit():
+                        offset = int(lastEventId)
+                    elif offset is None and tail is not None:
+                        offset, _ = self.logReader.tail(tail)
+                    return Response(
+                        self.followLogs(offset),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                    )
+
+                size = self.logReader.getSize()
+                if tail is not None:
+                    offset, data = self.logReader.tail(max(0, tail))
+                    body = data
+                    length = len(data)
+                else:
+                    offset = min(max(0, offset or 0), size)
+                    if length is None:
+                        length = size - offset
+                    length = max(0, min(length, size - offset))
+                    body = self.logReader.readRange(offset, length)
+
+                return Response(
+                    body,
+                    mimetype="text/plain",
+                    headers={
+                        "X-Log-Size": str(size),
+                        "X-Log-Offset": str(offset),
+                        "X-Log-Next-Offset": str(offset + length),
+                    },
+                )
             except Exception as e:
                 print(e)
                 logging.error(e)
@@ -191,32 +386,114 @@ class APIServer:
                 logging.error(e)
                 return Response(str(e), status=500)
 
+        @self.app.route("/metrics", methods=["GET"])
+        def getMetrics():
+            try:
+                metrics = {
+                    "backend": self.backend,
+                    "routes": self.requestMetrics.getMetrics(),
+                    "inferenceStages": self.data.inferenceData.stageTimings,
+                }
+                metrics["maxStreams"] = self.streamLimiter.maxStreams
+                metrics["openStreams"] = self.streamLimiter.openStreams
+                metrics["rejectedStreams"] = self.streamLimiter.rejectedStreams
+                if hasattr(self.server, "getStats"):
+                    metrics["server"] = self.server.getStats()
+                return jsonify(metrics)
+            except Exception as e:
+                print(e)
+                logging.error(e)
+                return Response(str(e), status=500)
+
         @self.app.route("/shutdown", methods=["GET"])
         def shutdownServer():
             try:
-                shutdownFunction = request.environ.get("werkzeug.server.shutdown")
-                if shutdownFunction is None:
-                    raise RuntimeError("Not running with the Werkzeug Server")
-                shutdownFunction()
+                if self.server is None:
+                    raise RuntimeError("Server is not running")
+                # shutdown() waits for the serve loop, which cannot finish
+                # while this request is being handled
+                threading.Thread(target=self.server.shutdown).start()
                 return Response(status=200)
             except Exception as e:
                 print(e)
                 logging.error(e)
                 return Response(str(e), status=500)
 
+    def followLogs(self, offset):
+        for event in self.logReader.follow(offset, self.stopEvent):
+            if event is None:
+                yield ": heartbeat\n\n"
+                continue
+            # The id is where the next line starts, Last-Event-ID resumes there
+            _, nextOffset, line = event
+            yield f"id: {nextOffset}\ndata: {line}\n\n"
+
+    def streamEvents(self):
+        with self.streamsLock:
+            self.activeStreams += 1
+        try:
+            version = self.changeNotifier.version
+            lastSent = {}
+            yield f"retry: {int(self.heartbeatInterval * 1000)}\n\n"
+            while not self.stopEvent.is_set():
+                sent = False
+                for name, value in (
+                    ("inferenceData", asdict(self.data.inferenceData)),
+                    ("lightModeData", asdict(self.data.lightModeData)),
+                ):
+                    if value != lastSent.get(name):
+                        lastSent[name] = value
+                        sent = True
+                        yield f"event: {name}\ndata: {json.dumps(value)}\n\n"
+
+                # Writing the heartbeat fails once the client is gone, which
+                # closes this generator
+                if not sent:
+                    yield ": heartbeat\n\n"
+
+                version = self.changeNotifier.wait(version, self.heartbeatInterval)
+        finally:
+            with self.streamsLock:
+                self.activeStreams -= 1
+            self.lastCall = datetime.now()
+
     def isClientActive(self):
+        if self.activeStreams > 0:
+            return True
         delta = datetime.now() - self.lastCall
         return delta < self.activeClientThreshold
 
-    def start(self):
-        def run_flask():
-            self.app.run(host="0.0.0.0", threaded=True)
+    # Responses that stay open until the client leaves: event streams and
+    # followed logs. Video range requests end on their own and are not counted.
+    @staticmethod
+    def isStreamingRequest(path):
+        route, _, query = path.partition("?")
+        if route == "/events":
+            return True
+        if route == "/logs":
+            follow = parse_qs(query).get("follow", ["false"])[0]
+            return follow.lower() in ("1", "true")
+        return False
 
-        self.thread = threading.Thread(target=run_flask)
+    def start(self):
+        self.server = createServer(
+            self.backend,
+            self.streamLimiter,
+            "0.0.0.0",
+            self.port,
+            workers=API_SERVER_WORKERS,
+            maxConnections=API_SERVER_MAX_CONNECTIONS,
+            keepAliveTimeout=API_SERVER_KEEP_ALIVE_TIMEOUT,
+            maxStreams=API_SERVER_MAX_STREAMS,
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever)
         self.thread.start()
 
     def stop(self):
-        requests.get("http://127.0.0.1:5000/shutdown")
+        # Open event streams and downloads end first, so the workers are free
+        self.stopEvent.set()
+        self.changeNotifier.notify()
+        self.server.shutdown()
         self.thread.join()
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+"""Compare the CPU cost of the video encoder backends on a synthetic source.
+
+Run from the repository root:
+    python -m benchmarks.encoder_benchmark --seconds 20
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+import cv2
+import numpy as np
+from input_output.video_maker import VideoMaker
+
+BACKENDS = {
+    "opencv-xvid": ("opencv", {}),
+    "ffmpeg-h264-ultrafast": ("ffmpeg", {"codec": "libx264", "preset": "ultrafast"}),
+    "ffmpeg-h264-veryfast": ("ffmpeg", {"codec": "libx264", "preset": "veryfast"}),
+    "ffmpeg-h265-ultrafast": ("ffmpeg", {"codec": "libx265", "preset": "ultrafast"}),
+    "ffmpeg-h264-v4l2m2m": ("ffmpeg", {"codec": "h264_v4l2m2m"}),
+}
+
+
+def syntheticFrames(width: int, height: int, count: int):
+    # Moving gradient with a little noise, so the encoder has real motion to code
+    rng = np.random.default_rng(0)
+    base = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    for index in range(count):
+        shifted = np.roll(base, index * 4, axis=1)
+        frame[:, :, 0] = shifted
+        frame[:, :, 1] = shifted[::-1]
+        frame[:, :, 2] = rng.integers(0, 32, (height, width), dtype=np.uint8)
+        cv2.putText(
+            frame, str(index), (40, 80), cv2.FONT_HERSHEY_PLAIN, 4, (255, 255, 255), 3
+        )
+        yield frame.copy()
+
+
+def cpuTime():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def benchmark(name, encoder, options, width, height, fps, seconds, outputFolder):
+    frameCount = int(fps * seconds)
+    # Frames are generated up front so only encoding is measured
+    frames = list(syntheticFrames(width, height, min(frameCount, int(fps * 2))))
+    outputFile = os.path.join(outputFolder, name)
+
+    cpuStart = cpuTime()
+    wallStart = time.time()
+    videoMaker = VideoMaker(outputFile, width, height, fps, encoder, options)
+    for index in range(frameCount):
+        videoMaker.writeFrame(frames[index % len(frames)])
+    videoMaker.releaseVideo()
+    wallTime = time.time() - wallStart
+    cpu = cpuTime() - cpuStart
+
+    size = os.path.getsize(videoMaker.outputFile)
+    print(
+        f"{name:<24} cpu/recorded s = {cpu / seconds:6.3f}  "
+        f"realtime factor = {seconds / wallTime:6.2f}x  "
+        f"size = {size / 1024 / 1024:7.2f} MB"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=float, default=9.0)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=list(BACKENDS.keys()),
+        default=list(BACKENDS.keys()),
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as outputFolder:
+        for name in args.backends:
+            encoder, options = BACKENDS[name]
+            try:
+                benchmark(
+                    name,
+                    encoder,
+                    options,
+                    args.width,
+                    args.height,
+                    args.fps,
+                    args.seconds,
+                    outputFolder,
+                )
+            except Exception as e:
+                print(f"{name:<24} failed: {e}")
@@ -0,0 +1,124 @@
+"""Compare the latency and detections of the inference engines on a recorded drive.
+
+The first engine is the reference, the others report how many of its
+detections they find (same label, IoU >= --iouThreshold) and how many extra
+ones they add. Run from the repository root:
+    python -m benchmarks.engine_benchmark --video recordings/1710000000.mkv \
+        --engines tasklib=models/12thMar2024/traffic_12thMar2024.tflite \
+                  tflite=models/12thMar2024/traffic_12thMar2024.tflite \
+                  onnx=models/12thMar2024/traffic_12thMar2024.onnx
+"""
+import argparse
+import time
+import numpy as np
+from benchmarks.roi_benchmark import readFrames
+from inference.detection_engines import ENGINES
+from inference.detection_filter import DetectionFilter
+from inference.inference_engine import InferenceEngine
+from inference.roi_tiler import RoiTiler
+
+
+def runEngine(engine, model, frames, threads, scoreThreshold, maxResults):
+    inferenceEngine = InferenceEngine(
+        model, None, threads, scoreThreshold, maxResults, engine=engine
+    )
+    height, width = frames[0].shape[:2]
+    detectionFilter = DetectionFilter(width, height, maxAreaDivisor=128)
+
+    # Warm up, the first invokes allocate buffers
+    inferenceEngine.getDetections(frames[0])
+
+    latencies = []
+    detections = []
+    for frame in frames:
+        startTime = time.perf_counter()
+        result = inferenceEngine.getDetections(frame)
+        latencies.append(time.perf_counter() - startTime)
+        detections.append(detectionFilter.filter(result))
+    return np.array(latencies) * 1000, detections
+
+
+# Greedy matching of one frame's detections, returns the matched count
+def countMatches(reference, detections, iouThreshold):
+    matched = 0
+    used = set()
+    for expected in reference:
+        for i, detection in enumerate(detections):
+            if i in used:
+                continue
+            if (
+                detection.categories[0].category_name
+                == expected.categories[0].category_name
+                and RoiTiler.getIoU(expected.bounding_box, detection.bounding_box)
+                >= iouThreshold
+            ):
+                used.add(i)
+                matched += 1
+                break
+    return matched
+
+
+def report(name, latencies, detections, referenceDetections, iouThreshold):
+    total = sum(len(frameDetections) for frameDetections in detections)
+    line = (
+        f"{name:<10} mean = {latencies.mean():7.2f} ms  "
+        f"p95 = {np.percentile(latencies, 95):7.2f} ms  "
+        f"detections = {total:5d}"
+    )
+    if referenceDetections is not None:
+        expected = sum(len(frameDetections) for frameDetections in referenceDetections)
+        matched = sum(
+            countMatches(reference, frameDetections, iouThreshold)
+            for reference, frameDetections in zip(referenceDetections, detections)
+        )
+        line += (
+            f"  recall = {matched / max(1, expected) * 100:5.1f}%"
+            f"  precision = {matched / max(1, total) * 100:5.1f}%"
+        )
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        required=True,
+        help=f"engine=model pairs, engines: {', '.join(ENGINES.keys())}",
+    )
+    parser.add_argument("--video", required=True, help="Recorded drive to replay.")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--step", type=int, default=1, help="Use every n-th frame.")
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--scoreThreshold", type=float, default=0.3)
+    parser.add_argument("--maxResults", type=int, default=3)
+    parser.add_argument("--iouThreshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    frames = readFrames(args.video, args.frames, args.step)
+    if not frames:
+        raise SystemExit(f"No frames could be read from {args.video}")
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+
+    referenceDetections = None
+    for pair in args.engines:
+        engine, _, model = pair.partition("=")
+        if engine not in ENGINES or not model:
+            raise SystemExit(f"Expected engine=model, got {pair}")
+        try:
+            latencies, detections = runEngine(
+                engine,
+                model,
+                frames,
+                args.threads,
+                args.scoreThreshold,
+                args.maxResults,
+            )
+        except Exception as e:
+            print(f"{engine:<10} failed: {e}")
+            continue
+        report(engine, latencies, detections, referenceDetections, args.iouThreshold)
+        if referenceDetections is None:
+            referenceDetections = detections
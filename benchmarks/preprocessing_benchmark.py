@@ -0,0 +1,123 @@
+"""Time each preprocessing stage of the Task Library and the fused interpreter path.
+
+Run from the repository root:
+    python -m benchmarks.preprocessing_benchmark --model models/12thMar2024/traffic_12thMar2024.tflite
+
+Without --model only the image stages are timed, on a 300x300 input.
+"""
+import argparse
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+
+def timeStage(function, iterations):
+    # Returns (mean ms, allocated KiB per call) of function()
+    function()
+    startTime = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    elapsed = (time.perf_counter() - startTime) / iterations * 1000
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024
+
+
+def report(path, stages, iterations):
+    print(path)
+    total = 0
+    for name, function in stages:
+        elapsed, allocated = timeStage(function, iterations)
+        total += elapsed
+        print(f"  {name:<28} {elapsed:8.3f} ms  {allocated:10.1f} KiB allocated")
+    print(f"  {'total':<28} {total:8.3f} ms")
+
+
+def legacyStages(frame, detector):
+    from tflite_support.task import vision
+
+    state = {}
+
+    def convert():
+        state["rgb"] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def wrap():
+        state["tensor"] = vision.TensorImage.create_from_array(state["rgb"])
+
+    stages = [("cvtColor full frame", convert), ("TensorImage", wrap)]
+    if detector:
+        stages.append(("detect (resize + invoke)", lambda: detector.detect(state["tensor"])))
+    return stages
+
+
+def fusedStages(frame, interpreterDetector, inputSize):
+    width, height = inputSize
+    buffer = np.empty((height, width, 3), dtype=np.uint8)
+
+    def resize():
+        cv2.resize(frame, inputSize, dst=buffer, interpolation=cv2.INTER_LINEAR)
+
+    def convert():
+        cv2.cvtColor(buffer, cv2.COLOR_BGR2RGB, dst=buffer)
+
+    stages = [("resize into buffer", resize), ("cvtColor input size", convert)]
+    if interpreterDetector:
+        interpreter = interpreterDetector.interpreter
+        indices = interpreterDetector.outputIndices
+
+        def postprocess():
+            interpreterDetector.createResult(
+                interpreter.get_tensor(indices["location"])[0],
+                interpreter.get_tensor(indices["category"])[0],
+                interpreter.get_tensor(indices["score"])[0],
+                interpreter.get_tensor(indices["number of detections"])[0],
+                frame.shape[1],
+                frame.shape[0],
+            )
+
+        stages = [
+            ("resize + cvtColor in tensor", lambda: interpreterDetector.prepareInput([frame])),
+            ("invoke", interpreter.invoke),
+            ("read outputs", postprocess),
+        ]
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=2)
+    args = parser.parse_args()
+
+    frame = np.random.randint(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+
+    detector = None
+    interpreterDetector = None
+    inputSize = (300, 300)
+    if args.model:
+        from tflite_support.task import core, vision
+        from inference.interpreter_detector import InterpreterDetector
+
+        options = vision.ObjectDetectorOptions(
+            base_options=core.BaseOptions(
+                file_name=args.model, num_threads=args.threads
+            )
+        )
+        detector = vision.ObjectDetector.create_from_options(options)
+        interpreterDetector = InterpreterDetector(
+            args.model, args.threads, batchSize=1
+        )
+        inputSize = (interpreterDetector.inputWidth, interpreterDetector.inputHeight)
+
+    print(f"Frame {args.width}x{args.height}, model input {inputSize[0]}x{inputSize[1]}")
+    report("Task Library", legacyStages(frame, detector), args.iterations)
+    report("Fused interpreter", fusedStages(frame, interpreterDetector, inputSize), args.iterations)
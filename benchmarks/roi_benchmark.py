@@ -0,0 +1,109 @@
+"""Compare full frame, region of interest and tiled inference on a recorded drive.
+
+Run from the repository root:
+    python -m benchmarks.roi_benchmark --model models/12thMar2024/traffic_12thMar2024.tflite \
+        --video recordings/1710000000.mkv --frames 300
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+from inference.detection_filter import DetectionFilter
+from inference.inference_engine import InferenceEngine
+from inference.roi_tiler import RoiTiler
+
+MODES = {
+    "full-frame": None,
+    "roi-upper-half": dict(roi=(0.0, 0.0, 1.0, 0.5)),
+    "roi-upper-half-2x1": dict(roi=(0.0, 0.0, 1.0, 0.5), tileColumns=2),
+    "roi-upper-half-3x1": dict(roi=(0.0, 0.0, 1.0, 0.5), tileColumns=3),
+}
+
+
+def readFrames(video: str, count: int, step: int):
+    capture = cv2.VideoCapture(video)
+    frames = []
+    index = 0
+    while len(frames) < count:
+        success, frame = capture.read()
+        if not success:
+            break
+        if index % step == 0:
+            frames.append(frame)
+        index += 1
+    capture.release()
+    return frames
+
+
+def benchmark(name, options, frames, model, threads, scoreThreshold, maxResults):
+    tiler = RoiTiler(maxResults=maxResults, **options) if options else None
+    engine = InferenceEngine(
+        model, None, threads, scoreThreshold, maxResults, tiler=tiler
+    )
+    height, width = frames[0].shape[:2]
+    detectionFilter = DetectionFilter(width, height, maxAreaDivisor=128)
+
+    # Warm up, the first invokes allocate buffers
+    engine.getDetections(frames[0])
+
+    latencies = []
+    framesWithDetections = 0
+    detectionCount = 0
+    for frame in frames:
+        startTime = time.perf_counter()
+        result = engine.getDetections(frame)
+        latencies.append(time.perf_counter() - startTime)
+
+        detections = detectionFilter.filter(result)
+        detectionCount += len(detections)
+        if detections:
+            framesWithDetections += 1
+
+    pixels = tiler.getPixelCount(width, height) if tiler else width * height
+    latencies = np.array(latencies) * 1000
+    print(
+        f"{name:<22} mean = {latencies.mean():7.2f} ms  "
+        f"p95 = {np.percentile(latencies, 95):7.2f} ms  "
+        f"detection rate = {framesWithDetections / len(frames) * 100:5.1f}%  "
+        f"detections = {detectionCount:5d}  "
+        f"pixels = {pixels / (width * height) * 100:5.1f}%"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--video", required=True, help="Recorded drive to replay.")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--step", type=int, default=1, help="Use every n-th frame.")
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--scoreThreshold", type=float, default=0.3)
+    parser.add_argument("--maxResults", type=int, default=3)
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=list(MODES.keys()),
+        default=list(MODES.keys()),
+    )
+    args = parser.parse_args()
+
+    frames = readFrames(args.video, args.frames, args.step)
+    if not frames:
+        raise SystemExit(f"No frames could be read from {args.video}")
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+
+    for name in args.modes:
+        try:
+            benchmark(
+                name,
+                MODES[name],
+                frames,
+                args.model,
+                args.threads,
+                args.scoreThreshold,
+                args.maxResults,
+            )
+        except Exception as e:
+            print(f"{name:<22} failed: {e}")
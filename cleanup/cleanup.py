@@ -5,29 +5,56 @@ import sys
 from api_server import InferenceData, Status
 from constants import CACHE_FOLDER, OUTPUT_FOLDER
 from storage.storage import Storage
+from storage.storage_index import StorageIndex
+from storage.video_catalog import VideoCatalog
 
 
 class Cleanup:
-    def __init__(self, folderPath, cachePath, targetSizeBytes, apiData: InferenceData):
+    def __init__(
+        self,
+        folderPath,
+        cachePath,
+        targetSizeBytes,
+        apiData: InferenceData,
+        storageIndex: StorageIndex = None,
+        videoCatalog: VideoCatalog = None,
+        storage: Storage = None,
+    ):
         self.folderPath = folderPath
         self.cachePath = cachePath
         self.targetSizeBytes = targetSizeBytes
         self.apiData = apiData
-        self.storage = Storage(folderPath, cachePath)
+        if storageIndex is None:
+            storageIndex = StorageIndex(folderPath, cachePath)
+            storageIndex.reconcile()
+        self.storageIndex = storageIndex
+        self.videoCatalog = videoCatalog
+        if storage is None:
+            storage = Storage(folderPath, cachePath, storageIndex, videoCatalog)
+        self.storage = storage
 
     def getTotalSize(self):
-        totalSize = 0
-        for dirpath, dirnames, filenames in os.walk(self.folderPath):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                totalSize += os.path.getsize(fp)
+        return self.storageIndex.getTotalSize()
 
-        for dirpath, dirnames, filenames in os.walk(self.cachePath):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                totalSize += os.path.getsize(fp)
+    # Deletes a recording that was already popped from the storage index,
+    # returns the number of bytes freed
+    def deleteRecording(self, fileName):
+        path = os.path.join(self.folderPath, fileName)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            size = 0
+        self.storage.deleteVideoThumbnail(fileName)
+        if self.videoCatalog:
+            self.videoCatalog.removeVideo(fileName)
+        print(f"Removed oldest file: {fileName}")
+        return size
 
-        return totalSize
+    def saveIndexes(self):
+        self.storageIndex.save()
+        if self.videoCatalog:
+            self.videoCatalog.save()
 
     def removeOldFiles(self):
         try:
@@ -42,18 +69,16 @@ class Cleanup:
                         1 - newOverflowSize / overflowSize
                     ) * 100
 
-                files = [
-                    (f, os.path.getmtime(os.path.join(self.folderPath, f)))
-                    for f in os.listdir(self.folderPath)
-                ]
-                oldestFile = min(files, key=lambda x: x[1])[0]
-                os.remove(os.path.join(self.folderPath, oldestFile))
-                self.storage.deleteVideoThumbnail(oldestFile)
-                print(f"Removed oldest file: {oldestFile}")
+                oldestFile = self.storageIndex.popOldestRecording()
+                if oldestFile is None:
+                    break
+                self.deleteRecording(oldestFile)
                 totalSize = self.getTotalSize()
         except Exception as e:
             print(e)
             logging.error(e)
+        finally:
+            self.saveIndexes()
 
 
 if __name__ == "__main__":
@@ -64,5 +89,5 @@ if __name__ == "__main__":
     folderPath = sys.argv[1]
     targetSize = int(sys.argv[2])
 
-    folderManager = Cleanup(folderPath, targetSize)
+    folderManager = Cleanup(folderPath, CACHE_FOLDER, targetSize, None)
     folderManager.removeOldFiles()
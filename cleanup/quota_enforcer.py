@@ -0,0 +1,166 @@
+import logging
+import shutil
+import threading
+import time
+import utils.utils as utils
+from cleanup.cleanup import Cleanup
+
+
+class QuotaEnforcer:
+    def __init__(
+        self,
+        cleanup: Cleanup,
+        highWatermark: float = 0.95,
+        lowWatermark: float = 0.90,
+        minFreeBytes: int = 1024 * 1024 * 1024,
+        minRecordings: int = 3,
+        checkInterval: float = 30,
+        batchSize: int = 4,
+        batchPause: float = 0.5,
+    ) -> None:
+        self.cleanup = cleanup
+        # Cleanup starts above the high watermark and deletes down to the low one
+        self.highWatermarkBytes = int(cleanup.targetSizeBytes * highWatermark)
+        self.lowWatermarkBytes = int(cleanup.targetSizeBytes * lowWatermark)
+        self.minFreeBytes = minFreeBytes
+        # The newest recordings are never deleted, whatever fills the disk
+        self.minRecordings = minRecordings
+        self.spaceWarning = False
+        self.checkInterval = checkInterval
+        self.batchSize = batchSize
+        self.batchPause = batchPause
+
+        self.thread = None
+        self.stopEvent = threading.Event()
+        self.wakeEvent = threading.Event()
+
+        # Metrics
+        self.bytesReclaimed = 0
+        self.filesDeleted = 0
+        self.runs = 0
+        self.lastDeletionLatency = 0
+        self.maxDeletionLatency = 0
+        self.lastRunTime = None
+
+    def getFreeBytes(self):
+        try:
+            return shutil.disk_usage(self.cleanup.folderPath).free
+        except OSError:
+            return None
+
+    # Bytes deleting recordings can free, the kept ones are assumed to be of
+    # average size
+    def getReclaimableBytes(self):
+        storageIndex = self.cleanup.storageIndex
+        count = storageIndex.getRecordingsCount()
+        if count <= self.minRecordings:
+            return 0
+        size = storageIndex.getRecordingsSize()
+        return size - size * self.minRecordings // count
+
+    # minFreeBytes applies to the whole filesystem. When the OS or the logs
+    # take the space, deleting every recording would not bring it back, so
+    # free space only counts when the recordings can make up for it.
+    def isLowOnSpace(self):
+        freeBytes = self.getFreeBytes()
+        if freeBytes is None or freeBytes >= self.minFreeBytes:
+            self.spaceWarning = False
+            return False
+        if self.getReclaimableBytes() < self.minFreeBytes - freeBytes:
+            if not self.spaceWarning:
+                self.spaceWarning = True
+                message = (
+                    f"Only {freeBytes} bytes free and the recordings cannot free "
+                    f"{self.minFreeBytes} bytes, the disk is used by other files"
+                )
+                print(message)
+                logging.error(message)
+            return False
+        return True
+
+    def isOverQuota(self):
+        if self.cleanup.getTotalSize() > self.highWatermarkBytes:
+            return True
+        return self.isLowOnSpace()
+
+    def isBelowLowWatermark(self):
+        if self.cleanup.getTotalSize() > self.lowWatermarkBytes:
+            return False
+        return not self.isLowOnSpace()
+
+    def deleteBatch(self):
+        storageIndex = self.cleanup.storageIndex
+        deleted = 0
+        for _ in range(self.batchSize):
+            if storageIndex.getRecordingsCount() <= self.minRecordings:
+                break
+            oldestFile = storageIndex.popOldestRecording()
+            if oldestFile is None:
+                break
+
+            startTime = time.time()
+            size = self.cleanup.deleteRecording(oldestFile)
+            latency = time.time() - startTime
+
+            self.bytesReclaimed += size
+            self.filesDeleted += 1
+            self.lastDeletionLatency = latency
+            self.maxDeletionLatency = max(self.maxDeletionLatency, latency)
+            deleted += 1
+        return deleted
+
+    def enforce(self):
+        if not self.isOverQuota():
+            return
+
+        self.runs += 1
+        overflowSize = max(1, self.cleanup.getTotalSize() - self.lowWatermarkBytes)
+        apiData = self.cleanup.apiData
+
+        while not self.stopEvent.is_set() and not self.isBelowLowWatermark():
+            if self.deleteBatch() == 0:
+                break
+            if apiData:
+                remaining = max(0, self.cleanup.getTotalSize() - self.lowWatermarkBytes)
+                apiData.cleanupPercent = (1 - remaining / overflowSize) * 100
+            # Give the recorder's writes room between batches
+            self.stopEvent.wait(self.batchPause)
+
+        self.cleanup.saveIndexes()
+
+    def run(self):
+        utils.lowerThreadPriority(19)
+        while not self.stopEvent.is_set():
+            try:
+                self.enforce()
+                self.lastRunTime = time.time()
+            except Exception as e:
+                print(e)
+                logging.error(e)
+            self.wakeEvent.wait(self.checkInterval)
+            self.wakeEvent.clear()
+
+    # Ask for a check now, e.g. at segment rotation, without waiting for it
+    def notify(self):
+        self.wakeEvent.set()
+
+    def getMetrics(self):
+        return {
+            "bytesReclaimed": self.bytesReclaimed,
+            "filesDeleted": self.filesDeleted,
+            "runs": self.runs,
+            "lastDeletionLatency": self.lastDeletionLatency,
+            "maxDeletionLatency": self.maxDeletionLatency,
+            "lastRunTime": self.lastRunTime,
+            "freeBytes": self.getFreeBytes(),
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        self.wakeEvent.set()
+        if self.thread:
+            self.thread.join()
@@ -11,3 +11,33 @@ FILE_DURATION = 10 * 60  # 10 Minutes
 # Logging
 LOGS_FOLDER = "logs"
 LOG_FILENAME = "error.log"
+LOG_MAX_BYTES = 1024 * 1024  # 1MB per file
+LOG_BACKUP_COUNT = 3
+
+# Video encoding, "opencv" (XVID) or "ffmpeg"
+VIDEO_ENCODER = "opencv"
+VIDEO_ENCODER_OPTIONS = {}
+# Seconds of frames the recorder buffers while the encoder or the SD card
+# stalls, check maxEncodeTime in the recorder stats when changing it
+RECORDER_QUEUE_SECONDS = 2.5
+
+# Storage accounting
+STORAGE_INDEX_FILE = "storage_index.json"
+
+# Frame ranges of finished segments, one JSON object per line
+SEGMENT_LOG_FILE = "segments.jsonl"
+
+# API server, "pooled" (cheroot, bounded worker threads) or "werkzeug" (thread per connection)
+API_SERVER_BACKEND = "pooled"
+API_SERVER_PORT = 5000
+API_SERVER_WORKERS = 8
+API_SERVER_MAX_CONNECTIONS = 32
+API_SERVER_KEEP_ALIVE_TIMEOUT = 10
+# Event streams and followed logs, each holds a thread of its own on top of the workers
+API_SERVER_MAX_STREAMS = 4
+
+# Video downloads, total bandwidth shared by all clients (None for unlimited)
+VIDEO_STREAM_MAX_BYTES_PER_SECOND = 4 * 1024 * 1024
+
+# Video catalog with per segment metadata
+CATALOG_FILE = "video_catalog.json"
@@ -0,0 +1,170 @@
+"""
+Benchmark model variants for latency and accuracy.
+
+Every model is timed on the same clip at each thread count (p50/p95 per frame)
+and scored with Pascal VOC mAP against the XML labels of a folder of frames.
+The fastest model and thread count that meets --minMap is printed at the end.
+
+Run from the repository root:
+    python -m dataset_and_training.dataset_utils.model_benchmark \
+        --models models/*/*.tflite --video recordings/1710000000.mkv \
+        --images totalLabelledFrames --threads 1 2 4 --minMap 0.85
+"""
+import argparse
+import time
+import xml.etree.ElementTree as ET
+import cv2
+import numpy as np
+from benchmarks.roi_benchmark import readFrames
+from dataset_and_training.dataset_utils.model_quantizer import list_labelled_images
+from inference.inference_engine import InferenceEngine
+from inference.roi_tiler import RoiTiler
+from tflite_support.task import processor
+
+
+def load_ground_truth(xml_path):
+    """
+    Read the objects of a Pascal VOC XML file.
+
+    Returns:
+    - list: (name, BoundingBox, difficult) for every object.
+    """
+    objects = []
+    for obj in ET.parse(xml_path).getroot().findall('object'):
+        box = obj.find('bndbox')
+        xmin, ymin, xmax, ymax = (
+            int(float(box.find(tag).text)) for tag in ('xmin', 'ymin', 'xmax', 'ymax')
+        )
+        difficult = obj.find('difficult')
+        objects.append((
+            obj.find('name').text,
+            processor.BoundingBox(xmin, ymin, xmax - xmin, ymax - ymin),
+            difficult is not None and difficult.text == '1',
+        ))
+    return objects
+
+
+def average_precision(recall, precision):
+    # VOC 2010+ all point interpolation: area under the monotone precision curve
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([0.0], precision, [0.0]))
+    for i in range(len(precision) - 2, -1, -1):
+        precision[i] = max(precision[i], precision[i + 1])
+    changes = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[changes + 1] - recall[changes]) * precision[changes + 1]))
+
+
+def evaluate_map(engine, labelled_images, iou_threshold=0.5):
+    """
+    Score a model on labelled frames.
+
+    Returns:
+    - (float, dict): mAP and the AP of every class.
+    """
+    ground_truth = {}
+    predictions = {}
+    for image_index, (image_path, xml_path) in enumerate(labelled_images):
+        image = cv2.imread(image_path)
+        if image is None:
+            continue
+        for name, box, difficult in load_ground_truth(xml_path):
+            ground_truth.setdefault(name, {}).setdefault(image_index, []).append(
+                [box, difficult, False]
+            )
+        for detection in engine.getDetections(image).detections:
+            category = detection.categories[0]
+            predictions.setdefault(category.category_name, []).append(
+                (category.score, image_index, detection.bounding_box)
+            )
+
+    class_aps = {}
+    for name, images in ground_truth.items():
+        positives = sum(
+            1 for objects in images.values() for _, difficult, _ in objects if not difficult
+        )
+        if positives == 0:
+            continue
+        detections = sorted(predictions.get(name, []), key=lambda p: p[0], reverse=True)
+        true_positives = np.zeros(len(detections))
+        false_positives = np.zeros(len(detections))
+        for i, (_, image_index, box) in enumerate(detections):
+            objects = images.get(image_index, [])
+            ious = [RoiTiler.getIoU(box, gt_box) for gt_box, _, _ in objects]
+            best = int(np.argmax(ious)) if ious else -1
+            if best < 0 or ious[best] < iou_threshold:
+                false_positives[i] = 1
+            elif objects[best][1]:
+                # Difficult objects count neither way
+                continue
+            elif objects[best][2]:
+                false_positives[i] = 1  # Duplicate detection
+            else:
+                objects[best][2] = True
+                true_positives[i] = 1
+
+        true_positives = np.cumsum(true_positives)
+        false_positives = np.cumsum(false_positives)
+        recall = true_positives / positives
+        precision = true_positives / np.maximum(true_positives + false_positives, 1e-9)
+        class_aps[name] = average_precision(recall, precision)
+
+    mean_ap = float(np.mean(list(class_aps.values()))) if class_aps else 0.0
+    return mean_ap, class_aps
+
+
+def measure_latency(engine, frames):
+    # Warm up, the first invokes allocate buffers
+    engine.getDetections(frames[0])
+    latencies = []
+    for frame in frames:
+        start_time = time.perf_counter()
+        engine.getDetections(frame)
+        latencies.append(time.perf_counter() - start_time)
+    latencies = np.array(latencies) * 1000
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--models", nargs="+", required=True)
+    parser.add_argument("--video", required=True, help="Fixed clip for latency.")
+    parser.add_argument("--images", required=True, help="Frames with Pascal VOC XML labels.")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--engine", default="tflite")
+    parser.add_argument("--iouThreshold", type=float, default=0.5)
+    parser.add_argument("--minMap", type=float, default=0.85, help="Accuracy floor, 0-1.")
+    args = parser.parse_args()
+
+    frames = readFrames(args.video, args.frames, 1)
+    if not frames:
+        raise SystemExit(f"No frames could be read from {args.video}")
+    labelled_images = list_labelled_images(args.images)
+    print(f"{len(frames)} clip frames, {len(labelled_images)} labelled frames")
+
+    results = []
+    for model in args.models:
+        # A low threshold and more results give the full precision/recall curve
+        engine = InferenceEngine(model, None, max(args.threads), 0.05, 10, engine=args.engine)
+        mean_ap, class_aps = evaluate_map(engine, labelled_images, args.iouThreshold)
+        aps = '  '.join(f"{name} {ap * 100:.1f}%" for name, ap in sorted(class_aps.items()))
+        print(f"{model}\n  mAP@{args.iouThreshold:.2f} = {mean_ap * 100:.2f}%  ({aps})")
+
+        for threads in args.threads:
+            # The decision threshold of the app, latency includes post processing
+            engine = InferenceEngine(model, None, threads, 0.3, 3, engine=args.engine)
+            p50, p95 = measure_latency(engine, frames)
+            print(f"  threads = {threads}  p50 = {p50:7.2f} ms  p95 = {p95:7.2f} ms")
+            results.append((p50, p95, model, threads, mean_ap))
+
+    passing = [result for result in results if result[4] >= args.minMap]
+    if not passing:
+        print(f"\nNo model reaches mAP {args.minMap * 100:.1f}%")
+    else:
+        p50, p95, model, threads, mean_ap = min(passing)
+        print(
+            f"\nFastest with mAP >= {args.minMap * 100:.1f}%: {model} with {threads} threads "
+            f"(p50 = {p50:.2f} ms, p95 = {p95:.2f} ms, mAP = {mean_ap * 100:.2f}%)"
+        )
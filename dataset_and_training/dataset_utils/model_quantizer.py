@@ -0,0 +1,128 @@
+import argparse
+import os
+import xml.etree.ElementTree as ET
+import cv2
+import numpy as np
+import tensorflow as tf
+from tflite_support.metadata_writers import object_detector
+from tflite_support.metadata_writers import writer_utils
+
+ObjectDetectorWriter = object_detector.MetadataWriter
+_INPUT_NORM_MEAN = 127.5
+_INPUT_NORM_STD = 127.5
+VARIANTS = ["float32", "float16", "int8"]
+
+
+def list_labelled_images(folder):
+    """
+    List the images of a folder that have a Pascal VOC XML file next to them.
+
+    Args:
+    - folder (str): Folder with .jpg/.png images and their .xml labels.
+
+    Returns:
+    - list: (image path, xml path) pairs, sorted by name.
+    """
+    pairs = []
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith(('.jpg', '.png')):
+            continue
+        xml_path = os.path.join(folder, os.path.splitext(file_name)[0] + '.xml')
+        if os.path.exists(xml_path):
+            pairs.append((os.path.join(folder, file_name), xml_path))
+    return pairs
+
+
+def count_objects(xml_path):
+    return len(ET.parse(xml_path).getroot().findall('object'))
+
+
+def representative_dataset(folder, input_size, samples=200):
+    """
+    Build the calibration generator for post training quantization.
+
+    Frames with labelled lights are used first, so the activation ranges are
+    measured on the scenes the model has to get right.
+    """
+    pairs = list_labelled_images(folder)
+    pairs.sort(key=lambda pair: count_objects(pair[1]), reverse=True)
+    pairs = pairs[:samples]
+    width, height = input_size
+
+    def generator():
+        for image_path, _ in pairs:
+            image = cv2.imread(image_path)
+            if image is None:
+                continue
+            image = cv2.cvtColor(cv2.resize(image, (width, height)), cv2.COLOR_BGR2RGB)
+            image = (image.astype(np.float32) - _INPUT_NORM_MEAN) / _INPUT_NORM_STD
+            yield [image[np.newaxis]]
+
+    return generator
+
+
+def convert(saved_model_dir, variant, images_folder=None, input_size=(320, 320), samples=200):
+    """
+    Convert a TFLite compatible SavedModel (exported with
+    export_tflite_graph_tf2.py) to one model variant.
+
+    Returns:
+    - bytes: The converted model, without metadata.
+    """
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+    if variant == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        if images_folder is None:
+            raise ValueError("int8 quantization needs a folder of labelled frames")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(
+            images_folder, input_size, samples
+        )
+        # The detection post processing op stays in float, everything before
+        # it runs in int8. The input takes raw uint8 pixels like the camera
+        # frames, so no normalization is needed at inference time.
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS,
+        ]
+        converter.inference_input_type = tf.uint8
+    elif variant != "float32":
+        raise ValueError(f"Unknown variant '{variant}', use one of {VARIANTS}")
+    return converter.convert()
+
+
+def save_with_metadata(model_content, label_file, save_to_path):
+    # Same metadata as model_converter.py, the Task Library and the raw
+    # interpreter engine read labels and normalization from it
+    writer = ObjectDetectorWriter.create_for_inference(
+        model_content, [_INPUT_NORM_MEAN], [_INPUT_NORM_STD], [label_file]
+    )
+    writer_utils.save_file(writer.populate(), save_to_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--savedModel", required=True, help="Exported SavedModel folder.")
+    parser.add_argument("--name", required=True, help="Output name, e.g. traffic_19thMar2024.")
+    parser.add_argument("--outputFolder", default=".")
+    parser.add_argument("--labelFile", default="labelmap.txt")
+    parser.add_argument(
+        "--images", default="totalLabelledFrames", help="Labelled frames for calibration."
+    )
+    parser.add_argument("--inputSize", type=int, nargs=2, default=[320, 320])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=VARIANTS)
+    args = parser.parse_args()
+
+    for variant in args.variants:
+        print(f"Converting {variant}...")
+        model_content = convert(
+            args.savedModel, variant, args.images, tuple(args.inputSize), args.samples
+        )
+        save_to_path = os.path.join(args.outputFolder, f"{args.name}_{variant}.tflite")
+        save_with_metadata(model_content, args.labelFile, save_to_path)
+        print(f"Saved {save_to_path} ({os.path.getsize(save_to_path) / 1024 / 1024:.2f} MB)")
@@ -0,0 +1,261 @@
+import logging
+import os
+import cv2
+import numpy as np
+from tflite_support.task import core
+from tflite_support.task import processor
+from tflite_support.task import vision
+from inference.interpreter_detector import InterpreterDetector, createDetectionResult
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+# Every engine takes BGR frames and returns processor.DetectionResult, so
+# DetectionFilter, FinalDecision and utils.visualize work with any of them.
+
+
+class TaskLibraryEngine:
+    # tflite_support's ObjectDetector, the only engine with the Edge TPU delegate
+    def __init__(
+        self,
+        model,
+        categoriesDeniedList=None,
+        threads=2,
+        scoreThreshold=0.5,
+        maxResults=3,
+        batchSize=1,
+        useCoral=False,
+    ) -> None:
+        base_options = core.BaseOptions(
+            file_name=model, use_coral=useCoral, num_threads=threads
+        )
+        detection_options = processor.DetectionOptions(
+            max_results=maxResults,
+            score_threshold=scoreThreshold,
+            category_name_denylist=categoriesDeniedList,
+        )
+        options = vision.ObjectDetectorOptions(
+            base_options=base_options, detection_options=detection_options
+        )
+        self.detector = vision.ObjectDetector.create_from_options(options)
+        self.batchSize = 1
+
+    def detect(self, image: np.ndarray):
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        input_tensor = vision.TensorImage.create_from_array(rgb_image)
+        return self.detector.detect(input_tensor)
+
+    def detectBatch(self, images):
+        return [self.detect(image) for image in images]
+
+
+class TFLiteEngine(InterpreterDetector):
+    # Raw TFLite interpreter with XNNPACK and explicit threads, frames are
+    # resized straight into the input tensor and can be batched
+    def __init__(
+        self,
+        model,
+        categoriesDeniedList=None,
+        threads=2,
+        scoreThreshold=0.5,
+        maxResults=3,
+        batchSize=1,
+        useXnnpack=True,
+    ) -> None:
+        super().__init__(
+            model,
+            threads,
+            scoreThreshold,
+            maxResults,
+            categoriesDeniedList,
+            batchSize,
+            useXnnpack,
+        )
+
+
+class OnnxEngine:
+    # ONNX Runtime on the CPU for a detection model exported with the usual
+    # four outputs (boxes, classes, scores, number of detections). The model
+    # has no TFLite metadata, labels come from a labelmap.txt next to it.
+    def __init__(
+        self,
+        model,
+        categoriesDeniedList=None,
+        threads=2,
+        scoreThreshold=0.5,
+        maxResults=3,
+        batchSize=1,
+        labels=None,
+        inputSize=(320, 320),
+        mean=127.5,
+        std=127.5,
+        classOffset=0,
+    ) -> None:
+        if onnxruntime is None:
+            raise ImportError("Install onnxruntime for the onnx inference engine")
+
+        self.scoreThreshold = scoreThreshold
+        self.maxResults = maxResults
+        self.categoriesDeniedList = set(categoriesDeniedList or [])
+        self.mean = np.float32(mean)
+        self.std = np.float32(std)
+        # Models exported from the TF Object Detection API count from 1
+        self.classOffset = classOffset
+        self.labels = self.loadLabels(
+            labels or os.path.join(os.path.dirname(model), "labelmap.txt")
+        )
+
+        sessionOptions = onnxruntime.SessionOptions()
+        sessionOptions.intra_op_num_threads = threads
+        sessionOptions.inter_op_num_threads = 1
+        sessionOptions.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        sessionOptions.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            model, sessionOptions, providers=["CPUExecutionProvider"]
+        )
+
+        modelInput = self.session.get_inputs()[0]
+        self.inputName = modelInput.name
+        self.isFloat = "float" in modelInput.type
+        shape = modelInput.shape
+        # Dynamic dimensions are strings, channels first models have 3 at axis 1
+        self.channelsFirst = len(shape) == 4 and shape[1] == 3
+        spatial = shape[2:4] if self.channelsFirst else shape[1:3]
+        if all(isinstance(size, int) for size in spatial):
+            self.inputHeight, self.inputWidth = spatial
+        else:
+            self.inputWidth, self.inputHeight = inputSize
+        self.batchSize = batchSize if not isinstance(shape[0], int) else shape[0]
+
+        self.outputNames = self.getOutputNames(
+            [output.name for output in self.session.get_outputs()]
+        )
+        self.imageBuffer = np.empty(
+            (self.batchSize, self.inputHeight, self.inputWidth, 3), dtype=np.uint8
+        )
+
+    @staticmethod
+    def loadLabels(path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as file:
+            return [line.strip() for line in file if line.strip()]
+
+    @staticmethod
+    def getOutputNames(names):
+        keys = {"location": "box", "category": "class", "score": "score"}
+        outputs = {}
+        for key, part in keys.items():
+            matches = [name for name in names if part in name.lower()]
+            if matches:
+                outputs[key] = matches[0]
+        matches = [name for name in names if "num" in name.lower()]
+        if matches:
+            outputs["number of detections"] = matches[0]
+        if len(outputs) == 4:
+            return outputs
+
+        order = ["location", "category", "score", "number of detections"]
+        return dict(zip(order, names))
+
+    def prepareInput(self, images):
+        batch = self.imageBuffer[:len(images)]
+        for buffer, image in zip(batch, images):
+            cv2.resize(
+                image,
+                (self.inputWidth, self.inputHeight),
+                dst=buffer,
+                interpolation=cv2.INTER_LINEAR,
+            )
+            cv2.cvtColor(buffer, cv2.COLOR_BGR2RGB, dst=buffer)
+        if self.isFloat:
+            batch = (batch.astype(np.float32) - self.mean) / self.std
+        if self.channelsFirst:
+            batch = np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+        return batch
+
+    def detectBatch(self, images):
+        results = []
+        outputNames = [
+            self.outputNames[name]
+            for name in ("location", "category", "score", "number of detections")
+        ]
+        for start in range(0, len(images), self.batchSize):
+            batch = images[start:start + self.batchSize]
+            boxes, classes, scores, counts = self.session.run(
+                outputNames, {self.inputName: self.prepareInput(batch)}
+            )
+            for i, image in enumerate(batch):
+                height, width = image.shape[:2]
+                results.append(
+                    createDetectionResult(
+                        boxes[i],
+                        np.asarray(classes[i]) - self.classOffset,
+                        scores[i],
+                        np.ravel(counts[i])[0],
+                        width,
+                        height,
+                        self.labels,
+                        self.scoreThreshold,
+                        self.maxResults,
+                        self.categoriesDeniedList,
+                    )
+                )
+        return results
+
+    def detect(self, image: np.ndarray):
+        return self.detectBatch([image])[0]
+
+
+ENGINES = {
+    "tasklib": TaskLibraryEngine,
+    "tflite": TFLiteEngine,
+    "onnx": OnnxEngine,
+}
+
+
+def createEngine(
+    engine,
+    model,
+    categoriesDeniedList=None,
+    threads=2,
+    scoreThreshold=0.5,
+    maxResults=3,
+    batchSize=1,
+    useCoral=False,
+    engineOptions=None,
+):
+    options = engineOptions or {}
+    if useCoral and engine != "tasklib":
+        print(f"Engine '{engine}' has no Edge TPU delegate, using the Task Library")
+        engine = "tasklib"
+    if engine == "tasklib":
+        options = dict(options, useCoral=useCoral)
+
+    try:
+        return ENGINES[engine](
+            model,
+            categoriesDeniedList,
+            threads,
+            scoreThreshold,
+            maxResults,
+            batchSize,
+            **options,
+        )
+    except (ImportError, ValueError, RuntimeError) as e:
+        # Explicit interpreter options are not swapped for another engine
+        if engine == "tasklib" or model.endswith(".onnx") or not options.get(
+            "useXnnpack", True
+        ):
+            raise
+        # The interpreter is not installed or cannot run the model
+        print(f"Inference engine '{engine}' is not available, using the Task Library: {e}")
+        logging.error(e)
+        return TaskLibraryEngine(
+            model, categoriesDeniedList, threads, scoreThreshold, maxResults
+        )
@@ -4,14 +4,38 @@ from api_server import InferenceData
 import utils.utils as utils
 import threading
 import logging
+from collections import deque
+from dataclasses import dataclass
+import numpy as np
+from input_output.frame_bus import DeliveryPolicy
 from input_output.input_source import InputSource
 from input_output.input_source_process import InputSourceProcess
 from inference.inference_engine import InferenceEngine
+from inference.inference_pipeline import InferencePipeline
+from inference.inference_worker_pool import InferenceWorkerPool
+from inference.inference_scheduler import InferenceScheduler
+from inference.light_tracker import LightTracker
+from inference.roi_tiler import RoiTiler
 from inference.detection_filter import DetectionFilter
 from inference.final_decision import FinalDecision
 from inference.actions import Actions
 
 
+# Seconds without a light before the actions forget the last one
+ACTIONS_WINDOW = 10
+
+
+@dataclass
+class InferenceFrame:
+    image: np.ndarray
+    startTime: float
+    runDetector: bool
+    prepared: np.ndarray = None
+    # Set when a worker process already ran the detector
+    detectionResult: object = None
+    detections: list = None
+
+
 class Inference:
     def __init__(
         self,
@@ -26,6 +50,12 @@ class Inference:
         apiData: InferenceData,
         categoriesDeniedList=None,
         showPreview=True,
+        tiler: RoiTiler = None,
+        scheduler: InferenceScheduler = None,
+        tracker: LightTracker = None,
+        engine: str = "tasklib",
+        pipelined=False,
+        workers: int = 1,
     ) -> None:
 
         self.thread = None
@@ -34,9 +64,40 @@ class Inference:
         self.inputSource = inputSource
         self.showPreview = showPreview
 
-        self.inferenceEngine = InferenceEngine(
-            model, categoriesDeniedList, numThreads, scoreThreshold, maxResults
-        )
+        # Frames from another process are requested, local ones are pushed
+        self.subscription = None
+        if not isinstance(inputSource, InputSourceProcess):
+            self.subscription = inputSource.subscribe(DeliveryPolicy.LATEST_ONLY)
+
+        # With several workers the model only runs in the worker processes,
+        # each with a share of the threads
+        self.inferenceEngine = None
+        self.workerPool = None
+        if workers > 1:
+            self.workerPool = InferenceWorkerPool(
+                workers,
+                inputSource.width,
+                inputSource.height,
+                dict(
+                    model=model,
+                    categoriesDeniedList=categoriesDeniedList,
+                    threads=max(1, numThreads // workers),
+                    scoreThreshold=scoreThreshold,
+                    maxResults=maxResults,
+                    tiler=tiler,
+                    engine=engine,
+                ),
+            )
+        else:
+            self.inferenceEngine = InferenceEngine(
+                model,
+                categoriesDeniedList,
+                numThreads,
+                scoreThreshold,
+                maxResults,
+                tiler=tiler,
+                engine=engine,
+            )
 
         self.detectionFilter = DetectionFilter(
             inputSource.width, inputSource.height, maxAreaDivisor=128
@@ -52,8 +113,34 @@ class Inference:
 
         self.fps = 0
 
+        # Times of the decisions of the last ACTIONS_WINDOW seconds, the actions
+        # keep their state for that long without a light
+        self.decisionTimes = deque()
+
+        # Adaptive rate, when set it replaces the fixed maxFps interval
+        self.scheduler = scheduler
+        self.lastInferenceTime = None
+
+        # Propagates detections between detector keyframes
+        self.tracker = tracker
+
         self.apiData = apiData
 
+        # Capture and preprocessing, detection and the decision on their own
+        # threads, so they overlap instead of adding up
+        self.pipeline = None
+        self.threads = []
+        if pipelined and self.workerPool is None:
+            self.pipeline = InferencePipeline(
+                [
+                    ("capture", self.captureStage),
+                    ("detect", self.detectFrame),
+                    ("decide", self.decideFrame),
+                ],
+                onStop=self.destroyWindow,
+                onError=self.dropFrame,
+            )
+
         pass
 
     def run(self):
@@ -64,20 +151,196 @@ class Inference:
         pass
 
     def infer(self):
+        frame = self.captureFrame()
+        if frame is None:
+            return
+        self.detectFrame(frame)
+        self.decideFrame(frame)
+
+        if self.scheduler:
+            return
+
+        currentTime = time.time()
+        elapsedTime = currentTime - frame.startTime
+        time.sleep(max(0, self.frameInterval - elapsedTime))
+        self.fps = 1 / (time.time() - frame.startTime)
+        pass
+
+    # Fetches the next frame and decides whether the detector runs on it.
+    # Returns None when the frame is skipped.
+    def captureFrame(self):
         startTime = time.time()
-        if isinstance(self.inputSource, InputSourceProcess):
+        if self.subscription is None:
             image = self.inputSource.requestImage()
+            if image is None:
+                return None
         else:
-            image = self.inputSource.getImage()
+            frame = self.subscription.getNextFrame(timeout=1)
+            if frame is None:
+                return None
+            image = frame.image
 
-        self.finalDecision.updateMinCount(int(self.fps))
-        self.actions.updateBufferSize(int(10 * self.fps))
+        # With the pipeline or the worker pool several frames are in flight
+        # before the tracker sees their results
+        scheduleAhead = self.pipeline is not None or self.workerPool is not None
+        if self.tracker is None:
+            runDetector = True
+        elif scheduleAhead:
+            runDetector = self.tracker.scheduleKeyframe()
+        else:
+            runDetector = self.tracker.needsKeyframe()
+        if runDetector and self.scheduler and not self.scheduler.shouldInfer(image):
+            runDetector = False
+            if self.tracker and scheduleAhead:
+                self.tracker.cancelKeyframe()
+            # With tracked lights the decision is still updated from the tracker
+            if self.tracker is None or not self.tracker.hasTracks():
+                if self.subscription is None:
+                    # requestImage() does not wait for a new frame
+                    time.sleep(1 / self.scheduler.maxFps)
+                return None
 
-        detectionResult = self.inferenceEngine.getDetections(image)
+        if self.scheduler:
+            if self.lastInferenceTime is not None:
+                self.fps = 1 / max(1e-6, startTime - self.lastInferenceTime)
+            self.lastInferenceTime = startTime
 
-        detections = self.detectionFilter.filter(detectionResult)
+        return InferenceFrame(image, startTime, runDetector)
 
-        detection = self.finalDecision.getDecision(detections)
+    # Pipelined capture, paced to maxFps and preprocessed for the model while
+    # the detect stage runs the previous frame
+    def captureStage(self, _):
+        if not self.scheduler and self.lastInferenceTime is not None:
+            time.sleep(
+                max(0, self.lastInferenceTime + self.frameInterval - time.time())
+            )
+
+        frame = self.captureFrame()
+        if frame is None:
+            return None
+        if not self.scheduler:
+            if self.lastInferenceTime is not None:
+                self.fps = 1 / max(1e-6, frame.startTime - self.lastInferenceTime)
+            self.lastInferenceTime = frame.startTime
+        if frame.runDetector and self.inferenceEngine:
+            try:
+                frame.prepared = self.inferenceEngine.prepare(frame.image)
+            except Exception:
+                self.dropFrame("capture", frame)
+                raise
+        return frame
+
+    # A frame failed in a stage. Its keyframe never reaches the tracker, so it
+    # is cancelled, otherwise low-confidence tracks stop asking for new ones.
+    def dropFrame(self, name, frame):
+        if (
+            isinstance(frame, InferenceFrame)
+            and frame.runDetector
+            and frame.detections is None
+            and self.tracker
+        ):
+            self.tracker.cancelKeyframe()
+
+    # Feeds the worker pool, submit() blocks while every worker is busy.
+    # Frames for the tracker only keep their place in the order.
+    def submitFrames(self):
+        while not self.stopEvent.is_set():
+            frame = None
+            try:
+                frame = self.captureStage(None)
+                if frame is None:
+                    continue
+                sequence = self.workerPool.submit(
+                    frame.image if frame.runDetector else None, frame, timeout=1
+                )
+                if sequence is None and frame.runDetector and self.tracker:
+                    # Dropped, the keyframe it was counted as never arrives
+                    self.tracker.cancelKeyframe()
+            except RuntimeError as e:
+                # No worker could start or they kept crashing, retrying is pointless
+                utils.playSound("sounds/error.mp3")
+                print(e)
+                logging.error(e)
+                break
+            except Exception as e:
+                utils.playSound("sounds/error.mp3")
+                print(e)
+                logging.error(e)
+                self.dropFrame("submit", frame)
+
+    # Results come back in frame order, so the tracker and FinalDecision see
+    # the same sequence as with a single engine
+    def collectResults(self):
+        while not self.stopEvent.is_set():
+            frame = None
+            try:
+                result = self.workerPool.getResult(timeout=0.5)
+                if result is None:
+                    continue
+                _, frame, frame.detectionResult = result
+                if frame.runDetector and frame.detectionResult is None:
+                    # The worker failed or timed out. That is not a frame
+                    # without lights, the tracks carry on from the last ones.
+                    if self.tracker is None:
+                        continue
+                    self.tracker.cancelKeyframe()
+                    frame.runDetector = False
+                self.detectFrame(frame)
+                self.decideFrame(frame)
+            except Exception as e:
+                utils.playSound("sounds/error.mp3")
+                print(e)
+                logging.error(e)
+                self.dropFrame("detect", frame)
+
+        self.destroyWindow()
+
+    def detectFrame(self, frame: InferenceFrame):
+        if frame.runDetector:
+            detectionResult = frame.detectionResult
+            if detectionResult is None:
+                detectionResult = self.inferenceEngine.getPreparedDetections(
+                    frame.image, frame.prepared
+                )
+
+            detections = self.detectionFilter.filter(detectionResult)
+            if self.scheduler:
+                self.scheduler.reportDetections(detections)
+            if self.tracker:
+                self.tracker.update(detections, frame.image)
+                detections = self.tracker.getDetections()
+        else:
+            self.tracker.propagate(frame.image)
+            detections = self.tracker.getDetections()
+
+        frame.detections = detections
+        return frame
+
+    # Detector runs per second a light is confirmed over. With the scheduler
+    # the interval since the last run swings between bursts and idle, only
+    # the budget is a rate the detector keeps up. With the tracker only every
+    # keyframeInterval-th frame is a detector run, the frames in between
+    # repeat its boxes and must not count as confirmations of their own.
+    def getDetectorFps(self):
+        if self.scheduler:
+            return self.scheduler.budgetFps
+        if self.tracker:
+            return self.fps / self.tracker.keyframeInterval
+        return self.fps
+
+    def decideFrame(self, frame: InferenceFrame):
+        now = time.time()
+        self.decisionTimes.append(now)
+        while now - self.decisionTimes[0] > ACTIONS_WINDOW:
+            self.decisionTimes.popleft()
+
+        detectorFps = self.getDetectorFps()
+        self.finalDecision.updateMinCount(max(1, int(detectorFps)))
+        self.actions.updateBufferSize(
+            max(len(self.decisionTimes), int(ACTIONS_WINDOW * detectorFps))
+        )
+
+        detection = self.finalDecision.getDecision(frame.detections)
         if self.apiData:
             if detection is None:
                 self.apiData.trafficLightColor = None
@@ -86,6 +349,8 @@ class Inference:
                     detection
                 ).category_name
             self.apiData.fps = self.fps
+            if self.pipeline or self.workerPool:
+                self.apiData.stageTimings = self.getStageTimings()
 
         self.actions.act(
             index=(
@@ -94,6 +359,8 @@ class Inference:
         )
 
         if self.showPreview:
+            # Frames are shared with the recorder, draw on a private copy
+            image = frame.image.copy()
             fps_text = "FPS = {:.1f}".format(self.fps)
             utils.putText(image, fps_text, (24, 20))
 
@@ -103,11 +370,8 @@ class Inference:
             cv2.imshow("Inference", image)
             cv2.waitKey(1)
 
-        currentTime = time.time()
-        elapsedTime = currentTime - startTime
-        time.sleep(max(0, self.frameInterval - elapsedTime))
-        self.fps = 1 / (time.time() - startTime)
-        pass
+        # Nothing is passed on, this is the last stage
+        return None
 
     def destroyWindow(self):
         try:
@@ -118,11 +382,36 @@ class Inference:
             print(e)
             logging.error(e)
 
+    def getStageTimings(self):
+        if self.workerPool:
+            return self.workerPool.getStats()
+        return self.pipeline.getStats() if self.pipeline else None
+
     def start(self):
+        if self.workerPool:
+            self.workerPool.start()
+            self.threads = [
+                threading.Thread(target=self.submitFrames),
+                threading.Thread(target=self.collectResults),
+            ]
+            for thread in self.threads:
+                thread.start()
+            return
+        if self.pipeline:
+            self.pipeline.start()
+            return
         self.thread = threading.Thread(target=self.run)
         self.thread.start()
 
     def stop(self):
         self.stopEvent.set()
+        if self.pipeline:
+            self.pipeline.stop()
         if self.thread:
             self.thread.join()
+        for thread in self.threads:
+            thread.join()
+        if self.workerPool:
+            self.workerPool.stop()
+        if self.subscription:
+            self.subscription.unsubscribe()
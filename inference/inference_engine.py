@@ -1,10 +1,6 @@
-from tflite_support.task import core
-from tflite_support.task import processor
-from tflite_support.task import vision
-
-
-import cv2
 import numpy as np
+from inference.detection_engines import createEngine
+from inference.roi_tiler import RoiTiler
 
 
 class InferenceEngine:
@@ -15,23 +11,68 @@ class InferenceEngine:
         threads=2,
         scoreThreshold=0.5,
         maxResults=3,
+        batchSize=None,
+        useCoral=False,
+        tiler: RoiTiler = None,
+        engine: str = "tasklib",
+        engineOptions: dict = None,
     ) -> None:
-        base_options = core.BaseOptions(
-            file_name=model, use_coral=False, num_threads=threads
-        )
-        detection_options = processor.DetectionOptions(
-            max_results=maxResults,
-            score_threshold=scoreThreshold,
-            category_name_denylist=categoriesDeniedList,
-        )
-        options = vision.ObjectDetectorOptions(
-            base_options=base_options, detection_options=detection_options
-        )
+        # The Task Library runs one frame per call, batches need the interpreter
+        if batchSize and batchSize > 1 and engine == "tasklib" and not useCoral:
+            engine = "tflite"
+
         self.model = model
-        self.detector = vision.ObjectDetector.create_from_options(options)
+        self.engine = createEngine(
+            engine,
+            model,
+            categoriesDeniedList,
+            threads,
+            scoreThreshold,
+            maxResults,
+            batchSize or 1,
+            useCoral,
+            engineOptions,
+        )
+        # Detect on a cropped region, optionally split in tiles, instead of the
+        # whole frame
+        self.tiler = tiler
         pass
 
+    def detect(self, image: np.ndarray):
+        return self.engine.detect(image)
+
+    def detectImages(self, images):
+        return self.engine.detectBatch(images)
+
     def getDetections(self, image: np.ndarray):
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        input_tensor = vision.TensorImage.create_from_array(rgb_image)
-        return self.detector.detect(input_tensor)
+        if self.tiler is None:
+            return self.detect(image)
+        return self.tiler.merge(self.detectImages(self.tiler.crop(image)), image)
+
+    # Resizes the frame to the model input ahead of getPreparedDetections, so
+    # it can overlap the previous frame's inference. None when the engine or
+    # the tiler needs the whole frame.
+    def prepare(self, image: np.ndarray):
+        if self.tiler is None and hasattr(self.engine, "prepareImage"):
+            return self.engine.prepareImage(image)
+        return None
+
+    def getPreparedDetections(self, image: np.ndarray, prepared):
+        if prepared is None:
+            return self.getDetections(image)
+        height, width = image.shape[:2]
+        return self.engine.detectPrepared(prepared, width, height)
+
+    # Returns one DetectionResult per frame, with a tiler the tiles of all
+    # frames go through the model together
+    def getDetectionsBatch(self, images):
+        if self.tiler is None:
+            return self.detectImages(images)
+
+        tiles = [self.tiler.crop(image) for image in images]
+        results = self.detectImages([tile for frameTiles in tiles for tile in frameTiles])
+        merged = []
+        for image, frameTiles in zip(images, tiles):
+            merged.append(self.tiler.merge(results[:len(frameTiles)], image))
+            results = results[len(frameTiles):]
+        return merged
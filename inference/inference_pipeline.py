@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+import utils.utils as utils
+
+
+class StageSlot:
+    # Single item handoff between two stages. put() blocks while the slot is
+    # full, so a slow stage holds the ones before it back instead of letting
+    # frames pile up.
+    def __init__(self) -> None:
+        self.item = None
+        self.full = False
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, item) -> bool:
+        with self.condition:
+            self.condition.wait_for(lambda: not self.full or self.closed)
+            if self.closed:
+                return False
+            self.item = item
+            self.full = True
+            self.condition.notify_all()
+            return True
+
+    # Returns None on timeout or once the slot is closed
+    def get(self, timeout: float = None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.full or self.closed, timeout=timeout)
+            if not self.full or self.closed:
+                return None
+            item = self.item
+            self.item = None
+            self.full = False
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class StageTimer:
+    # Smoothed time a stage spends working, waiting for its input and blocked
+    # on a full output slot
+    def __init__(self, smoothing: float = 0.1) -> None:
+        self.smoothing = smoothing
+        self.busyTime = None
+        self.waitTime = None
+        self.blockedTime = None
+        self.frames = 0
+
+    def record(self, waitTime: float, busyTime: float, blockedTime: float = 0):
+        if self.busyTime is None:
+            self.busyTime = busyTime
+            self.waitTime = waitTime
+            self.blockedTime = blockedTime
+        else:
+            self.busyTime += self.smoothing * (busyTime - self.busyTime)
+            self.waitTime += self.smoothing * (waitTime - self.waitTime)
+            self.blockedTime += self.smoothing * (blockedTime - self.blockedTime)
+        self.frames += 1
+
+    def getStats(self):
+        return {
+            "busyMs": round((self.busyTime or 0) * 1000, 2),
+            "waitMs": round((self.waitTime or 0) * 1000, 2),
+            "blockedMs": round((self.blockedTime or 0) * 1000, 2),
+            "frames": self.frames,
+        }
+
+
+class InferencePipeline:
+    # Runs each stage on its own thread. A stage function takes the previous
+    # stage's output (None for the first stage) and returns the item for the
+    # next one, or None to drop the frame. With one slot between stages the
+    # frame rate approaches that of the slowest stage, not the sum of all.
+    # onError(name, item) is called with the input of a stage that raised, so
+    # the owner can undo what it scheduled for that frame.
+    def __init__(self, stages, onStop=None, onError=None, maxBackoff: float = 2.0) -> None:
+        self.stages = stages
+        self.onStop = onStop
+        self.onError = onError
+        self.maxBackoff = maxBackoff
+        self.slots = [StageSlot() for _ in stages[1:]]
+        self.timers = {name: StageTimer() for name, _ in stages}
+        self.stopEvent = threading.Event()
+        self.threads = []
+
+    def runStage(self, index: int):
+        name, function = self.stages[index]
+        inputSlot = self.slots[index - 1] if index > 0 else None
+        outputSlot = self.slots[index] if index < len(self.slots) else None
+        timer = self.timers[name]
+        errors = 0
+
+        try:
+            while not self.stopEvent.is_set():
+                waitStart = time.perf_counter()
+                item = None
+                if inputSlot:
+                    item = inputSlot.get(timeout=0.5)
+                    if item is None:
+                        continue
+                busyStart = time.perf_counter()
+                try:
+                    output = function(item)
+                except Exception as e:
+                    # One sound per run of errors, and a growing pause so a
+                    # stage that keeps failing does not spin
+                    if errors == 0:
+                        utils.playSound("sounds/error.mp3")
+                    errors += 1
+                    print(f"Error in the {name} stage: {e}")
+                    logging.error(f"Error in the {name} stage: {e}")
+                    if self.onError:
+                        self.onError(name, item)
+                    self.stopEvent.wait(min(self.maxBackoff, 0.05 * 2 ** (errors - 1)))
+                    continue
+                errors = 0
+                busyEnd = time.perf_counter()
+                if output is None:
+                    # A first stage without a frame must not count as busy
+                    if inputSlot:
+                        timer.record(busyStart - waitStart, busyEnd - busyStart)
+                    continue
+                if outputSlot and not outputSlot.put(output):
+                    break
+                timer.record(
+                    busyStart - waitStart, busyEnd - busyStart, time.perf_counter() - busyEnd
+                )
+        finally:
+            if outputSlot is None and self.onStop:
+                self.onStop()
+
+    def getStats(self):
+        return {name: timer.getStats() for name, timer in self.timers.items()}
+
+    def start(self):
+        self.stopEvent.clear()
+        self.threads = [
+            threading.Thread(target=self.runStage, args=(index,), name=name)
+            for index, (name, _) in enumerate(self.stages)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        for slot in self.slots:
+            slot.close()
+        for thread in self.threads:
+            thread.join()
+
+
+if __name__ == "__main__":
+    # Three stages of 20, 50 and 10 ms, about 20 fps instead of 12.5
+    def capture(_):
+        time.sleep(0.02)
+        return time.time()
+
+    def infer(item):
+        time.sleep(0.05)
+        return item
+
+    def decide(item):
+        time.sleep(0.01)
+        return item
+
+    pipeline = InferencePipeline([("capture", capture), ("infer", infer), ("decide", decide)])
+    pipeline.start()
+    time.sleep(3)
+    pipeline.stop()
+    stats = pipeline.getStats()
+    print(stats)
+    print(f"Decisions per second: {stats['decide']['frames'] / 3:.1f}")
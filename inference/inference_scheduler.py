@@ -0,0 +1,113 @@
+import time
+import cv2
+import numpy as np
+
+
+class InferenceScheduler:
+    # Decides per frame whether the detector should run. A cheap change signal
+    # (mean difference of tiny grayscale frames) raises the rate while the
+    # scene moves or a light is tracked, and lowers it while parked. Runs are
+    # paid from credits that accrue at budgetFps, so the average rate, and with
+    # it the CPU use, never exceeds the fixed rate it replaces.
+    def __init__(
+        self,
+        budgetFps: float,
+        minFps: float = None,
+        maxFps: float = 10.0,
+        burstSeconds: float = 5.0,
+        changeThreshold: float = 0.02,
+        fullChange: float = 0.1,
+        trackingHoldTime: float = 3.0,
+        signalSize=(32, 18),
+    ) -> None:
+        self.budgetFps = budgetFps
+        self.minFps = minFps if minFps is not None else budgetFps / 4
+        self.maxFps = max(maxFps, budgetFps)
+        self.maxCredits = max(1.0, budgetFps * burstSeconds)
+        self.changeThreshold = changeThreshold
+        self.fullChange = fullChange
+        self.trackingHoldTime = trackingHoldTime
+        self.signalSize = signalSize
+
+        self.credits = self.maxCredits
+        self.lastCreditTime = time.monotonic()
+        self.lastInferenceTime = 0
+        self.lastDetectionTime = 0
+        self.previousSignal = None
+        self.change = 0.0
+
+        # Metrics
+        self.framesSeen = 0
+        self.framesInferred = 0
+
+    # Mean absolute difference to the previous frame, 0 (same) to 1
+    def getChange(self, image: np.ndarray):
+        small = cv2.resize(image, self.signalSize, interpolation=cv2.INTER_AREA)
+        signal = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        previous = self.previousSignal
+        self.previousSignal = signal
+        if previous is None:
+            return 1.0
+        return float(cv2.absdiff(signal, previous).mean()) / 255
+
+    def isTracking(self, now=None):
+        now = time.monotonic() if now is None else now
+        return now - self.lastDetectionTime < self.trackingHoldTime
+
+    def getTargetFps(self, now=None):
+        if self.isTracking(now):
+            return self.maxFps
+        if self.change < self.changeThreshold:
+            return self.minFps
+        # Scale between the budget and the max rate with the amount of change
+        level = min(1.0, (self.change - self.changeThreshold) / self.fullChange)
+        return self.budgetFps + level * (self.maxFps - self.budgetFps)
+
+    def shouldInfer(self, image: np.ndarray):
+        now = time.monotonic()
+        self.framesSeen += 1
+        self.credits = min(
+            self.maxCredits,
+            self.credits + (now - self.lastCreditTime) * self.budgetFps,
+        )
+        self.lastCreditTime = now
+
+        # Smoothed, so a single noisy frame does not trigger a burst
+        self.change = 0.5 * self.change + 0.5 * self.getChange(image)
+
+        if self.credits < 1:
+            return False
+        if now - self.lastInferenceTime < 1 / self.getTargetFps(now):
+            return False
+
+        self.credits -= 1
+        self.lastInferenceTime = now
+        self.framesInferred += 1
+        return True
+
+    def reportDetections(self, detections):
+        if detections:
+            self.lastDetectionTime = time.monotonic()
+
+    def getStats(self):
+        return {
+            "change": self.change,
+            "targetFps": self.getTargetFps(),
+            "credits": self.credits,
+            "tracking": self.isTracking(),
+            "framesSeen": self.framesSeen,
+            "framesInferred": self.framesInferred,
+        }
+
+
+if __name__ == "__main__":
+    scheduler = InferenceScheduler(budgetFps=1.0, maxFps=9.0)
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    startTime = time.time()
+    while time.time() - startTime < 10:
+        # Static for 5 seconds, then a moving scene
+        if time.time() - startTime > 5:
+            frame = np.random.randint(0, 255, frame.shape, dtype=np.uint8)
+        scheduler.shouldInfer(frame)
+        time.sleep(1 / 9)
+    print(scheduler.getStats())
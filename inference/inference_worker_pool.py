@@ -0,0 +1,467 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+from tflite_support.task import processor
+
+
+# Detections cross the process boundary as plain tuples
+def serializeResult(result: processor.DetectionResult):
+    return [
+        (
+            (
+                detection.bounding_box.origin_x,
+                detection.bounding_box.origin_y,
+                detection.bounding_box.width,
+                detection.bounding_box.height,
+            ),
+            [
+                (
+                    category.index,
+                    category.score,
+                    category.display_name,
+                    category.category_name,
+                )
+                for category in detection.categories
+            ],
+        )
+        for detection in result.detections
+    ]
+
+
+def deserializeResult(detections):
+    return processor.DetectionResult(
+        detections=[
+            processor.Detection(
+                bounding_box=processor.BoundingBox(*box),
+                categories=[processor.Category(*category) for category in categories],
+            )
+            for box, categories in detections
+        ]
+    )
+
+
+# Messages on the result queue, as (kind, workerId, sequence, payload)
+STARTED = "started"
+STARTUP_FAILED = "startupFailed"
+DEQUEUED = "dequeued"
+RESULT = "result"
+FAILED = "failed"
+
+
+def runWorker(workerId, engineOptions, memoryName, frameShape, slots, taskQueue, resultQueue):
+    # The engine is created here, the model never crosses the process boundary
+    from inference.inference_engine import InferenceEngine
+
+    sharedMemory = shared_memory.SharedMemory(name=memoryName)
+    frames = np.ndarray((slots,) + frameShape, dtype=np.uint8, buffer=sharedMemory.buf)
+    try:
+        engine = InferenceEngine(**engineOptions)
+    except Exception as e:
+        resultQueue.put((STARTUP_FAILED, workerId, None, str(e)))
+        del frames
+        sharedMemory.close()
+        return
+    resultQueue.put((STARTED, workerId, None, None))
+
+    while True:
+        task = taskQueue.get()
+        if task is None:
+            break
+        sequence, slot = task
+        # The result timeout runs from here, not from submit
+        resultQueue.put((DEQUEUED, workerId, sequence, None))
+        try:
+            detections = serializeResult(engine.getDetections(frames[slot]))
+            resultQueue.put((RESULT, workerId, sequence, detections))
+        except Exception as e:
+            resultQueue.put((FAILED, workerId, sequence, str(e)))
+
+    del frames
+    sharedMemory.close()
+
+
+class InferenceWorkerPool:
+    # Runs InferenceEngine in several processes, so the Python work around each
+    # invoke is not serialized by the GIL. Frames are copied into shared memory
+    # slots, only (sequence, slot) goes through the task queue. Results come
+    # back in submission order through a reorder buffer, frames that fail or
+    # time out come back without a result so the order never stalls.
+    def __init__(
+        self,
+        workers: int,
+        width: int,
+        height: int,
+        engineOptions: dict,
+        slotsPerWorker: int = 2,
+        resultTimeout: float = 5.0,
+        maxRestarts: int = 3,
+        channels: int = 3,
+    ) -> None:
+        self.workers = workers
+        self.engineOptions = engineOptions
+        self.frameShape = (height, width, channels)
+        self.slots = workers * slotsPerWorker
+        self.resultTimeout = resultTimeout
+        self.maxRestarts = maxRestarts
+
+        # Spawned, forking would copy the threads and locks of the app
+        self.context = multiprocessing.get_context("spawn")
+        self.taskQueue = self.context.Queue()
+        self.resultQueue = self.context.Queue()
+        self.processes = []
+        self.sharedMemory = None
+        self.frames = None
+
+        self.condition = threading.Condition()
+        self.freeSlots = deque(range(self.slots))
+        self.nextSequence = 1
+        self.deliverSequence = 1
+        # sequence -> [context, slot, dequeue time, workerId], until delivered
+        self.pending = {}
+        # Reorder buffer, sequence -> DetectionResult (None when not detected
+        # or failed)
+        self.results = {}
+        # Slots of frames that timed out, kept until the late result arrives or
+        # the worker is gone: sequence -> (slot, workerId)
+        self.abandonedSlots = {}
+        # workerId -> sequence it is running
+        self.workerTasks = {}
+        # workerId -> (restarts, time of the next restart)
+        self.restarts = {}
+        self.failedWorkers = set()
+        self.error = None
+        self.stopEvent = threading.Event()
+        self.collector = None
+
+        # Metrics
+        self.framesSubmitted = 0
+        self.framesCompleted = 0
+        self.framesFailed = 0
+        self.workerRestarts = 0
+        self.maxReorderDepth = 0
+
+    def startWorker(self, workerId):
+        process = self.context.Process(
+            target=runWorker,
+            args=(
+                workerId,
+                self.engineOptions,
+                self.sharedMemory.name,
+                self.frameShape,
+                self.slots,
+                self.taskQueue,
+                self.resultQueue,
+            ),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def start(self):
+        frameBytes = int(np.prod(self.frameShape))
+        self.sharedMemory = shared_memory.SharedMemory(
+            create=True, size=frameBytes * self.slots
+        )
+        self.frames = np.ndarray(
+            (self.slots,) + self.frameShape, dtype=np.uint8, buffer=self.sharedMemory.buf
+        )
+        self.stopEvent.clear()
+        self.processes = [self.startWorker(workerId) for workerId in range(self.workers)]
+        self.collector = threading.Thread(target=self.collectResults)
+        self.collector.start()
+
+    # Copies the frame into a free slot and queues it, blocking while every slot
+    # is in use. An image of None reserves a place in the order without running
+    # the model. Returns the sequence, or None on timeout or after stop().
+    # Raises RuntimeError once no worker can run.
+    def submit(self, image: np.ndarray, context=None, timeout: float = None):
+        if image is not None and image.shape != self.frameShape:
+            raise ValueError(f"Expected frames of {self.frameShape}, got {image.shape}")
+
+        with self.condition:
+            if self.error:
+                raise RuntimeError(self.error)
+            if image is None:
+                sequence = self.nextSequence
+                self.nextSequence += 1
+                self.pending[sequence] = [context, None, None, None]
+                self.results[sequence] = None
+                self.condition.notify_all()
+                return sequence
+
+            if not self.condition.wait_for(
+                lambda: self.freeSlots or self.stopEvent.is_set() or self.error,
+                timeout=timeout,
+            ):
+                return None
+            if self.stopEvent.is_set():
+                return None
+            if self.error:
+                raise RuntimeError(self.error)
+            slot = self.freeSlots.popleft()
+            sequence = self.nextSequence
+            self.nextSequence += 1
+
+        # The slot belongs to this call until the task is queued
+        np.copyto(self.frames[slot], image)
+        with self.condition:
+            self.pending[sequence] = [context, slot, None, None]
+            self.framesSubmitted += 1
+        self.taskQueue.put((sequence, slot))
+        return sequence
+
+    # The following methods must be called with the condition held
+
+    def releaseSlot(self, entry):
+        if entry[1] is not None:
+            self.freeSlots.append(entry[1])
+            entry[1] = None
+
+    def failFrame(self, sequence, releaseSlot=True):
+        entry = self.pending.get(sequence)
+        if entry is None or sequence in self.results:
+            return
+        if releaseSlot:
+            self.releaseSlot(entry)
+        elif entry[1] is not None:
+            # A worker may still read the frame, the slot stays reserved
+            self.abandonedSlots[sequence] = (entry[1], entry[3])
+            entry[1] = None
+        self.framesFailed += 1
+        # Not an empty result, no lights seen would end the tracks
+        self.results[sequence] = None
+        self.condition.notify_all()
+
+    def handleMessage(self, kind, workerId, sequence, payload):
+        if kind == STARTED:
+            self.restarts.pop(workerId, None)
+            return
+        if kind == STARTUP_FAILED:
+            # A bad model or a missing runtime fails the same way every time
+            message = f"Inference worker {workerId} failed to start: {payload}"
+            print(message)
+            logging.error(message)
+            self.failedWorkers.add(workerId)
+            if len(self.failedWorkers) == self.workers:
+                self.setError(message)
+            return
+        if kind == DEQUEUED:
+            self.workerTasks[workerId] = sequence
+            entry = self.pending.get(sequence)
+            if entry is not None:
+                entry[2] = time.monotonic()
+                entry[3] = workerId
+            return
+
+        self.workerTasks.pop(workerId, None)
+        abandoned = self.abandonedSlots.pop(sequence, None)
+        if abandoned is not None:
+            # Late result of a frame that already timed out
+            self.freeSlots.append(abandoned[0])
+            self.condition.notify_all()
+            return
+
+        entry = self.pending.get(sequence)
+        if entry is None or sequence in self.results:
+            return
+        if kind == FAILED:
+            message = f"Inference worker {workerId}: {payload}"
+            print(message)
+            logging.error(message)
+            self.failFrame(sequence)
+            return
+        self.releaseSlot(entry)
+        self.framesCompleted += 1
+        self.results[sequence] = deserializeResult(payload)
+        self.maxReorderDepth = max(self.maxReorderDepth, len(self.results))
+        self.condition.notify_all()
+
+    # Fails every undelivered frame, no worker is left to run them
+    def setError(self, message):
+        self.error = message
+        for sequence in list(self.pending):
+            self.failFrame(sequence)
+        self.condition.notify_all()
+
+    def collectResults(self):
+        lastHealthCheck = time.monotonic()
+        while not self.stopEvent.is_set():
+            if time.monotonic() - lastHealthCheck > 1:
+                self.checkWorkers()
+                lastHealthCheck = time.monotonic()
+
+            try:
+                message = self.resultQueue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            with self.condition:
+                self.handleMessage(*message)
+
+    # Restarts crashed workers with a growing delay, up to maxRestarts times
+    def checkWorkers(self):
+        if all(process.is_alive() for process in self.processes):
+            return
+        with self.condition:
+            # Read what the dead workers sent before they exited, a task they
+            # took must be known before their slots are released
+            while True:
+                try:
+                    message = self.resultQueue.get_nowait()
+                except queue.Empty:
+                    break
+                self.handleMessage(*message)
+            now = time.monotonic()
+            for workerId, process in enumerate(self.processes):
+                if process.is_alive() or self.stopEvent.is_set():
+                    continue
+                if workerId in self.failedWorkers:
+                    continue
+
+                # Whatever the dead worker held can be reused
+                sequence = self.workerTasks.pop(workerId, None)
+                if sequence is not None:
+                    self.failFrame(sequence)
+                for sequence, (slot, owner) in list(self.abandonedSlots.items()):
+                    if owner == workerId:
+                        del self.abandonedSlots[sequence]
+                        self.freeSlots.append(slot)
+                        self.condition.notify_all()
+
+                restarts, restartTime = self.restarts.get(workerId, (0, None))
+                if restartTime is None:
+                    if restarts >= self.maxRestarts:
+                        message = (
+                            f"Inference worker {workerId} exited with "
+                            f"{process.exitcode} {restarts} times, giving up"
+                        )
+                        print(message)
+                        logging.error(message)
+                        self.failedWorkers.add(workerId)
+                        if len(self.failedWorkers) == self.workers:
+                            self.setError(message)
+                        continue
+                    self.restarts[workerId] = (restarts, now + 2 ** restarts)
+                    continue
+                if now < restartTime:
+                    continue
+
+                message = f"Inference worker {workerId} exited with {process.exitcode}, restarting"
+                print(message)
+                logging.error(message)
+                self.processes[workerId] = self.startWorker(workerId)
+                self.restarts[workerId] = (restarts + 1, None)
+                self.workerRestarts += 1
+
+    # Returns (sequence, context, DetectionResult) of the next frame in
+    # submission order, None on timeout. The result is None for frames that
+    # were submitted without an image and for frames that failed or timed out.
+    def getResult(self, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while not self.stopEvent.is_set():
+                sequence = self.deliverSequence
+                if sequence in self.results:
+                    result = self.results.pop(sequence)
+                    context = self.pending.pop(sequence)[0]
+                    self.deliverSequence += 1
+                    return sequence, context, result
+
+                now = time.monotonic()
+                entry = self.pending.get(sequence)
+                if (
+                    entry is not None
+                    and entry[2] is not None
+                    and now - entry[2] > self.resultTimeout
+                ):
+                    # The worker hangs, give up on this frame but keep its slot
+                    # until the worker answers or is gone
+                    logging.error(f"Inference of frame {sequence} timed out")
+                    self.failFrame(sequence, releaseSlot=False)
+                    continue
+
+                if deadline is not None and now >= deadline:
+                    return None
+                waitTime = 0.1 if deadline is None else min(0.1, deadline - now)
+                self.condition.wait(waitTime)
+        return None
+
+    def getStats(self):
+        with self.condition:
+            return {
+                "workers": self.workers,
+                "workersAlive": sum(process.is_alive() for process in self.processes),
+                "failedWorkers": len(self.failedWorkers),
+                "inFlight": len(self.pending),
+                "freeSlots": len(self.freeSlots),
+                "abandonedSlots": len(self.abandonedSlots),
+                "reorderDepth": len(self.results),
+                "maxReorderDepth": self.maxReorderDepth,
+                "framesSubmitted": self.framesSubmitted,
+                "framesCompleted": self.framesCompleted,
+                "framesFailed": self.framesFailed,
+                "workerRestarts": self.workerRestarts,
+                "error": self.error,
+            }
+
+    def stop(self):
+        self.stopEvent.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.collector:
+            self.collector.join()
+        for _ in self.processes:
+            self.taskQueue.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+        self.frames = None
+        if self.sharedMemory:
+            self.sharedMemory.close()
+            self.sharedMemory.unlink()
+            self.sharedMemory = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    pool = InferenceWorkerPool(
+        args.workers, 1280, 720, dict(model=args.model, threads=1, scoreThreshold=0.3)
+    )
+    pool.start()
+    frame = np.random.randint(0, 255, (720, 1280, 3), dtype=np.uint8)
+    startTime = time.time()
+    delivered = []
+
+    def collect():
+        while len(delivered) < args.frames:
+            result = pool.getResult(timeout=10)
+            if result is None:
+                break
+            delivered.append(result[0])
+
+    collector = threading.Thread(target=collect)
+    collector.start()
+    for _ in range(args.frames):
+        pool.submit(frame)
+    collector.join()
+    elapsed = time.time() - startTime
+    print(f"{len(delivered)} frames in {elapsed:.2f}s ({len(delivered) / elapsed:.1f} fps)")
+    print(f"In order: {delivered == sorted(delivered)}")
+    print(pool.getStats())
+    pool.stop()
@@ -0,0 +1,288 @@
+import json
+import cv2
+import numpy as np
+from tflite_support import metadata
+from tflite_support.task import processor
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    try:
+        from tensorflow.lite import Interpreter
+    except ImportError:
+        Interpreter = None
+
+try:
+    from tflite_runtime.interpreter import OpResolverType
+except ImportError:
+    try:
+        from tensorflow.lite.experimental import OpResolverType
+    except ImportError:
+        OpResolverType = None
+
+# One frame being prepared, one waiting and one in the interpreter
+PREPARED_BUFFERS = 3
+
+
+# Turns SSD style outputs (normalized ymin, xmin, ymax, xmax boxes) into the
+# DetectionResult the Task Library returns
+def createDetectionResult(
+    boxes,
+    classes,
+    scores,
+    count,
+    width,
+    height,
+    labels,
+    scoreThreshold,
+    maxResults,
+    categoriesDeniedList=(),
+):
+    detections = []
+    for i in range(int(count)):
+        score = float(scores[i])
+        if score < scoreThreshold:
+            continue
+        index = int(classes[i])
+        name = labels[index] if index < len(labels) else str(index)
+        if name in categoriesDeniedList:
+            continue
+
+        ymin, xmin, ymax, xmax = np.clip(boxes[i], 0, 1)
+        detections.append(
+            processor.Detection(
+                bounding_box=processor.BoundingBox(
+                    int(xmin * width),
+                    int(ymin * height),
+                    int((xmax - xmin) * width),
+                    int((ymax - ymin) * height),
+                ),
+                categories=[processor.Category(index, score, "", name)],
+            )
+        )
+        if len(detections) == maxResults:
+            break
+    return processor.DetectionResult(detections=detections)
+
+
+class InterpreterDetector:
+    # Runs an SSD style detection model (with the TFLite_Detection_PostProcess
+    # op) on the raw interpreter, so several frames can go through one invoke.
+    # Labels and input normalization are read from the model metadata, results
+    # match what the Task Library ObjectDetector returns.
+    def __init__(
+        self,
+        model,
+        threads=2,
+        scoreThreshold=0.5,
+        maxResults=3,
+        categoriesDeniedList=None,
+        batchSize=8,
+        useXnnpack=True,
+    ) -> None:
+        if Interpreter is None:
+            raise ImportError("Install tflite-runtime or tensorflow for batched inference")
+
+        self.model = model
+        self.scoreThreshold = scoreThreshold
+        self.maxResults = maxResults
+        self.categoriesDeniedList = set(categoriesDeniedList or [])
+
+        displayer = metadata.MetadataDisplayer.with_model_file(model)
+        modelMetadata = json.loads(displayer.get_metadata_json())
+        subgraph = modelMetadata["subgraph_metadata"][0]
+        self.labels = self.loadLabels(displayer)
+        self.mean, self.std = self.getNormalization(subgraph)
+        outputNames = [
+            tensor.get("name", "") for tensor in subgraph.get("output_tensor_metadata", [])
+        ]
+
+        self.interpreter = self.createInterpreter(model, threads, useXnnpack)
+        inputDetails = self.interpreter.get_input_details()[0]
+        self.inputIndex = inputDetails["index"]
+        self.inputDtype = inputDetails["dtype"]
+        _, self.inputHeight, self.inputWidth, _ = inputDetails["shape"]
+
+        self.batchSize = self.allocate(batchSize)
+        self.outputIndices = self.getOutputIndices(outputNames)
+
+        # uint8 models get frames resized straight into the interpreter's input
+        # tensor. Float models need a small staging buffer for normalization.
+        self.imageBuffer = None
+        if self.inputDtype != np.uint8:
+            self.imageBuffer = np.empty(
+                (self.batchSize, self.inputHeight, self.inputWidth, 3), dtype=np.uint8
+            )
+        self.preparedBuffers = np.empty(
+            (PREPARED_BUFFERS, self.inputHeight, self.inputWidth, 3), dtype=np.uint8
+        )
+        self.preparedIndex = 0
+
+    # XNNPACK is TFLite's default CPU delegate for float models, it uses the
+    # same num_threads. Without it every op runs on the reference kernels.
+    @staticmethod
+    def createInterpreter(model, threads, useXnnpack=True):
+        if useXnnpack:
+            return Interpreter(model_path=model, num_threads=threads)
+        if OpResolverType is None:
+            # Quietly keeping XNNPACK would make a comparison meaningless
+            raise RuntimeError(
+                "This TFLite runtime cannot disable XNNPACK (no OpResolverType)"
+            )
+        return Interpreter(
+            model_path=model,
+            num_threads=threads,
+            experimental_op_resolver_type=OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES,
+        )
+
+    @staticmethod
+    def loadLabels(displayer):
+        for fileName in displayer.get_packed_associated_file_list():
+            if fileName.endswith(".txt"):
+                content = displayer.get_associated_file_buffer(fileName).decode()
+                return [line.strip() for line in content.splitlines() if line.strip()]
+        return []
+
+    @staticmethod
+    def getNormalization(subgraph):
+        inputMetadata = subgraph["input_tensor_metadata"][0]
+        for unit in inputMetadata.get("process_units", []):
+            if unit.get("options_type") == "NormalizationOptions":
+                options = unit["options"]
+                return (
+                    np.array(options["mean"], dtype=np.float32),
+                    np.array(options["std"], dtype=np.float32),
+                )
+        return np.float32(127.5), np.float32(127.5)
+
+    # Tries to give the input a batch dimension, returns the batch size that
+    # the model accepts. Many detection models only run with a batch of 1.
+    def allocate(self, batchSize):
+        if batchSize > 1:
+            try:
+                self.interpreter.resize_tensor_input(
+                    self.inputIndex, [batchSize, self.inputHeight, self.inputWidth, 3]
+                )
+                self.interpreter.allocate_tensors()
+                self.interpreter.set_tensor(
+                    self.inputIndex,
+                    np.zeros(
+                        (batchSize, self.inputHeight, self.inputWidth, 3),
+                        dtype=self.inputDtype,
+                    ),
+                )
+                self.interpreter.invoke()
+                return batchSize
+            except (RuntimeError, ValueError) as e:
+                print(f"Model does not support a batch of {batchSize}, using 1: {e}")
+
+        self.interpreter.resize_tensor_input(
+            self.inputIndex, [1, self.inputHeight, self.inputWidth, 3]
+        )
+        self.interpreter.allocate_tensors()
+        return 1
+
+    def getOutputIndices(self, outputNames):
+        details = self.interpreter.get_output_details()
+        indices = {}
+        # The metadata lists the outputs in tensor order
+        for name, detail in zip(outputNames, details):
+            if name in ("location", "category", "score", "number of detections"):
+                indices[name] = detail["index"]
+        if len(indices) == 4:
+            return indices
+
+        # Without metadata fall back to the usual SSD output order
+        names = ["location", "category", "score", "number of detections"]
+        return {name: detail["index"] for name, detail in zip(names, details)}
+
+    # Resizes first and swaps BGR to RGB on the small image, nothing the size
+    # of a frame is allocated
+    def resizeInto(self, image: np.ndarray, buffer: np.ndarray):
+        cv2.resize(
+            image,
+            (self.inputWidth, self.inputHeight),
+            dst=buffer,
+            interpolation=cv2.INTER_LINEAR,
+        )
+        cv2.cvtColor(buffer, cv2.COLOR_BGR2RGB, dst=buffer)
+
+    def prepareInput(self, images):
+        # A view of the interpreter's input tensor, it must not be kept past
+        # this call because invoke() may move the tensor
+        inputTensor = self.interpreter.tensor(self.inputIndex)()
+        if self.imageBuffer is None:
+            for i, image in enumerate(images):
+                self.resizeInto(image, inputTensor[i])
+            return
+
+        for i, image in enumerate(images):
+            self.resizeInto(image, self.imageBuffer[i])
+        np.subtract(self.imageBuffer, self.mean, out=inputTensor)
+        np.divide(inputTensor, self.std, out=inputTensor)
+
+    def createResult(self, boxes, classes, scores, count, width, height):
+        return createDetectionResult(
+            boxes,
+            classes,
+            scores,
+            count,
+            width,
+            height,
+            self.labels,
+            self.scoreThreshold,
+            self.maxResults,
+            self.categoriesDeniedList,
+        )
+
+    # Reads the outputs of the last invoke, one DetectionResult per frame size
+    def readResults(self, sizes):
+        boxes = self.interpreter.get_tensor(self.outputIndices["location"])
+        classes = self.interpreter.get_tensor(self.outputIndices["category"])
+        scores = self.interpreter.get_tensor(self.outputIndices["score"])
+        counts = self.interpreter.get_tensor(self.outputIndices["number of detections"])
+        return [
+            self.createResult(boxes[i], classes[i], scores[i], counts[i], width, height)
+            for i, (width, height) in enumerate(sizes)
+        ]
+
+    # Takes a list of BGR frames (or an array with a leading frame axis) and
+    # returns one DetectionResult per frame
+    def detectBatch(self, images):
+        results = []
+        for start in range(0, len(images), self.batchSize):
+            batch = images[start:start + self.batchSize]
+            # Unused slots of a short last batch keep their old contents, their
+            # results are ignored
+            self.prepareInput(batch)
+            self.interpreter.invoke()
+            results += self.readResults(
+                [(image.shape[1], image.shape[0]) for image in batch]
+            )
+        return results
+
+    def detect(self, image: np.ndarray):
+        return self.detectBatch([image])[0]
+
+    # Resizes a frame into the next staging buffer without touching the
+    # interpreter, so a pipeline can prepare one frame while another runs.
+    # Buffers are reused in turn, at most PREPARED_BUFFERS may be in use.
+    def prepareImage(self, image: np.ndarray):
+        buffer = self.preparedBuffers[self.preparedIndex]
+        self.preparedIndex = (self.preparedIndex + 1) % PREPARED_BUFFERS
+        self.resizeInto(image, buffer)
+        return buffer
+
+    # Like prepareInput, the tensor view must be gone before invoke()
+    def copyPrepared(self, prepared: np.ndarray):
+        inputTensor = self.interpreter.tensor(self.inputIndex)()
+        if self.imageBuffer is None:
+            np.copyto(inputTensor[0], prepared)
+        else:
+            np.subtract(prepared, self.mean, out=inputTensor[0])
+            np.divide(inputTensor[0], self.std, out=inputTensor[0])
+
+    def detectPrepared(self, prepared: np.ndarray, width, height):
+        self.copyPrepared(prepared)
+        self.interpreter.invoke()
+        return self.readResults([(width, height)])[0]
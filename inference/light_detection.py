@@ -4,6 +4,7 @@ import time
 import cv2
 import numpy as np
 from api_server import LightMode, LightModeData
+from input_output.frame_bus import DeliveryPolicy
 from input_output.input_source import InputSource
 
 log = logging.getLogger("werkzeug")
@@ -22,6 +23,7 @@ class LightDetection:
         self.thread = None
         self.refreshInterval = 1 / fps
         self.inputSource = inputSource
+        self.subscription = None
         self.stopEvent = threading.Event()
         self.thresholdBrightnessDark = thresholdBrightnessDark
         self.thresholdBrightnessLight = thresholdBrightnessLight
@@ -32,8 +34,12 @@ class LightDetection:
     def detect(self):
         try:
             while not self.stopEvent.is_set():
-                image = self.inputSource.getImage()
-                grayImage = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                frame = self.subscription.getNextFrame(timeout=self.refreshInterval)
+                if frame is None:
+                    if self.subscription.closed:
+                        break
+                    continue
+                grayImage = cv2.cvtColor(frame.image, cv2.COLOR_BGR2GRAY)
                 averageBrightness = np.mean(grayImage)
                 if (
                     self.lightMode == LightMode.DARK.value
@@ -54,10 +60,13 @@ class LightDetection:
             self.stopEvent.set()
 
     def start(self):
+        self.subscription = self.inputSource.subscribe(DeliveryPolicy.LATEST_ONLY)
         self.thread = threading.Thread(target=self.detect)
         self.thread.start()
 
     def stop(self):
         self.stopEvent.set()
+        if self.subscription:
+            self.subscription.unsubscribe()
         if self.thread:
             self.thread.join()
@@ -0,0 +1,260 @@
+import threading
+import cv2
+import numpy as np
+from tflite_support.task import processor
+from inference.roi_tiler import RoiTiler
+
+# Hue ranges of the lamp colours on OpenCV's 0-180 hue scale
+HUE_RANGES = {
+    "red": [(0, 10), (160, 180)],
+    "yellow": [(15, 35)],
+    "green": [(40, 95)],
+}
+
+
+def classifyColor(crop: np.ndarray, minLitFraction: float = 0.05):
+    # Returns (colour, confidence) from the hue histogram of the bright,
+    # saturated pixels in the crop, (None, 0) when no lamp looks lit
+    if crop.size == 0:
+        return None, 0.0
+    hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+    lit = cv2.inRange(hsv, (0, 90, 150), (180, 255, 255))
+    litCount = cv2.countNonZero(lit)
+    if litCount < minLitFraction * lit.size:
+        return None, 0.0
+
+    histogram = cv2.calcHist([hsv], [0], lit, [180], [0, 180]).ravel()
+    counts = {
+        color: sum(histogram[low:high].sum() for low, high in ranges)
+        for color, ranges in HUE_RANGES.items()
+    }
+    color = max(counts, key=counts.get)
+    return color, float(counts[color] / litCount)
+
+
+class Track:
+    def __init__(self, box, category: processor.Category) -> None:
+        self.box = np.array(box, dtype=np.float32)  # x, y, width, height
+        self.velocity = np.zeros(2, dtype=np.float32)
+        self.category = category
+        self.hits = 1
+        self.misses = 0
+        self.confidence = 1.0
+        self.framesSinceUpdate = 0
+
+    def getBoundingBox(self):
+        x, y, w, h = self.box
+        return processor.BoundingBox(int(x), int(y), int(w), int(h))
+
+
+class LightTracker:
+    # Carries detector boxes between keyframes. Boxes are moved with sparse
+    # optical flow and their colour is re-read from the HSV histogram of the
+    # crop every frame, so a light switching colour is seen before the next
+    # detector run. The detector runs every keyframeInterval frames, or sooner
+    # when a track loses confidence.
+    def __init__(
+        self,
+        keyframeInterval: int = 5,
+        iouThreshold: float = 0.3,
+        minConfidence: float = 0.5,
+        confidenceDecay: float = 0.95,
+        maxMisses: int = 2,
+        minColorConfidence: float = 0.6,
+        categoryIndices: dict = None,
+    ) -> None:
+        self.keyframeInterval = keyframeInterval
+        self.iouThreshold = iouThreshold
+        self.minConfidence = minConfidence
+        self.confidenceDecay = confidenceDecay
+        self.maxMisses = maxMisses
+        self.minColorConfidence = minColorConfidence
+
+        self.tracks = []
+        # Label name -> index, completed from the detector's categories
+        self.categoryIndices = dict(categoryIndices or {})
+        # Label name -> display name, as the detector reports it
+        self.displayNames = {}
+        self.previousGray = None
+        self.framesSinceKeyframe = None
+        # Keyframes decided on frames ahead of the results, see scheduleKeyframe()
+        self.scheduledSinceKeyframe = None
+        self.keyframesInFlight = 0
+        # The pipelined inference checks for keyframes on the capture thread
+        # while the detect thread updates the tracks
+        self.lock = threading.Lock()
+
+    def hasTracks(self):
+        with self.lock:
+            return len(self.tracks) > 0
+
+    def needsKeyframe(self):
+        with self.lock:
+            if self.framesSinceKeyframe is None:
+                return True
+            if self.framesSinceKeyframe + 1 >= self.keyframeInterval:
+                return True
+            return any(track.confidence < self.minConfidence for track in self.tracks)
+
+    # needsKeyframe() for frames that are decided before the previous ones
+    # reach the tracker, as with the pipeline or the worker pool. Counts the
+    # frames scheduled instead of the frames applied, and a track losing
+    # confidence only asks for a keyframe when none is already on its way.
+    def scheduleKeyframe(self):
+        with self.lock:
+            due = (
+                self.scheduledSinceKeyframe is None
+                or self.scheduledSinceKeyframe + 1 >= self.keyframeInterval
+                or (
+                    self.keyframesInFlight == 0
+                    and any(track.confidence < self.minConfidence for track in self.tracks)
+                )
+            )
+            if due:
+                self.scheduledSinceKeyframe = 0
+                self.keyframesInFlight += 1
+            else:
+                self.scheduledSinceKeyframe += 1
+            return due
+
+    # The scheduled keyframe was not run, the next frame asks again
+    def cancelKeyframe(self):
+        with self.lock:
+            self.keyframesInFlight = max(0, self.keyframesInFlight - 1)
+            self.scheduledSinceKeyframe = self.keyframeInterval - 1
+
+    def update(self, detections, image: np.ndarray):
+        with self.lock:
+            self.updateTracks(detections, image)
+
+    def updateTracks(self, detections, image: np.ndarray):
+        for detection in detections:
+            category = detection.categories[0]
+            self.categoryIndices[category.category_name] = category.index
+            self.displayNames[category.category_name] = category.display_name
+
+        pairs = []
+        for trackIndex, track in enumerate(self.tracks):
+            for detectionIndex, detection in enumerate(detections):
+                iou = RoiTiler.getIoU(track.getBoundingBox(), detection.bounding_box)
+                if iou >= self.iouThreshold:
+                    pairs.append((iou, trackIndex, detectionIndex))
+
+        matchedTracks = set()
+        matchedDetections = set()
+        for _, trackIndex, detectionIndex in sorted(pairs, reverse=True):
+            if trackIndex in matchedTracks or detectionIndex in matchedDetections:
+                continue
+            matchedTracks.add(trackIndex)
+            matchedDetections.add(detectionIndex)
+
+            track = self.tracks[trackIndex]
+            box = detections[detectionIndex].bounding_box
+            newBox = np.array(
+                [box.origin_x, box.origin_y, box.width, box.height], dtype=np.float32
+            )
+            frames = max(1, track.framesSinceUpdate)
+            track.velocity = (newBox[:2] - track.box[:2]) / frames
+            track.box = newBox
+            track.category = detections[detectionIndex].categories[0]
+            track.hits += 1
+            track.misses = 0
+            track.confidence = 1.0
+            track.framesSinceUpdate = 0
+
+        tracks = []
+        for trackIndex, track in enumerate(self.tracks):
+            if trackIndex not in matchedTracks:
+                track.misses += 1
+                track.confidence *= 0.5
+                if track.misses > self.maxMisses:
+                    continue
+            tracks.append(track)
+
+        for detectionIndex, detection in enumerate(detections):
+            if detectionIndex not in matchedDetections:
+                box = detection.bounding_box
+                tracks.append(
+                    Track(
+                        (box.origin_x, box.origin_y, box.width, box.height),
+                        detection.categories[0],
+                    )
+                )
+
+        self.tracks = tracks
+        self.previousGray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        self.framesSinceKeyframe = 0
+        self.keyframesInFlight = max(0, self.keyframesInFlight - 1)
+
+    def getFlowPoints(self, track: Track):
+        x, y, w, h = track.box
+        xs = np.linspace(x + w * 0.2, x + w * 0.8, 3)
+        ys = np.linspace(y + h * 0.2, y + h * 0.8, 3)
+        return np.array(
+            [[px, py] for py in ys for px in xs], dtype=np.float32
+        ).reshape(-1, 1, 2)
+
+    def propagate(self, image: np.ndarray):
+        with self.lock:
+            self.propagateTracks(image)
+
+    def propagateTracks(self, image: np.ndarray):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+        if self.framesSinceKeyframe is not None:
+            self.framesSinceKeyframe += 1
+
+        for track in self.tracks:
+            track.framesSinceUpdate += 1
+            shift = track.velocity
+            if self.previousGray is not None:
+                points = self.getFlowPoints(track)
+                newPoints, status, _ = cv2.calcOpticalFlowPyrLK(
+                    self.previousGray, gray, points, None, winSize=(15, 15), maxLevel=2
+                )
+                good = status.ravel() == 1
+                if good.mean() >= 0.5:
+                    shift = np.median((newPoints - points).reshape(-1, 2)[good], axis=0)
+                else:
+                    track.confidence *= 0.5
+
+            track.box[:2] += shift
+            track.box[0] = np.clip(track.box[0], 0, max(0, width - track.box[2]))
+            track.box[1] = np.clip(track.box[1], 0, max(0, height - track.box[3]))
+            track.confidence *= self.confidenceDecay
+
+            x, y, w, h = track.box.astype(int)
+            color, colorConfidence = classifyColor(image[y:y + h, x:x + w])
+            if color is None or colorConfidence < self.minColorConfidence:
+                track.confidence *= self.confidenceDecay
+            elif color != track.category.category_name and color in self.categoryIndices:
+                # The light changed colour since the last detector run
+                track.category = processor.Category(
+                    self.categoryIndices[color],
+                    track.category.score * colorConfidence,
+                    self.displayNames.get(color, ""),
+                    color,
+                )
+
+        self.previousGray = gray
+
+    def getDetections(self):
+        with self.lock:
+            return self.getTrackDetections()
+
+    def getTrackDetections(self):
+        return [
+            processor.Detection(
+                bounding_box=track.getBoundingBox(),
+                categories=[
+                    processor.Category(
+                        track.category.index,
+                        track.category.score * track.confidence,
+                        track.category.display_name,
+                        track.category.category_name,
+                    )
+                ],
+            )
+            for track in self.tracks
+            if track.misses == 0 and track.confidence >= self.minConfidence / 2
+        ]
@@ -0,0 +1,196 @@
+import numpy as np
+from tflite_support.task import processor
+
+
+class RoiTiler:
+    # Crops a region of interest out of the frame and optionally splits it into
+    # overlapping tiles. Each tile is detected on its own, so small, distant
+    # lights keep more pixels after the model's downscale. The roi is given as
+    # fractions of the frame: (x, y, width, height).
+    def __init__(
+        self,
+        roi=(0.0, 0.0, 1.0, 0.5),
+        tileColumns: int = 1,
+        tileRows: int = 1,
+        overlap: float = 0.2,
+        iouThreshold: float = 0.5,
+        maxResults: int = 3,
+        edgeMargin: int = 4,
+    ) -> None:
+        self.roi = roi
+        self.tileColumns = tileColumns
+        self.tileRows = tileRows
+        self.overlap = overlap
+        self.iouThreshold = iouThreshold
+        self.maxResults = maxResults
+        # Pixels from a tile edge within which a box counts as cut by it
+        self.edgeMargin = edgeMargin
+        self.tiles = None
+        self.frameSize = None
+
+    @staticmethod
+    def splitAxis(start, length, count, overlap):
+        if count <= 1:
+            return [(start, length)]
+        # count tiles of equal size, neighbours share `overlap` of a tile
+        size = int(round(length / (count - (count - 1) * overlap)))
+        step = (length - size) / (count - 1)
+        return [(start + int(round(i * step)), size) for i in range(count)]
+
+    # Returns (x, y, width, height) of every tile in pixels, cached per frame size
+    def getTiles(self, width, height):
+        if self.frameSize == (width, height):
+            return self.tiles
+
+        roiX, roiY, roiWidth, roiHeight = self.roi
+        x = int(roiX * width)
+        y = int(roiY * height)
+        w = min(width - x, int(roiWidth * width))
+        h = min(height - y, int(roiHeight * height))
+
+        columns = self.splitAxis(x, w, self.tileColumns, self.overlap)
+        rows = self.splitAxis(y, h, self.tileRows, self.overlap)
+        self.tiles = [
+            (tileX, tileY, tileWidth, tileHeight)
+            for tileY, tileHeight in rows
+            for tileX, tileWidth in columns
+        ]
+        self.frameSize = (width, height)
+        return self.tiles
+
+    # Views into the frame, nothing is copied
+    def crop(self, image: np.ndarray):
+        height, width = image.shape[:2]
+        return [
+            image[y:y + h, x:x + w] for x, y, w, h in self.getTiles(width, height)
+        ]
+
+    def getPixelCount(self, width, height):
+        return sum(w * h for _, _, w, h in self.getTiles(width, height))
+
+    @staticmethod
+    def getIoU(a: processor.BoundingBox, b: processor.BoundingBox):
+        x1 = max(a.origin_x, b.origin_x)
+        y1 = max(a.origin_y, b.origin_y)
+        x2 = min(a.origin_x + a.width, b.origin_x + b.width)
+        y2 = min(a.origin_y + a.height, b.origin_y + b.height)
+        intersection = max(0, x2 - x1) * max(0, y2 - y1)
+        union = a.width * a.height + b.width * b.height - intersection
+        return intersection / union if union > 0 else 0
+
+    # True when the box ends at an edge of its tile that lies inside the roi,
+    # i.e. the object may continue in the neighbouring tile
+    def isCut(self, box: processor.BoundingBox, tile, tiles):
+        x, y, w, h = tile
+        roiLeft = min(t[0] for t in tiles)
+        roiTop = min(t[1] for t in tiles)
+        roiRight = max(t[0] + t[2] for t in tiles)
+        roiBottom = max(t[1] + t[3] for t in tiles)
+        margin = self.edgeMargin
+        return (
+            (x > roiLeft and box.origin_x - x <= margin)
+            or (y > roiTop and box.origin_y - y <= margin)
+            or (x + w < roiRight and x + w - (box.origin_x + box.width) <= margin)
+            or (y + h < roiBottom and y + h - (box.origin_y + box.height) <= margin)
+        )
+
+    # Boxes that touch (within edgeMargin) and line up along one axis
+    def areJoinable(self, a: processor.BoundingBox, b: processor.BoundingBox):
+        margin = self.edgeMargin
+        spans = []
+        for startA, lengthA, startB, lengthB in (
+            (a.origin_x, a.width, b.origin_x, b.width),
+            (a.origin_y, a.height, b.origin_y, b.height),
+        ):
+            overlap = min(startA + lengthA, startB + lengthB) - max(startA, startB)
+            if overlap < -margin:
+                return False
+            spans.append(overlap / max(1, min(lengthA, lengthB)))
+        return max(spans) >= 0.5
+
+    @staticmethod
+    def getUnion(a: processor.BoundingBox, b: processor.BoundingBox):
+        x1 = min(a.origin_x, b.origin_x)
+        y1 = min(a.origin_y, b.origin_y)
+        x2 = max(a.origin_x + a.width, b.origin_x + b.width)
+        y2 = max(a.origin_y + a.height, b.origin_y + b.height)
+        return processor.BoundingBox(x1, y1, x2 - x1, y2 - y1)
+
+    # A light cut by a tile edge comes back as a partial box from each tile,
+    # too different from each other for the IoU test. Boxes of one class from
+    # different tiles that meet at a cut are replaced by their union.
+    def joinCutBoxes(self, entries):
+        joined = True
+        while joined:
+            joined = False
+            for i, (a, tilesA, cutA) in enumerate(entries):
+                for j in range(i + 1, len(entries)):
+                    b, tilesB, cutB = entries[j]
+                    if (
+                        (cutA or cutB)
+                        and not tilesA & tilesB
+                        and a.categories[0].index == b.categories[0].index
+                        and self.areJoinable(a.bounding_box, b.bounding_box)
+                    ):
+                        best = a if a.categories[0].score >= b.categories[0].score else b
+                        entries[i] = (
+                            processor.Detection(
+                                bounding_box=self.getUnion(a.bounding_box, b.bounding_box),
+                                categories=best.categories,
+                            ),
+                            tilesA | tilesB,
+                            cutA and cutB,
+                        )
+                        del entries[j]
+                        joined = True
+                        break
+                if joined:
+                    break
+        return [detection for detection, _, _ in entries]
+
+    # Moves tile detections to frame coordinates, joins lights cut by a tile
+    # edge and removes the duplicates found in overlapping tiles with a per
+    # class non-maximum suppression
+    def merge(self, tileResults, image: np.ndarray):
+        height, width = image.shape[:2]
+        tiles = self.getTiles(width, height)
+        entries = []
+        for index, (tile, result) in enumerate(zip(tiles, tileResults)):
+            x, y, _, _ = tile
+            for detection in result.detections:
+                box = detection.bounding_box
+                box = processor.BoundingBox(
+                    box.origin_x + x, box.origin_y + y, box.width, box.height
+                )
+                entries.append(
+                    (
+                        processor.Detection(
+                            bounding_box=box, categories=detection.categories
+                        ),
+                        {index},
+                        self.isCut(box, tile, tiles),
+                    )
+                )
+
+        detections = self.joinCutBoxes(entries) if len(tiles) > 1 else [
+            detection for detection, _, _ in entries
+        ]
+        detections.sort(key=lambda d: d.categories[0].score, reverse=True)
+        kept = []
+        for detection in detections:
+            if all(
+                other.categories[0].index != detection.categories[0].index
+                or self.getIoU(other.bounding_box, detection.bounding_box)
+                < self.iouThreshold
+                for other in kept
+            ):
+                kept.append(detection)
+                if len(kept) == self.maxResults:
+                    break
+        return processor.DetectionResult(detections=kept)
+
+
+if __name__ == "__main__":
+    tiler = RoiTiler(roi=(0, 0, 1, 0.5), tileColumns=2, tileRows=1)
+    print(f"Tiles: {tiler.getTiles(1280, 720)}")
+    print(f"Pixels: {tiler.getPixelCount(1280, 720)} of {1280 * 720}")
@@ -1,11 +1,17 @@
+import json
 import logging
 import time
 import os
 import threading
 from cleanup.cleanup import Cleanup
+from cleanup.quota_enforcer import QuotaEnforcer
 import utils.utils as utils
+from constants import SEGMENT_LOG_FILE
+from input_output.frame_bus import DeliveryPolicy
 from input_output.input_source import InputSource
 from input_output.video_recorder import VideoRecorder
+from storage.storage_stats import StorageStats
+from storage.video_catalog import VideoCatalog
 
 
 class Dashcam:
@@ -17,10 +23,19 @@ class Dashcam:
         outputFolder="recordings",
         recoveryFolder: str = None,
         fps=30.0,
+        quotaEnforcer: QuotaEnforcer = None,
+        preopenTime: float = 2,
+        spriteFrames: int = 10,
+        segmentLogFile: str = SEGMENT_LOG_FILE,
+        videoCatalog: VideoCatalog = None,
+        storageStats: StorageStats = None,
     ):
         self.fileDuration = fileDuration
         self.inputSource = inputSource
         self.cleanup = cleanup
+        self.quotaEnforcer = quotaEnforcer
+        self.videoCatalog = videoCatalog
+        self.storageStats = storageStats
 
         if not os.path.exists(outputFolder):
             os.makedirs(outputFolder)
@@ -28,36 +43,133 @@ class Dashcam:
         self.outputFolder = outputFolder
         self.recoveryFolder = recoveryFolder
         self.fps = fps
+        self.preopenTime = preopenTime
+        self.spriteInterval = max(1, int(fileDuration * fps / spriteFrames))
+        self.segmentLogFile = segmentLogFile
+        self.finalizeThreads = []
         self.thread = None
         self.stopEvent = threading.Event()
         pass
 
-    def record(self):
+    def openRecorder(self, startTimestamp):
+        fileName = f"{int(startTimestamp)}.mkv"
+        outputFile = os.path.join(self.outputFolder, fileName)
+        videoRecorder = VideoRecorder(
+            self.inputSource,
+            outputFile,
+            self.fps,
+            self.recoveryFolder,
+            spriteInterval=self.spriteInterval,
+        )
+        videoRecorder.start(subscribe=False)
+        return videoRecorder
+
+    def finalizeRecorder(self, videoRecorder: VideoRecorder, keep=True):
         try:
-            while not self.stopEvent.is_set():
-                self.cleanup.removeOldFiles()
-                fileName = f"{int(time.time())}.mkv"
-                outputFile = os.path.join(self.outputFolder, fileName)
-                videoRecorder = VideoRecorder(
-                    self.inputSource, outputFile, self.fps, self.recoveryFolder
+            videoRecorder.stop()
+            outputFile = videoRecorder.videoMaker.outputFile
+            if not keep or videoRecorder.frameCount == 0:
+                if os.path.exists(outputFile):
+                    os.remove(outputFile)
+                return
+
+            size = self.cleanup.storageIndex.addRecording(outputFile)
+            if videoRecorder.thumbnailFrame is not None:
+                self.cleanup.storage.saveThumbnails(
+                    os.path.basename(outputFile),
+                    videoRecorder.thumbnailFrame,
+                    videoRecorder.spriteFrames,
+                )
+            segmentInfo = videoRecorder.getSegmentInfo()
+            self.logSegment(segmentInfo)
+            videoMaker = videoRecorder.videoMaker
+            duration = segmentInfo["frameCount"] / videoMaker.fps
+            if self.storageStats:
+                self.storageStats.recordSegment(size, duration)
+            if self.videoCatalog:
+                self.videoCatalog.addVideo(
+                    outputFile,
+                    startTimestamp=segmentInfo["startTimestamp"],
+                    duration=duration,
+                    width=videoMaker.width,
+                    height=videoMaker.height,
+                    codec=videoMaker.codec,
                 )
-                videoRecorder.start()
 
-                startTime = time.time()
+            # Cleanup runs in the background, rotation never waits for it
+            if self.quotaEnforcer:
+                self.quotaEnforcer.notify()
+            else:
+                self.cleanup.removeOldFiles()
+        except Exception as e:
+            utils.playSound("sounds/error.mp3")
+            print(e)
+            logging.error(e)
+
+    # The old writer is flushed and released while the next one records
+    def finalizeRecorderAsync(self, videoRecorder: VideoRecorder):
+        thread = threading.Thread(target=self.finalizeRecorder, args=(videoRecorder,))
+        thread.start()
+        self.finalizeThreads = [t for t in self.finalizeThreads if t.is_alive()]
+        self.finalizeThreads.append(thread)
 
-                while (
-                    (time.time() - startTime) < self.fileDuration
-                    and (not self.stopEvent.is_set())
-                    and (not videoRecorder.stopEvent.is_set())
-                ):
-                    time.sleep(1)
+    def logSegment(self, segmentInfo):
+        with open(self.segmentLogFile, "a") as f:
+            f.write(json.dumps(segmentInfo) + "\n")
 
-                videoRecorder.stop()
+    def record(self):
+        subscription = self.inputSource.subscribe(
+            DeliveryPolicy.DROP_OLDEST, max(1, int(2 * self.fps))
+        )
+        videoRecorder = None
+        nextRecorder = None
+        try:
+            segmentStart = None
+            while not self.stopEvent.is_set():
+                frame = subscription.getNextFrame(timeout=1)
+
+                if frame is None:
+                    if subscription.closed:
+                        break
+                    continue
+
+                if videoRecorder is None:
+                    segmentStart = frame.timestamp
+                    videoRecorder = self.openRecorder(segmentStart)
+
+                # Segments follow a fixed time grid, so names do not drift
+                boundary = segmentStart + self.fileDuration
+
+                # Open the next writer ahead of the boundary
+                if nextRecorder is None and frame.timestamp >= boundary - self.preopenTime:
+                    nextRecorder = self.openRecorder(boundary)
+
+                # Switch writers on the first frame past the boundary
+                if frame.timestamp >= boundary:
+                    self.finalizeRecorderAsync(videoRecorder)
+                    videoRecorder = nextRecorder
+                    nextRecorder = None
+                    segmentStart = boundary
+                    if frame.timestamp >= segmentStart + self.fileDuration:
+                        # Capture stalled for longer than a segment
+                        segmentStart = frame.timestamp
+
+                videoRecorder.pushFrame(frame)
+
+                if videoRecorder.stopEvent.is_set():
+                    raise Exception(f"Recorder for {videoRecorder.outputFile} stopped")
         except Exception as e:
             utils.playSound("sounds/error.mp3")
             print(e)
             logging.error(e)
         finally:
+            subscription.unsubscribe()
+            if videoRecorder:
+                self.finalizeRecorder(videoRecorder)
+            if nextRecorder:
+                self.finalizeRecorder(nextRecorder, keep=False)
+            for thread in self.finalizeThreads:
+                thread.join()
             self.stopEvent.set()
 
     def start(self):
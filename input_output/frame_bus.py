@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+import numpy as np
+
+
+@dataclass
+class Frame:
+    frameId: int
+    timestamp: float
+    image: np.ndarray
+
+
+class DeliveryPolicy(Enum):
+    # Only the newest frame is kept, older unread frames are replaced
+    LATEST_ONLY = "latestOnly"
+    # Queue up to maxSize frames, the oldest unread frame is dropped when full
+    DROP_OLDEST = "dropOldest"
+    # Queue up to maxSize frames, new frames are rejected when full
+    BOUNDED_QUEUE = "boundedQueue"
+
+
+class FrameSubscription:
+    def __init__(self, bus, policy: DeliveryPolicy, maxSize: int) -> None:
+        self.bus = bus
+        self.policy = policy
+        self.maxSize = 1 if policy == DeliveryPolicy.LATEST_ONLY else max(1, maxSize)
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.droppedFrames = 0
+        self.lastFrameId = 0
+
+    def deliver(self, frame: Frame):
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.frames) >= self.maxSize:
+                self.droppedFrames += 1
+                if self.policy == DeliveryPolicy.BOUNDED_QUEUE:
+                    return
+                self.frames.popleft()
+            self.frames.append(frame)
+            self.condition.notify()
+
+    # Blocks until a frame newer than the last returned one is available.
+    # Returns None on timeout or once the subscription is closed.
+    def getNextFrame(self, timeout: float = None) -> Frame:
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.frames or self.closed, timeout=timeout
+            ):
+                return None
+            if not self.frames:
+                return None
+            frame = self.frames.popleft()
+            self.lastFrameId = frame.frameId
+            return frame
+
+    def pending(self):
+        with self.condition:
+            return len(self.frames)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.frames.clear()
+            self.condition.notify_all()
+
+    def unsubscribe(self):
+        self.bus.unsubscribe(self)
+
+
+class FrameBus:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.frameId = 0
+        self.latestFrame: Frame = None
+        self.closed = False
+
+    def subscribe(
+        self, policy: DeliveryPolicy = DeliveryPolicy.LATEST_ONLY, maxSize: int = 1
+    ) -> FrameSubscription:
+        subscription = FrameSubscription(self, policy, maxSize)
+        with self.lock:
+            if self.closed:
+                subscription.close()
+            else:
+                self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: FrameSubscription):
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+        subscription.close()
+
+    def publish(self, image: np.ndarray, timestamp: float = None) -> Frame:
+        with self.lock:
+            self.frameId += 1
+            frame = Frame(
+                self.frameId, time.time() if timestamp is None else timestamp, image
+            )
+            self.latestFrame = frame
+            subscriptions = list(self.subscriptions)
+
+        for subscription in subscriptions:
+            subscription.deliver(frame)
+        return frame
+
+    def getLatestFrame(self) -> Frame:
+        return self.latestFrame
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            subscriptions = list(self.subscriptions)
+            self.subscriptions.clear()
+
+        for subscription in subscriptions:
+            subscription.close()
+
+
+if __name__ == "__main__":
+    bus = FrameBus()
+    latest = bus.subscribe(DeliveryPolicy.LATEST_ONLY)
+    queued = bus.subscribe(DeliveryPolicy.DROP_OLDEST, maxSize=3)
+
+    for _ in range(5):
+        bus.publish(np.zeros((2, 2, 3), dtype=np.uint8))
+
+    print("Latest only:", latest.getNextFrame(timeout=0).frameId)
+    print("Drop oldest:", [queued.getNextFrame(timeout=0).frameId for _ in range(3)])
+    print("Dropped:", latest.droppedFrames, queued.droppedFrames)
+    bus.close()
+    print("After close:", latest.getNextFrame(timeout=1))
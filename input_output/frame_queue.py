@@ -0,0 +1,140 @@
+import threading
+from collections import deque
+from enum import Enum
+import cv2
+import numpy as np
+
+
+class OverflowPolicy(Enum):
+    # Drop the incoming frame when the queue is full
+    DROP = "drop"
+    # Block the producer until a slot is free
+    BLOCK = "block"
+    # Store frames at half resolution once the queue is half full, drop when full
+    DOWNSCALE = "downscale"
+
+
+class FrameQueue:
+    def __init__(
+        self,
+        capacity: int,
+        width: int,
+        height: int,
+        policy: OverflowPolicy = OverflowPolicy.DROP,
+        channels: int = 3,
+    ) -> None:
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self.width = width
+        self.height = height
+
+        # Every slot is allocated once, frames are copied in and never reallocated
+        self.slots = np.empty((self.capacity, height, width, channels), dtype=np.uint8)
+        self.smallSlots = None
+        if policy == OverflowPolicy.DOWNSCALE:
+            self.smallSlots = np.empty(
+                (self.capacity, height // 2, width // 2, channels), dtype=np.uint8
+            )
+        self.freeSlots = deque(range(self.capacity))
+        self.filledSlots = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        # Counters
+        self.framesQueued = 0
+        self.framesDropped = 0
+        self.framesDownscaled = 0
+        self.maxDepth = 0
+        self.depthTotal = 0
+
+    def getDepth(self):
+        return len(self.filledSlots)
+
+    def put(self, image: np.ndarray, timestamp: float = None, timeout: float = None):
+        with self.condition:
+            if self.policy == OverflowPolicy.BLOCK:
+                self.condition.wait_for(
+                    lambda: self.freeSlots or self.closed, timeout=timeout
+                )
+
+            if self.closed or not self.freeSlots:
+                self.framesDropped += 1
+                return False
+
+            # Most recently released first, so a queue that stays shallow keeps
+            # touching the same few slots and the rest are never paged in
+            slot = self.freeSlots.pop()
+            downscale = (
+                self.policy == OverflowPolicy.DOWNSCALE
+                and len(self.filledSlots) >= self.capacity // 2
+            )
+
+        # Copy outside the lock, the slot is owned by the producer until queued
+        if downscale:
+            target = self.smallSlots[slot]
+            cv2.resize(image, (target.shape[1], target.shape[0]), dst=target,
+                       interpolation=cv2.INTER_AREA)
+        elif image.shape == self.slots[slot].shape:
+            np.copyto(self.slots[slot], image)
+        else:
+            cv2.resize(image, (self.width, self.height), dst=self.slots[slot])
+
+        with self.condition:
+            self.filledSlots.append((slot, timestamp, downscale))
+            self.framesQueued += 1
+            if downscale:
+                self.framesDownscaled += 1
+            depth = len(self.filledSlots)
+            self.maxDepth = max(self.maxDepth, depth)
+            self.depthTotal += depth
+            self.condition.notify_all()
+        return True
+
+    # Returns (slot, timestamp, image view), release(slot) once the view is used.
+    # Returns None on timeout or when the queue is closed and drained.
+    def get(self, timeout: float = None):
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.filledSlots or self.closed, timeout=timeout
+            ):
+                return None
+            if not self.filledSlots:
+                return None
+            slot, timestamp, downscaled = self.filledSlots.popleft()
+
+        image = self.smallSlots[slot] if downscaled else self.slots[slot]
+        return slot, timestamp, image
+
+    def release(self, slot: int):
+        with self.condition:
+            self.freeSlots.append(slot)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def getStats(self):
+        with self.condition:
+            return {
+                "capacity": self.capacity,
+                "depth": len(self.filledSlots),
+                "maxDepth": self.maxDepth,
+                "averageDepth": self.depthTotal / max(1, self.framesQueued),
+                "framesQueued": self.framesQueued,
+                "framesDropped": self.framesDropped,
+                "framesDownscaled": self.framesDownscaled,
+            }
+
+
+if __name__ == "__main__":
+    queue = FrameQueue(4, 64, 48, OverflowPolicy.DOWNSCALE)
+    for value in range(6):
+        queue.put(np.full((48, 64, 3), value, dtype=np.uint8))
+
+    while queue.getDepth():
+        slot, _, image = queue.get(timeout=0)
+        print(f"Slot {slot}: shape {image.shape}, value {image[0, 0, 0]}")
+        queue.release(slot)
+    print(queue.getStats())
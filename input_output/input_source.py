@@ -3,6 +3,7 @@ import cv2
 import time
 import threading
 import utils.utils as utils
+from input_output.frame_bus import DeliveryPolicy, FrameBus
 
 
 class InputSource:
@@ -27,6 +28,7 @@ class InputSource:
             self.capture = cv2.VideoCapture(videoSource)
 
         self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.frameBus = FrameBus()
         self.image = None
         self.frameCount = 0
         self.fps = 0
@@ -84,6 +86,7 @@ class InputSource:
             logging.error(e)
         finally:
             self.stopEvent.set()
+            self.frameBus.close()
             self.releaseCapture()
 
     def refreshFrame(self):
@@ -99,6 +102,7 @@ class InputSource:
 
         # Calculate FPS
         currentTime = time.time()
+        self.frameBus.publish(image, currentTime)
         elapsedTime = currentTime - self.lastTime
         self.fps = 1 / elapsedTime
         self.lastTime = currentTime
@@ -108,6 +112,9 @@ class InputSource:
     def getImage(self):
         return self.image
 
+    def subscribe(self, policy=DeliveryPolicy.LATEST_ONLY, maxSize=1):
+        return self.frameBus.subscribe(policy, maxSize)
+
     def releaseCapture(self):
         self.capture.release()
 
@@ -1,9 +1,12 @@
 import logging
 import multiprocessing
+import queue
 import cv2
 import time
 import utils.utils as utils
 from input_output.dashcam import Dashcam
+from input_output.frame_bus import DeliveryPolicy, FrameBus
+from input_output.shared_frame_ring import SharedFrameRing
 
 
 class InputSourceProcess:
@@ -16,6 +19,8 @@ class InputSourceProcess:
         recoveryFolder,
         fileDuration=600,
         maxFps=30.0,
+        useSharedMemory=True,
+        ringSlots=4,
     ) -> None:
         self.videoSource = videoSource
         self.width = width
@@ -25,6 +30,7 @@ class InputSourceProcess:
         self.outputFolder = outputFolder
         self.recoveryFolder = recoveryFolder
         self.frame = None
+        self.frameBus = None
 
         self.process = None
         self.stopEvent = multiprocessing.Event()
@@ -35,8 +41,17 @@ class InputSourceProcess:
         self.imageQueue = multiprocessing.Queue(1)
         self.fps = multiprocessing.Value("d", 0.0)
 
+        # Shared memory frame ring, the queue above is kept as a fallback
+        self.useSharedMemory = useSharedMemory
+        self.ringSlots = ringSlots
+        self.frameRing = None
+        self.frameRingActive = multiprocessing.Value("b", 0)
+        self.lastSequence = 0
+
     def start(self):
         print("Starting capture...")
+        if self.useSharedMemory:
+            self.openFrameRing()
         self.process = multiprocessing.Process(target=self.captureFrames)
         self.process.start()
         self.startedEvent.wait()
@@ -52,6 +67,25 @@ class InputSourceProcess:
         if self.process:
             self.process.terminate()
         print("Process terminated")
+        self.closeFrameRing()
+
+    def openFrameRing(self):
+        try:
+            if self.width is None or self.height is None:
+                capture = self.getVideoCapture()
+                capture.release()
+            self.frameRing = SharedFrameRing(self.width, self.height, self.ringSlots)
+            self.frameRingActive.value = 1
+        except Exception as e:
+            print(f"Shared memory unavailable, falling back to the queue: {e}")
+            logging.error(e)
+            self.frameRing = None
+
+    def closeFrameRing(self):
+        self.frameRingActive.value = 0
+        if self.frameRing:
+            self.frameRing.close()
+            self.frameRing = None
 
     def getVideoCapture(self):
         if str(self.videoSource).isdigit():
@@ -74,6 +108,8 @@ class InputSourceProcess:
             frameInterval = 1 / self.maxFps
 
             capture = self.getVideoCapture()
+            # The bus only lives in the capture process, next to the dashcam
+            self.frameBus = FrameBus()
             self.startedEvent.set()
             startTime = time.time()
             fpsLastTime = time.time()
@@ -96,7 +132,15 @@ class InputSourceProcess:
                 if not succces:
                     raise Exception("Failed to capture frame")
 
-                if self.frameRequestEvent.is_set():
+                published = False
+                if self.frameRingActive.value:
+                    published = self.frameRing.write(frame)
+                    if not published:
+                        # Camera delivered an unexpected frame size
+                        print("Frame does not fit the shared memory ring, using the queue")
+                        self.frameRingActive.value = 0
+
+                if (not published) and self.frameRequestEvent.is_set():
                     while not self.imageQueue.empty():
                         self.imageQueue.get()
 
@@ -105,6 +149,7 @@ class InputSourceProcess:
                     self.frameReadyEvent.set()
 
                 self.frame = frame
+                self.frameBus.publish(frame)
                 fps = 1 / (time.time() - fpsLastTime)
                 fpsLastTime = time.time()
                 self.fps.value = fps
@@ -119,6 +164,8 @@ class InputSourceProcess:
             print(e)
             logging.error(e)
         finally:
+            if self.frameBus:
+                self.frameBus.close()
             dashcam.stop()
             capture.release()
             self.stoppedEvent.set()
@@ -127,14 +174,62 @@ class InputSourceProcess:
     def getImage(self):
         return self.frame
 
-    # Request the image from a seperate process
-    def requestImage(self):
+    # Subscribe to new frames, will only work in the same process
+    def subscribe(self, policy=DeliveryPolicy.LATEST_ONLY, maxSize=1):
+        return self.frameBus.subscribe(policy, maxSize)
+
+    # Zero-copy access to the newest frame from a seperate process, returns
+    # (sequence, view) or (0, None) when no new frame arrives within the
+    # timeout. The view is overwritten once the camera wraps around the ring,
+    # call isFrameValid(sequence) after using it and drop what was computed
+    # from it if the frame is no longer valid. Only with the frame ring.
+    def requestFrame(self, timeout=1.0):
+        if not self.frameRingActive.value:
+            return 0, None
+        sequence, view = self.frameRing.waitForFrame(self.lastSequence, timeout)
+        if view is not None:
+            self.lastSequence = sequence
+        return sequence, view
+
+    def isFrameValid(self, sequence):
+        return self.frameRing.isValid(sequence)
+
+    # Request the image from a seperate process, None when no new frame
+    # arrives within the timeout. The image is the caller's to keep: with the
+    # frame ring it is one copy of the view, not a pickled queue round trip.
+    def requestImage(self, timeout=1.0):
+        if self.frameRingActive.value:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                sequence, view = self.requestFrame(deadline - time.time())
+                if view is None:
+                    return None
+                image = view.copy()
+                # Torn when the writer reached the slot during the copy
+                if self.isFrameValid(sequence):
+                    return image
+            return None
+
+        # A frame that arrived after an earlier request timed out is stale
+        self.clearImageQueue()
         self.frameRequestEvent.set()
-        self.frameReadyEvent.wait()
+        if not self.frameReadyEvent.wait(timeout):
+            # Withdraw the request, so no late frame is queued for the next call
+            self.frameRequestEvent.clear()
+            self.clearImageQueue()
+            return None
         image = self.imageQueue.get()
         self.frameReadyEvent.clear()
         return image
 
+    def clearImageQueue(self):
+        while not self.imageQueue.empty():
+            try:
+                self.imageQueue.get_nowait()
+            except queue.Empty:
+                break
+        self.frameReadyEvent.clear()
+
     def getFps(self):
         return self.fps.value
 
@@ -15,11 +15,17 @@
 import argparse
 
 import cv2
-from tflite_support.task import core
-from tflite_support.task import processor
-from tflite_support.task import vision
 import utils.utils as utils
 import input_output.input_source as input_source
+from inference.inference_engine import InferenceEngine
+from inference.inference_worker_pool import InferenceWorkerPool
+
+
+def detect_with_pool(pool: InferenceWorkerPool, images):
+    """Run frames through the worker processes and return the results in frame order."""
+    for image in images:
+        pool.submit(image)
+    return [pool.getResult()[2] for _ in images]
 
 
 def run(
@@ -30,6 +36,8 @@ def run(
     num_threads: int,
     enable_edgetpu: bool,
     output_file: str,
+    batch_size: int = 8,
+    workers: int = 1,
 ) -> None:
     """Run object detection on each frame of a video and save the processed frames in a new video file.
 
@@ -41,6 +49,8 @@ def run(
         num_threads: The number of CPU threads to run the model.
         enable_edgetpu: True/False whether the model is an EdgeTPU model.
         output_file: Path to the output video file to save the processed frames.
+        batch_size: Number of frames to run through the model at once.
+        workers: Number of inference processes, the threads are shared between them.
     """
 
     # Initialize video capture from the input video file
@@ -59,52 +69,83 @@ def run(
     out = cv2.VideoWriter(output_file, fourcc, 30.0, (width, height), isColor=True)
 
     # Initialize the object detection model
-    base_options = core.BaseOptions(
-        file_name=model, use_coral=enable_edgetpu, num_threads=num_threads
-    )
-    detection_options = processor.DetectionOptions(max_results=3, score_threshold=0.3)
-    options = vision.ObjectDetectorOptions(
-        base_options=base_options, detection_options=detection_options
-    )
-    detector = vision.ObjectDetector.create_from_options(options)
-
-    # Continuously capture frames from the video and run inference
-    while inputSource.isCaptureOpen():
-
-        image = inputSource.refreshFrame()
-
-        # Convert the image from BGR to RGB as required by the TFLite model.
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        # Create a TensorImage object from the RGB image.
-        input_tensor = vision.TensorImage.create_from_array(rgb_image)
-
-        # Run object detection estimation using the model.
-        detection_result = detector.detect(input_tensor)
-
-        # Draw keypoints and edges on input image
-        image = utils.visualize(image, detection_result)
-
-        # Write the processed frame to the output video file
-        out.write(cv2.resize(image, (width, height)))
-
-        # Print completion progress
-        if frame_count > 0:
-            current_frame += 1
-            progress = (current_frame / frame_count) * 100
-            print(
-                f"\rProcessing frame {current_frame}/{frame_count} ({progress:.2f}%)",
-                end="",
-                flush=True,
-            )
-
-        # Show the processed frame (optional)
-        cv2.imshow("object_detector", image)
-
-        # Stop the program if the ESC key is pressed.
-        if cv2.waitKey(1) == 27:
-            break
-
+    pool = None
+    if workers > 1:
+        pool = InferenceWorkerPool(
+            workers,
+            width,
+            height,
+            dict(
+                model=model,
+                threads=max(1, num_threads // workers),
+                scoreThreshold=0.3,
+                maxResults=3,
+                useCoral=enable_edgetpu,
+            ),
+        )
+        pool.start()
+    else:
+        inference_engine = InferenceEngine(
+            model,
+            threads=num_threads,
+            scoreThreshold=0.3,
+            maxResults=3,
+            batchSize=batch_size,
+            useCoral=enable_edgetpu,
+        )
+
+    # Continuously capture frames from the video and run inference in batches
+    stopped = False
+    try:
+        while inputSource.isCaptureOpen() and not stopped:
+
+            images = []
+            while len(images) < batch_size and inputSource.isCaptureOpen():
+                try:
+                    images.append(inputSource.refreshFrame())
+                except Exception:
+                    # End of the video, the last partial batch is still processed
+                    break
+
+            if not images:
+                break
+
+            # Run object detection estimation using the model.
+            if pool:
+                detection_results = detect_with_pool(pool, images)
+            else:
+                detection_results = inference_engine.getDetectionsBatch(images)
+
+            for image, detection_result in zip(images, detection_results):
+                # Draw keypoints and edges on input image, a frame a worker
+                # failed on is written as it is
+                if detection_result is not None:
+                    image = utils.visualize(image, detection_result)
+
+                # Write the processed frame to the output video file
+                out.write(cv2.resize(image, (width, height)))
+
+                # Print completion progress
+                if frame_count > 0:
+                    current_frame += 1
+                    progress = (current_frame / frame_count) * 100
+                    print(
+                        f"\rProcessing frame {current_frame}/{frame_count} ({progress:.2f}%)",
+                        end="",
+                        flush=True,
+                    )
+
+                # Show the processed frame (optional)
+                cv2.imshow("object_detector", image)
+
+                # Stop the program if the ESC key is pressed.
+                if cv2.waitKey(1) == 27:
+                    stopped = True
+                    break
+    finally:
+        # The workers and their shared memory must not outlive an error
+        if pool:
+            pool.stop()
     inputSource.releaseCapture()
     out.release()
     cv2.destroyAllWindows()
@@ -160,6 +201,20 @@ def main():
         help="Path to the output video file to save the processed frames.",
         required=True,
     )
+    parser.add_argument(
+        "--batchSize",
+        help="Number of frames to run through the model at once.",
+        required=False,
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of inference processes, frames keep their order.",
+        required=False,
+        type=int,
+        default=1,
+    )
     args = parser.parse_args()
 
     run(
@@ -170,6 +225,8 @@ def main():
         args.numThreads,
         args.enableEdgeTPU,
         args.outputFile,
+        args.batchSize,
+        args.workers,
     )
 
 
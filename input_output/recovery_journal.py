@@ -0,0 +1,193 @@
+import logging
+import os
+import struct
+import zlib
+import cv2
+import numpy as np
+
+JOURNAL_EXTENSION = ".journal"
+INDEX_EXTENSION = ".idx"
+
+# magic, version, width, height, fps, start timestamp
+_HEADER = struct.Struct("<4sHIIdd")
+_HEADER_SIZE = 64
+_MAGIC = b"DCJ1"
+_VERSION = 1
+
+# magic, frame index, timestamp, length, crc32
+_RECORD = struct.Struct("<IIdII")
+_RECORD_MAGIC = 0x4652414D
+
+# offset, length
+_INDEX_ENTRY = struct.Struct("<QI")
+
+
+def getJournalPath(recoveryFolder: str, outputFile: str):
+    name, _ = os.path.splitext(os.path.basename(outputFile))
+    return os.path.join(recoveryFolder, name + JOURNAL_EXTENSION)
+
+
+def getIndexPath(journalPath: str):
+    return journalPath + INDEX_EXTENSION
+
+
+class RecoveryJournalWriter:
+    def __init__(
+        self,
+        path: str,
+        width: int,
+        height: int,
+        fps: float,
+        startTimestamp: float,
+        jpegQuality: int = 80,
+        syncInterval: int = 30,
+        preallocateBytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.path = path
+        self.indexPath = getIndexPath(path)
+        self.encodeParams = [cv2.IMWRITE_JPEG_QUALITY, jpegQuality]
+        self.syncInterval = max(1, syncInterval)
+        self.preallocateBytes = preallocateBytes
+
+        self.journalFile = open(path, "wb")
+        self.indexFile = open(self.indexPath, "wb")
+        self.allocated = 0
+        self.preallocate(self.preallocateBytes)
+
+        header = _HEADER.pack(_MAGIC, _VERSION, width, height, fps, startTimestamp)
+        self.journalFile.write(header.ljust(_HEADER_SIZE, b"\0"))
+        self.offset = _HEADER_SIZE
+        self.frameIndex = 0
+        self.pendingIndex = []
+        self.sync()
+
+    def preallocate(self, size):
+        # Unwritten space reads as zeros, so a replay stops at the first gap
+        fileno = self.journalFile.fileno()
+        try:
+            os.posix_fallocate(fileno, self.allocated, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fileno, self.allocated + size)
+        self.allocated += size
+
+    def append(self, image: np.ndarray, timestamp: float):
+        success, buffer = cv2.imencode(".jpg", image, self.encodeParams)
+        if not success:
+            raise Exception("Failed to encode recovery frame")
+        data = buffer.tobytes()
+
+        recordLength = _RECORD.size + len(data)
+        while self.offset + recordLength > self.allocated:
+            self.preallocate(self.preallocateBytes)
+
+        self.journalFile.write(
+            _RECORD.pack(
+                _RECORD_MAGIC, self.frameIndex, timestamp, len(data), zlib.crc32(data)
+            )
+        )
+        self.journalFile.write(data)
+        self.pendingIndex.append(_INDEX_ENTRY.pack(self.offset, recordLength))
+        self.offset += recordLength
+        self.frameIndex += 1
+
+        if len(self.pendingIndex) >= self.syncInterval:
+            self.sync()
+
+    def sync(self):
+        # Frames are made durable before the index that points at them
+        self.journalFile.flush()
+        os.fsync(self.journalFile.fileno())
+        if self.pendingIndex:
+            self.indexFile.write(b"".join(self.pendingIndex))
+            self.pendingIndex = []
+        self.indexFile.flush()
+        os.fsync(self.indexFile.fileno())
+
+    def close(self):
+        if self.journalFile.closed:
+            return
+        self.sync()
+        self.journalFile.truncate(self.offset)
+        self.journalFile.close()
+        self.indexFile.close()
+
+    def remove(self):
+        self.close()
+        for path in (self.path, self.indexPath):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class RecoveryJournalReader:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.indexPath = getIndexPath(path)
+
+        with open(path, "rb") as journalFile:
+            header = journalFile.read(_HEADER_SIZE)
+        if len(header) < _HEADER.size:
+            raise Exception(f"Journal '{path}' has no header")
+
+        magic, version, width, height, fps, startTimestamp = _HEADER.unpack_from(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise Exception(f"'{path}' is not a recovery journal")
+
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.startTimestamp = startTimestamp
+
+    # Frames known to be durable, the journal may hold a few more past the last sync
+    def getIndexedFrameCount(self):
+        if not os.path.exists(self.indexPath):
+            return 0
+        return os.path.getsize(self.indexPath) // _INDEX_ENTRY.size
+
+    # Yields (frameIndex, timestamp, jpegBytes) in order and stops at the first
+    # torn or unwritten record
+    def readRecords(self, startFrame: int = 0):
+        with open(self.path, "rb") as journalFile:
+            journalFile.seek(_HEADER_SIZE)
+            while True:
+                header = journalFile.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    return
+
+                magic, frameIndex, timestamp, length, crc = _RECORD.unpack(header)
+                if magic != _RECORD_MAGIC:
+                    return
+
+                if frameIndex < startFrame:
+                    journalFile.seek(length, os.SEEK_CUR)
+                    continue
+
+                data = journalFile.read(length)
+                if len(data) < length or zlib.crc32(data) != crc:
+                    logging.error(f"Torn record {frameIndex} in journal {self.path}")
+                    return
+
+                yield frameIndex, timestamp, data
+
+    def readFrames(self, startFrame: int = 0):
+        for frameIndex, timestamp, data in self.readRecords(startFrame):
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            yield frameIndex, timestamp, image
+
+    def remove(self):
+        for path in (self.path, self.indexPath):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    journalPath = "test.journal"
+    writer = RecoveryJournalWriter(journalPath, 320, 240, 30.0, 0, syncInterval=4)
+    for value in range(10):
+        writer.append(np.full((240, 320, 3), value * 20, dtype=np.uint8), value / 30)
+    writer.close()
+
+    reader = RecoveryJournalReader(journalPath)
+    print(f"Indexed frames: {reader.getIndexedFrameCount()}")
+    for frameIndex, timestamp, image in reader.readFrames(startFrame=5):
+        print(f"Frame {frameIndex} at {timestamp:.3f}s, value {image[0, 0, 0]}")
+    reader.remove()
@@ -0,0 +1,131 @@
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SharedFrameRing:
+    # Header layout (int64): [latestSequence, slotSequence_0 ... slotSequence_N-1]
+    # A slot sequence of -1 means the writer is currently filling that slot.
+    WRITING = -1
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        slots: int = 4,
+        channels: int = 3,
+        name: str = None,
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.slots = slots
+        self.frameShape = (height, width, channels)
+        self.frameBytes = height * width * channels
+        self.headerBytes = (slots + 1) * np.dtype(np.int64).itemsize
+
+        create = name is None
+        self.sharedMemory = shared_memory.SharedMemory(
+            name=name, create=create, size=self.headerBytes + self.frameBytes * slots
+        )
+        self.owner = create
+        self.attach()
+
+        if create:
+            self.header[:] = 0
+
+    def attach(self):
+        buffer = self.sharedMemory.buf
+        self.header = np.ndarray((self.slots + 1,), dtype=np.int64, buffer=buffer)
+        self.frames = np.ndarray(
+            (self.slots,) + self.frameShape,
+            dtype=np.uint8,
+            buffer=buffer,
+            offset=self.headerBytes,
+        )
+
+    def __getstate__(self):
+        # Only the segment name crosses the process boundary, never the frames
+        return {
+            "width": self.width,
+            "height": self.height,
+            "channels": self.channels,
+            "slots": self.slots,
+            "name": self.sharedMemory.name,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(
+            state["width"],
+            state["height"],
+            state["slots"],
+            state["channels"],
+            state["name"],
+        )
+
+    def accepts(self, frame: np.ndarray):
+        return frame.shape == self.frameShape and frame.dtype == np.uint8
+
+    # Single writer only, readers never take a lock
+    def write(self, frame: np.ndarray):
+        if not self.accepts(frame):
+            return False
+
+        sequence = int(self.header[0]) + 1
+        slot = sequence % self.slots
+
+        self.header[slot + 1] = self.WRITING
+        np.copyto(self.frames[slot], frame)
+        self.header[slot + 1] = sequence
+        self.header[0] = sequence
+        return True
+
+    def getLatestSequence(self):
+        return int(self.header[0])
+
+    # Returns (sequence, view) of the newest frame without copying it.
+    # The view stays valid until the writer wraps around the ring, use
+    # isValid() after processing or copy the frame if it is kept longer.
+    def getLatestFrame(self):
+        sequence = self.getLatestSequence()
+        if sequence == 0:
+            return 0, None
+
+        slot = sequence % self.slots
+        if int(self.header[slot + 1]) != sequence:
+            return 0, None
+
+        return sequence, self.frames[slot]
+
+    def isValid(self, sequence: int):
+        return int(self.header[sequence % self.slots + 1]) == sequence
+
+    def waitForFrame(self, afterSequence: int = 0, timeout: float = None, pollInterval=0.001):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            sequence, frame = self.getLatestFrame()
+            if sequence > afterSequence and frame is not None:
+                return sequence, frame
+            if deadline is not None and time.time() >= deadline:
+                return 0, None
+            time.sleep(pollInterval)
+
+    def close(self):
+        self.header = None
+        self.frames = None
+        self.sharedMemory.close()
+        if self.owner:
+            self.sharedMemory.unlink()
+
+
+if __name__ == "__main__":
+    ring = SharedFrameRing(640, 480, slots=3)
+    reader = SharedFrameRing(640, 480, slots=3, name=ring.sharedMemory.name)
+
+    for value in range(5):
+        ring.write(np.full((480, 640, 3), value, dtype=np.uint8))
+        sequence, frame = reader.getLatestFrame()
+        print(f"Sequence {sequence}: value {frame[0, 0, 0]}, valid {reader.isValid(sequence)}")
+
+    reader.close()
+    ring.close()
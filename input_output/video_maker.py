@@ -1,20 +1,142 @@
+import logging
+import subprocess
+import threading
+from collections import deque
 import cv2
+import numpy as np
+from constants import VIDEO_ENCODER, VIDEO_ENCODER_OPTIONS
+
+
+class OpenCVEncoder:
+    def __init__(
+        self, outputFile: str, width: int, height: int, fps: float, fourcc="XVID"
+    ) -> None:
+        self.codec = fourcc
+        self.out = cv2.VideoWriter(
+            outputFile, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height), isColor=True
+        )
+
+    def write(self, image: np.ndarray):
+        self.out.write(image)
+
+    def release(self):
+        self.out.release()
+
+
+class FFmpegEncoder:
+    # Raw BGR frames are piped to ffmpeg's stdin, encoding happens in ffmpeg's
+    # own threads. Use codec "h264_v4l2m2m" for the Raspberry Pi hardware encoder.
+    def __init__(
+        self,
+        outputFile: str,
+        width: int,
+        height: int,
+        fps: float,
+        codec="libx264",
+        preset="veryfast",
+        crf=23,
+        threads=0,
+        ffmpegPath="ffmpeg",
+    ) -> None:
+        self.codec = codec
+        command = [
+            ffmpegPath,
+            "-loglevel", "error",
+            "-y",
+            "-f", "rawvideo",
+            "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}",
+            "-r", str(fps),
+            "-i", "-",
+            "-an",
+            "-c:v", codec,
+            "-pix_fmt", "yuv420p",
+            "-threads", str(threads),
+        ]
+        if codec in ("libx264", "libx265"):
+            command += ["-preset", preset, "-crf", str(crf)]
+        command.append(outputFile)
+
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        # stderr is read all the time, a full pipe would block ffmpeg and with
+        # it the writes to stdin. The last lines are kept for error messages.
+        self.errorLines = deque(maxlen=20)
+        self.stderrThread = threading.Thread(target=self.readErrors, daemon=True)
+        self.stderrThread.start()
+
+    def readErrors(self):
+        for line in self.process.stderr:
+            self.errorLines.append(line.decode(errors="ignore").rstrip())
+
+    def getError(self):
+        self.stderrThread.join(timeout=1)
+        return "\n".join(self.errorLines)
+
+    def write(self, image: np.ndarray):
+        try:
+            self.process.stdin.write(memoryview(np.ascontiguousarray(image)))
+        except BrokenPipeError:
+            self.process.wait()
+            raise Exception(f"ffmpeg encoder stopped: {self.getError()}")
+
+    def release(self):
+        if self.process.stdin:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        self.process.wait()
+        error = self.getError()
+        if self.process.returncode != 0:
+            logging.error(f"ffmpeg exited with {self.process.returncode}: {error}")
+
+
+ENCODERS = {
+    "opencv": OpenCVEncoder,
+    "ffmpeg": FFmpegEncoder,
+}
+
+
+def createEncoder(encoder, outputFile, width, height, fps, encoderOptions=None):
+    options = encoderOptions or {}
+    try:
+        return ENCODERS[encoder](outputFile, width, height, fps, **options)
+    except FileNotFoundError as e:
+        # ffmpeg is not installed, keep recording with OpenCV
+        print(f"Encoder '{encoder}' is not available, using OpenCV: {e}")
+        logging.error(e)
+        return OpenCVEncoder(outputFile, width, height, fps)
 
 
 class VideoMaker:
-    def __init__(self, outputFile: str, width: int, height: int, fps: float = 30.0) -> None:
-        fourcc = cv2.VideoWriter_fourcc(*"XVID")
+    def __init__(
+        self,
+        outputFile: str,
+        width: int,
+        height: int,
+        fps: float = 30.0,
+        encoder: str = VIDEO_ENCODER,
+        encoderOptions: dict = None,
+    ) -> None:
         if not outputFile.endswith(".mkv"):
             outputFile = outputFile + ".mkv"
         self.outputFile = outputFile
         self.width = width
         self.height = height
-        self.out = cv2.VideoWriter(
-            self.outputFile, fourcc, fps, (width, height), isColor=True
+        if encoderOptions is None and encoder == VIDEO_ENCODER:
+            encoderOptions = VIDEO_ENCODER_OPTIONS
+        self.fps = fps
+        self.encoder = createEncoder(
+            encoder, self.outputFile, width, height, fps, encoderOptions
         )
+        self.codec = self.encoder.codec
 
     def writeFrame(self, image):
-        self.out.write(cv2.resize(image, (self.width, self.height)))
+        if image.shape[1] != self.width or image.shape[0] != self.height:
+            image = cv2.resize(image, (self.width, self.height))
+        self.encoder.write(image)
 
     def releaseVideo(self):
-        self.out.release()
+        self.encoder.release()
@@ -3,10 +3,14 @@ import threading
 import time
 import os
 import cv2
-import shutil
 import utils.utils as utils
+from constants import RECORDER_QUEUE_SECONDS
+from input_output.frame_bus import DeliveryPolicy, Frame, FrameSubscription
+from input_output.frame_queue import FrameQueue, OverflowPolicy
 from input_output.input_source import InputSource
+from input_output.recovery_journal import RecoveryJournalWriter, getJournalPath
 from input_output.video_maker import VideoMaker
+from storage.storage import SPRITE_FRAME_SIZE, THUMBNAIL_SIZES
 
 
 class VideoRecorder:
@@ -16,6 +20,9 @@ class VideoRecorder:
         outputFile: str,
         fps: float = 30.0,
         recoveryFolder: str = None,
+        queueSize: int = None,
+        overflowPolicy: OverflowPolicy = OverflowPolicy.DROP,
+        spriteInterval: int = None,
     ) -> None:
         self.inputSource = inputSource
         self.outputFile = outputFile
@@ -25,55 +32,150 @@ class VideoRecorder:
             outputFile, inputSource.width, inputSource.height, self.fps
         )
 
+        # Frames are buffered here so encoder and SD card write stalls do not
+        # block the capture side. Slots are reused most recent first, only as
+        # many as a stall fills are ever paged in.
+        if queueSize is None:
+            queueSize = max(1, int(RECORDER_QUEUE_SECONDS * self.fps))
+        self.frameQueue = FrameQueue(
+            queueSize, inputSource.width, inputSource.height, overflowPolicy
+        )
+        self.encodeTime = 0
+        self.maxEncodeTime = 0
+        self.encodeStartTime = None
+
+        # Frame range written to this file, used to stitch segments together
+        self.firstFrameId = None
+        self.lastFrameId = None
+        self.firstTimestamp = None
+        self.lastTimestamp = None
+        # Frames the encoder wrote, not the ones dropped by the queue
+        self.frameCount = 0
+        self.framesCaptured = 0
+
+        # Downscaled frames kept for thumbnails, so none have to be decoded later
+        self.spriteInterval = spriteInterval
+        self.thumbnailFrame = None
+        self.spriteFrames = []
+
+        self.subscription = None
+        self.recoverySubscription = None
+        self.recoveryJournal = None
         self.mainThread = None
+        self.encoderThread = None
         self.recoveryThread = None
         self.stopEvent = threading.Event()
         pass
 
     def recordVideo(self):
         try:
-            frameInterval = 1 / self.fps
             while not self.stopEvent.is_set():
-                startTime = time.time()
-
-                image = self.inputSource.getImage()
+                frame = self.subscription.getNextFrame(timeout=1)
 
-                if image is None:
+                if frame is None:
+                    if self.subscription.closed:
+                        break
                     continue
 
-                self.videoMaker.writeFrame(image)
+                self.pushFrame(frame)
 
-                endTime = time.time()
-                elapsedTime = endTime - startTime
-                waitTime = max(0, frameInterval - elapsedTime)
-                time.sleep(waitTime)
+            # The frames buffered before stop() are the tail of the segment,
+            # later ones belong to the next file
+            for _ in range(self.subscription.pending()):
+                frame = self.subscription.getNextFrame(timeout=0)
+                if frame is None:
+                    break
+                self.pushFrame(frame)
         except Exception as e:
             utils.playSound("sounds/error.mp3")
             print(e)
             logging.error(e)
         finally:
             self.stopEvent.set()
+            self.frameQueue.close()
+
+    # Hand a frame to the recorder directly, used when started with subscribe=False
+    def pushFrame(self, frame: Frame):
+        if self.firstFrameId is None:
+            self.firstFrameId = frame.frameId
+            self.firstTimestamp = frame.timestamp
+            self.thumbnailFrame = cv2.resize(
+                frame.image, THUMBNAIL_SIZES["large"], interpolation=cv2.INTER_AREA
+            )
+        if self.spriteInterval and self.framesCaptured % self.spriteInterval == 0:
+            self.spriteFrames.append(
+                cv2.resize(frame.image, SPRITE_FRAME_SIZE, interpolation=cv2.INTER_AREA)
+            )
+        self.lastFrameId = frame.frameId
+        self.lastTimestamp = frame.timestamp
+        self.framesCaptured += 1
+
+        self.frameQueue.put(frame.image, frame.timestamp)
+        if self.recoverySubscription:
+            self.recoverySubscription.deliver(frame)
+
+    def encodeFrames(self):
+        try:
+            self.encodeStartTime = time.time()
+            while True:
+                item = self.frameQueue.get(timeout=1)
+
+                if item is None:
+                    if self.frameQueue.closed:
+                        break
+                    continue
+
+                slot, _, image = item
+                startTime = time.time()
+                try:
+                    self.videoMaker.writeFrame(image)
+                finally:
+                    self.frameQueue.release(slot)
+                self.frameCount += 1
+                encodeTime = time.time() - startTime
+                self.encodeTime += encodeTime
+                self.maxEncodeTime = max(self.maxEncodeTime, encodeTime)
+        except Exception as e:
+            utils.playSound("sounds/error.mp3")
+            print(e)
+            logging.error(e)
+        finally:
+            self.stopEvent.set()
+            self.frameQueue.close()
+
+    def getStats(self):
+        stats = self.frameQueue.getStats()
+        elapsedTime = time.time() - self.encodeStartTime if self.encodeStartTime else 0
+        # Fraction of wall time the encoder was busy, 1.0 means saturated
+        stats["encoderUtilization"] = self.encodeTime / elapsedTime if elapsedTime else 0
+        # Longest single write, the queue has to hold this many seconds of frames
+        stats["maxEncodeTime"] = self.maxEncodeTime
+        return stats
 
     def recovery(self):
         try:
             if not os.path.exists(self.recoveryFolder):
                 os.makedirs(self.recoveryFolder)
-            frameInterval = 1 / self.fps
-            frameCount = 0
             while not self.stopEvent.is_set():
-                startTime = time.time()
-
-                image = self.inputSource.getImage()
+                frame = self.recoverySubscription.getNextFrame(timeout=1)
 
-                if image is None:
+                if frame is None:
+                    if self.recoverySubscription.closed:
+                        break
                     continue
 
-                frameCount += 1
-                cv2.imwrite(f"{self.recoveryFolder}/{frameCount}.jpg", image)
-                endTime = time.time()
-                elapsedTime = endTime - startTime
-                waitTime = max(0, frameInterval - elapsedTime)
-                time.sleep(waitTime)
+                if self.recoveryJournal is None:
+                    height, width = frame.image.shape[:2]
+                    self.recoveryJournal = RecoveryJournalWriter(
+                        getJournalPath(self.recoveryFolder, self.outputFile),
+                        width,
+                        height,
+                        self.fps,
+                        frame.timestamp,
+                        syncInterval=max(1, int(self.fps)),
+                    )
+
+                self.recoveryJournal.append(frame.image, frame.timestamp)
         except Exception as e:
             utils.playSound("sounds/error.mp3")
             print(e)
@@ -81,21 +183,58 @@ class VideoRecorder:
         finally:
             self.stopEvent.set()
 
-    def start(self):
-        self.mainThread = threading.Thread(target=self.recordVideo)
-        self.mainThread.start()
+    def getSegmentInfo(self):
+        return {
+            "file": os.path.basename(self.videoMaker.outputFile),
+            "firstFrameId": self.firstFrameId,
+            "lastFrameId": self.lastFrameId,
+            "frameCount": self.frameCount,
+            "startTimestamp": self.firstTimestamp,
+            "endTimestamp": self.lastTimestamp,
+        }
+
+    # With subscribe=False frames are not taken from the input source, the
+    # owner feeds them through pushFrame()
+    def start(self, subscribe=True):
+        # Every captured frame is written exactly once, a one second backlog is
+        # kept before the oldest frames are dropped
+        backlog = max(1, int(self.fps))
+        self.encoderThread = threading.Thread(target=self.encodeFrames)
+        self.encoderThread.start()
         if self.recoveryFolder is not None:
+            self.recoverySubscription = FrameSubscription(
+                None, DeliveryPolicy.DROP_OLDEST, backlog
+            )
             self.recoveryThread = threading.Thread(target=self.recovery)
             self.recoveryThread.start()
+        if subscribe:
+            self.subscription = self.inputSource.subscribe(
+                DeliveryPolicy.DROP_OLDEST, backlog
+            )
+            self.mainThread = threading.Thread(target=self.recordVideo)
+            self.mainThread.start()
 
     def stop(self):
         self.stopEvent.set()
+        # Unsubscribing clears the buffered frames, the main thread writes
+        # them first
         if self.mainThread:
             self.mainThread.join()
+        if self.subscription:
+            self.subscription.unsubscribe()
+        if self.recoverySubscription:
+            self.recoverySubscription.close()
+        # Let the encoder drain the frames that are already queued
+        self.frameQueue.close()
+        if self.encoderThread:
+            self.encoderThread.join()
         if self.recoveryThread:
             self.recoveryThread.join()
         self.videoMaker.releaseVideo()
-        shutil.rmtree(self.recoveryFolder, ignore_errors=True)
+        print(f"Recorder stats for {self.outputFile}: {self.getStats()}")
+        # The segment is complete, its recovery journal is no longer needed
+        if self.recoveryJournal:
+            self.recoveryJournal.remove()
 
 
 if __name__ == "__main__":
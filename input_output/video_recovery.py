@@ -1,28 +1,61 @@
+import json
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+import numpy as np
 import os
-import shutil
 import re
 from api_server import InferenceData, Status
 import utils.utils as utils
+from input_output.recovery_journal import JOURNAL_EXTENSION, RecoveryJournalReader
 from input_output.video_maker import VideoMaker
+from storage.video_catalog import probeVideo
+
+CHECKPOINT_EXTENSION = ".checkpoint"
+IMAGES_CHECKPOINT = "images" + CHECKPOINT_EXTENSION
+
+
+def decodeImage(data: bytes):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
 
 
 class VideoRecovery:
     def __init__(
-        self, recoveryFolder: str, outputFolder: str, apiData: InferenceData, fps: float = 30.0
+        self,
+        recoveryFolder: str,
+        outputFolder: str,
+        apiData: InferenceData,
+        fps: float = 30.0,
+        workers: int = 2,
+        chunkDuration: int = 60,
+        storageIndex=None,
+        videoCatalog=None,
     ) -> None:
         self.recoveryFolder = recoveryFolder
         self.outputFolder = outputFolder
         self.fps = fps
         self.apiData = apiData
+        self.storageIndex = storageIndex
+        self.videoCatalog = videoCatalog
+
+        # Decoding runs on a pool, encoding stays in order on the recovery thread
+        self.workers = max(1, workers)
+        self.reorderWindow = self.workers * 4
+        # Recovered video is written in chunks, each completed chunk is checkpointed
+        self.chunkFrames = max(1, int(chunkDuration * fps))
 
-    def getFrameDimensions(self):
+        self.journals = []
+        self.images = []
+        self.totalFrames = 1
+        self.recoveredFrames = 0
+        self.thread = None
+        self.stopEvent = threading.Event()
+
+    def getFrameDimensions(self, fileName):
         try:
-            image_file = os.path.join(
-                self.recoveryFolder, os.listdir(self.recoveryFolder)[0]
-            )
-            image = cv2.imread(image_file)
+            image = cv2.imread(os.path.join(self.recoveryFolder, fileName))
             return image.shape[1], image.shape[0]
         except Exception as e:
             print(e)
@@ -37,70 +70,251 @@ class VideoRecovery:
         else:
             return 0
 
-    def recoverVideo(self):
+    def getJournals(self):
+        return sorted(
+            os.path.join(self.recoveryFolder, f)
+            for f in os.listdir(self.recoveryFolder)
+            if f.endswith(JOURNAL_EXTENSION)
+        )
+
+    def getImages(self):
+        return sorted(
+            filter(lambda x: str(x).endswith(".jpg"), os.listdir(self.recoveryFolder)),
+            key=VideoRecovery.frameNumberSort,
+        )
 
+    @staticmethod
+    def loadCheckpoint(path):
         try:
-            if self.apiData:
-                self.apiData.status = Status.RECOVERY.value
-            if not os.path.exists(self.recoveryFolder):
-                print(f"Recovery folder '{self.recoveryFolder}' does not exist.")
-                return
+            with open(path, "r") as f:
+                return json.load(f)["nextFrame"]
+        except (OSError, ValueError, KeyError):
+            return 0
 
-            if not os.path.isdir(self.recoveryFolder):
-                print(f"Path '{self.recoveryFolder}' is not a directory.")
-                return
+    @staticmethod
+    def saveCheckpoint(path, nextFrame):
+        temporaryPath = path + ".tmp"
+        with open(temporaryPath, "w") as f:
+            json.dump({"nextFrame": nextFrame}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporaryPath, path)
+
+    @staticmethod
+    def removeCheckpoint(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def updateProgress(self):
+        progress = min(100, self.recoveredFrames / self.totalFrames * 100)
+        if self.apiData:
+            self.apiData.recoveryPercent = progress
+        print(f"\rProgress: {progress:.2f}%", end="", flush=True)
+
+    def releaseChunk(self, videoMaker: VideoMaker):
+        videoMaker.releaseVideo()
+        if self.storageIndex:
+            self.storageIndex.addRecording(videoMaker.outputFile)
+        if self.videoCatalog:
+            self.videoCatalog.addVideo(
+                videoMaker.outputFile, **probeVideo(videoMaker.outputFile)
+            )
+
+    def encodeRecords(self, records, decode, checkpointPath, width, height, fps):
+        # records yields (frameIndex, timestamp, payload) in order, payloads are
+        # decoded in parallel and written back in order through a reorder buffer
+        pending = deque()
+        videoMaker = None
+        chunkFrames = 0
+        lastFrame = None
+
+        def writeNext():
+            nonlocal videoMaker, chunkFrames, lastFrame
+            frameIndex, timestamp, future = pending.popleft()
+            image = future.result()
+
+            # Chunks are named by their first frame. After a crash the
+            # checkpoint is still at the start of the partial chunk, so the
+            # resumed chunk replaces the partial file. A stop() checkpoints
+            # past the partial chunk instead, it is kept as a shorter file and
+            # the resumed run continues in a new one.
+            if videoMaker is None:
+                outputFile = os.path.join(self.outputFolder, str(int(timestamp)))
+                videoMaker = VideoMaker(outputFile, width, height, fps)
+
+            if image is not None:
+                videoMaker.writeFrame(image)
+            chunkFrames += 1
+            lastFrame = frameIndex
+            self.recoveredFrames += 1
+            self.updateProgress()
+
+            if chunkFrames >= self.chunkFrames:
+                self.releaseChunk(videoMaker)
+                videoMaker = None
+                chunkFrames = 0
+                self.saveCheckpoint(checkpointPath, frameIndex + 1)
+
+        with ThreadPoolExecutor(
+            self.workers, initializer=utils.lowerThreadPriority
+        ) as pool:
+            try:
+                for frameIndex, timestamp, payload in records:
+                    if self.stopEvent.is_set():
+                        break
+                    pending.append((frameIndex, timestamp, pool.submit(decode, payload)))
+                    while len(pending) > self.reorderWindow:
+                        writeNext()
+
+                while pending:
+                    writeNext()
+            finally:
+                for _, _, future in pending:
+                    future.cancel()
+                if videoMaker is not None:
+                    self.releaseChunk(videoMaker)
+                if lastFrame is not None and chunkFrames > 0:
+                    self.saveCheckpoint(checkpointPath, lastFrame + 1)
+
+        return not self.stopEvent.is_set()
 
-            if not os.listdir(self.recoveryFolder):
-                print(
-                    f"Recovery folder '{self.recoveryFolder}' is empty. No images to recover."
-                )
+    def recoverJournals(self, journals):
+        for journal in journals:
+            if self.stopEvent.is_set():
                 return
 
-            sortedFiles = sorted(
-                filter(
-                    lambda x: str(x).endswith(".jpg"), os.listdir(self.recoveryFolder)
-                ),
-                key=VideoRecovery.frameNumberSort,
+            reader = RecoveryJournalReader(journal)
+            checkpointPath = journal + CHECKPOINT_EXTENSION
+            startFrame = self.loadCheckpoint(checkpointPath)
+            self.recoveredFrames += startFrame
+
+            completed = self.encodeRecords(
+                reader.readRecords(startFrame),
+                decodeImage,
+                checkpointPath,
+                reader.width,
+                reader.height,
+                reader.fps or self.fps,
             )
 
-            width, height = self.getFrameDimensions()
-            firstTimestamp = str(
-                int(os.path.getmtime(os.path.join(self.recoveryFolder, sortedFiles[0])))
+            if completed:
+                reader.remove()
+                self.removeCheckpoint(checkpointPath)
+
+    def recoverImages(self, sortedFiles):
+        if not sortedFiles or self.stopEvent.is_set():
+            return
+
+        checkpointPath = os.path.join(self.recoveryFolder, IMAGES_CHECKPOINT)
+        startFrame = self.loadCheckpoint(checkpointPath)
+        self.recoveredFrames += startFrame
+
+        width, height = self.getFrameDimensions(sortedFiles[0])
+        firstTimestamp = os.path.getmtime(
+            os.path.join(self.recoveryFolder, sortedFiles[0])
+        )
+
+        records = (
+            (i, firstTimestamp + i / self.fps, os.path.join(self.recoveryFolder, file))
+            for i, file in enumerate(sortedFiles)
+            if i >= startFrame
+        )
+
+        if self.encodeRecords(records, cv2.imread, checkpointPath, width, height, self.fps):
+            for file in sortedFiles:
+                os.remove(os.path.join(self.recoveryFolder, file))
+            self.removeCheckpoint(checkpointPath)
+
+    def findWork(self):
+        if not os.path.exists(self.recoveryFolder):
+            print(f"Recovery folder '{self.recoveryFolder}' does not exist.")
+            return False
+
+        if not os.path.isdir(self.recoveryFolder):
+            print(f"Path '{self.recoveryFolder}' is not a directory.")
+            return False
+
+        # Snapshot the work now, a recorder may add its own journal later
+        self.journals = self.getJournals()
+        self.images = self.getImages()
+
+        if not self.journals and not self.images:
+            print(
+                f"Recovery folder '{self.recoveryFolder}' is empty. No images to recover."
             )
+            return False
 
-            print("\nStarting recovery...")
+        journalFrames = 0
+        for journal in self.journals:
+            try:
+                journalFrames += RecoveryJournalReader(journal).getIndexedFrameCount()
+            except Exception as e:
+                print(e)
+                logging.error(e)
+                os.remove(journal)
+                self.journals.remove(journal)
 
-            outputFile = os.path.join(self.outputFolder, firstTimestamp)
+        self.totalFrames = max(1, journalFrames + len(self.images))
+        self.recoveredFrames = 0
+        return True
 
-            videoMaker = VideoMaker(outputFile, width, height, self.fps)
+    def recoverVideo(self, findWork=True):
+        previousStatus = self.apiData.status if self.apiData else None
+        try:
+            if self.apiData:
+                self.apiData.status = Status.RECOVERY.value
 
-            total_files = len(sortedFiles)
+            if findWork and not self.findWork():
+                return
+
+            print("\nStarting recovery...")
 
-            for i, file in enumerate(sortedFiles, start=1):
-                image_path = os.path.join(self.recoveryFolder, file)
-                try:
-                    image = cv2.imread(image_path)
-                    videoMaker.writeFrame(image)
-                except Exception as e:
-                    print(f"Exception occured while processing image {image_path}")
-                    print(e)
-                    logging.error(e)
+            self.recoverJournals(self.journals)
 
-                progress = i / total_files * 100
-                if self.apiData:
-                    self.apiData.recoveryPercent = progress
-                print(f"\rProgress: {progress:.2f}%", end="", flush=True)
+            # Frames left behind as loose JPEGs by older versions
+            self.recoverImages(self.images)
 
-            videoMaker.releaseVideo()
-            shutil.rmtree(self.recoveryFolder, ignore_errors=True)
-            print("\nRecovery completed.\n")
+            if self.stopEvent.is_set():
+                print("\nRecovery interrupted, it will resume from the checkpoint.\n")
+            else:
+                print("\nRecovery completed.\n")
         except Exception as e:
             utils.playSound("sounds/error.mp3")
             print(e)
             logging.error(e)
+        finally:
+            # Unless the status was changed meanwhile, e.g. inference started
+            if self.apiData and self.apiData.status == Status.RECOVERY.value:
+                self.apiData.status = previousStatus
 
         pass
 
+    def run(self):
+        utils.lowerThreadPriority()
+        self.recoverVideo(findWork=False)
+
+    # Recover in the background, the pending work is collected before returning
+    # so recording can start right away
+    def start(self):
+        try:
+            if not self.findWork():
+                return
+        except Exception as e:
+            print(e)
+            logging.error(e)
+            return
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread:
+            self.thread.join()
+
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
+
 
 if __name__ == "__main__":
     recoveryFolder = "recovery/"
@@ -3,20 +3,31 @@ import time
 import cv2
 import argparse
 import logging
+from logging.handlers import RotatingFileHandler
 import os
 from inference.light_detection import LightDetection
 import utils.utils as utils
 from api_server import APIServer, Status
 from cleanup.cleanup import Cleanup
+from cleanup.quota_enforcer import QuotaEnforcer
+from storage.storage import Storage
+from storage.storage_index import StorageIndex
+from storage.storage_stats import StorageStats
+from storage.video_catalog import VideoCatalog
 from inference.labels import Label
 from input_output.video_recovery import VideoRecovery
 from input_output.input_source import InputSource
 from input_output.dashcam import Dashcam
 from inference.inference import Inference
+from inference.inference_scheduler import InferenceScheduler
+from inference.light_tracker import LightTracker
+from inference.roi_tiler import RoiTiler
 from constants import (
     CACHE_FOLDER,
     FILE_DURATION,
+    LOG_BACKUP_COUNT,
     LOG_FILENAME,
+    LOG_MAX_BYTES,
     LOGS_FOLDER,
     MAX_FOLDER_SIZE_BYTES,
     OUTPUT_FOLDER,
@@ -27,7 +38,13 @@ from constants import (
 if not os.path.exists(LOGS_FOLDER):
     os.makedirs(LOGS_FOLDER)
 logging.basicConfig(
-    filename=os.path.join(LOGS_FOLDER, LOG_FILENAME),
+    handlers=[
+        RotatingFileHandler(
+            os.path.join(LOGS_FOLDER, LOG_FILENAME),
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+        )
+    ],
     level=logging.ERROR,
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
@@ -49,6 +66,16 @@ MODEL = "models/12thMar2024/traffic_12thMar2024.tflite"
 SCORE_THRESHOLD = 0.3
 MAX_RESULTS = 3
 NUM_THREADS = 2
+# Part of the frame to detect on as (x, y, width, height) fractions, None for
+# the whole frame, and how many (columns, rows) tiles to split it into
+INFERENCE_ROI = None
+INFERENCE_TILES = (1, 1)
+# With tracking the detector runs on every n-th decision frame
+TRACKER_KEYFRAME_INTERVAL = 5
+# "tasklib" (tflite_support), "tflite" (raw interpreter with XNNPACK, frames
+# resized straight into the input tensor) or "onnx" (ONNX Runtime, needs a
+# .onnx MODEL)
+INFERENCE_ENGINE = "tflite"
 
 # Actions
 ACTIONS_DICT = {
@@ -64,32 +91,70 @@ ACTIONS_DICT = {
 
 
 def main(
-    maxFps: float, cameraId, numThreads: int, showPreview: bool, maxInferenceFps: float
+    maxFps: float,
+    cameraId,
+    numThreads: int,
+    showPreview: bool,
+    maxInferenceFps: float,
+    adaptiveInference: bool = False,
+    trackLights: bool = False,
+    pipelinedInference: bool = False,
+    inferenceWorkers: int = 1,
 ):
     try:
         utils.playSound("sounds/startup.mp3", wait=True)
 
+        # Size accounting for recordings and the thumbnail cache
+        storageIndex = StorageIndex(OUTPUT_FOLDER, CACHE_FOLDER)
+        storageIndex.load()
+        storageIndex.reconcile()
+
+        # Metadata of every recording for the gallery
+        videoCatalog = VideoCatalog(OUTPUT_FOLDER)
+        videoCatalog.load()
+        videoCatalog.reconcile(CACHE_FOLDER)
+
+        # Thumbnails, shared so the server and cleanup see the same memory cache
+        storage = Storage(OUTPUT_FOLDER, CACHE_FOLDER, storageIndex, videoCatalog)
+
+        # Usage and projections for /info, updated as segments are finished
+        storageStats = StorageStats(storageIndex, MAX_FOLDER_SIZE_BYTES)
+        storageStats.seedFromCatalog(videoCatalog)
+
         # Start the server
-        apiServer = APIServer()
+        apiServer = APIServer(
+            storageIndex=storageIndex,
+            videoCatalog=videoCatalog,
+            storage=storage,
+            storageStats=storageStats,
+        )
         apiServer.start()
 
-        # Cleanup old video files
+        # Keep old video files within the quota in the background
         cleanup = Cleanup(
             folderPath=OUTPUT_FOLDER,
             cachePath=CACHE_FOLDER,
             targetSizeBytes=MAX_FOLDER_SIZE_BYTES,
             apiData=apiServer.data.inferenceData,
+            storageIndex=storageIndex,
+            videoCatalog=videoCatalog,
+            storage=storage,
         )
-        cleanup.removeOldFiles()
+        quotaEnforcer = QuotaEnforcer(cleanup)
+        quotaEnforcer.start()
+        apiServer.quotaEnforcer = quotaEnforcer
+        storageStats.quotaEnforcer = quotaEnforcer
 
-        # Start recovery as soon as the program starts
+        # Recover interrupted recordings in the background while recording
         videoRecovery = VideoRecovery(
             recoveryFolder=RECOVERY_FOLDER,
             outputFolder=OUTPUT_FOLDER,
             apiData=apiServer.data.inferenceData,
             fps=maxFps,
+            storageIndex=storageIndex,
+            videoCatalog=videoCatalog,
         )
-        videoRecovery.recoverVideo()
+        videoRecovery.start()
 
         # Open input source
         inputSource = InputSource(
@@ -105,10 +170,17 @@ def main(
             outputFolder=OUTPUT_FOLDER,
             recoveryFolder=None,
             fps=maxFps,
+            quotaEnforcer=quotaEnforcer,
+            videoCatalog=videoCatalog,
+            storageStats=storageStats,
         )
         dashcam.start()
 
-        # Start inference
+        # Start inference. With tracking, decisions are made more often for the
+        # same number of detector runs.
+        decisionFps = maxInferenceFps
+        if trackLights:
+            decisionFps = min(maxFps, maxInferenceFps * TRACKER_KEYFRAME_INTERVAL)
         inference = Inference(
             inputSource=inputSource,
             indexPriority=[GREEN.index, YELLOW.index, RED.index, OFF.index],
@@ -117,10 +189,34 @@ def main(
             maxResults=MAX_RESULTS,
             numThreads=numThreads,
             actionsDict=ACTIONS_DICT,
-            maxFps=maxInferenceFps,
+            maxFps=decisionFps,
             categoriesDeniedList=[OFF.name],
             showPreview=showPreview,
             apiData=apiServer.data.inferenceData,
+            tiler=(
+                RoiTiler(INFERENCE_ROI, *INFERENCE_TILES, maxResults=MAX_RESULTS)
+                if INFERENCE_ROI
+                else None
+            ),
+            # maxInferenceFps becomes the average rate, bursts go up to maxFps
+            scheduler=(
+                InferenceScheduler(budgetFps=maxInferenceFps, maxFps=maxFps)
+                if adaptiveInference
+                else None
+            ),
+            tracker=(
+                LightTracker(
+                    keyframeInterval=TRACKER_KEYFRAME_INTERVAL,
+                    categoryIndices={
+                        label.name: label.index for label in (RED, GREEN, YELLOW)
+                    },
+                )
+                if trackLights
+                else None
+            ),
+            engine=INFERENCE_ENGINE,
+            pipelined=pipelinedInference,
+            workers=inferenceWorkers,
         )
 
         # Start light detection
@@ -159,6 +255,13 @@ def main(
             print(f"Error setting status to IDLE: {e}")
             logging.error(f"Error setting status to IDLE: {e}")
 
+        try:
+            videoRecovery.stop()
+        except Exception as e:
+            utils.playSound("sounds/error.mp3")
+            print(f"Error stopping video recovery: {e}")
+            logging.error(f"Error stopping video recovery: {e}")
+
         try:
             lightDetection.stop()
         except Exception as e:
@@ -194,6 +297,13 @@ def main(
             print(f"Error stopping input source: {e}")
             logging.error(f"Error stopping input source: {e}")
 
+        try:
+            quotaEnforcer.stop()
+        except Exception as e:
+            utils.playSound("sounds/error.mp3")
+            print(f"Error stopping quota enforcer: {e}")
+            logging.error(f"Error stopping quota enforcer: {e}")
+
         try:
             apiServer.stop()
         except Exception as e:
@@ -240,6 +350,31 @@ if __name__ == "__main__":
         required=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--adaptiveInference",
+        help="Run inference faster while the scene changes and slower while it is static, averaging maxInferenceFps.",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--trackLights",
+        help="Track detected lights between detector runs to decide more often.",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pipelinedInference",
+        help="Run capture, detection and the decision on separate threads so they overlap.",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--inferenceWorkers",
+        help="Number of inference processes, frames are merged back in order. NUM_THREADS is shared between them.",
+        required=False,
+        type=int,
+        default=1,
+    )
     args = parser.parse_args()
 
     if args.maxInferenceFps is None:
@@ -254,6 +389,10 @@ if __name__ == "__main__":
                     numThreads=args.numThreads,
                     showPreview=args.showPreview,
                     maxInferenceFps=args.maxInferenceFps,
+                    adaptiveInference=args.adaptiveInference,
+                    trackLights=args.trackLights,
+                    pipelinedInference=args.pipelinedInference,
+                    inferenceWorkers=args.inferenceWorkers,
                 )
                 == True
             ):
@@ -1,32 +1,148 @@
 import logging
 import os
+import threading
+from collections import OrderedDict
 import cv2
+import numpy as np
 import shutil
 
+# Thumbnail variants, "large" keeps the original cache file name
+THUMBNAIL_SIZES = {
+    "large": (480, 270),
+    "small": (240, 135),
+}
+SPRITE_FRAME_SIZE = (160, 90)
+
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.items.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous)
+            self.items[key] = value
+            self.current_bytes += len(value)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def remove(self, key):
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.current_bytes -= len(value)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.current_bytes = 0
+
 
 class Storage:
-    def __init__(self, output_folder, cache_folder):
+    def __init__(
+        self,
+        output_folder,
+        cache_folder,
+        storage_index=None,
+        video_catalog=None,
+        memory_cache_bytes=8 * 1024 * 1024,
+    ):
         self.output_folder = output_folder
         self.cache_folder = cache_folder
+        self.storage_index = storage_index
+        self.video_catalog = video_catalog
+        self.memory_cache = LRUCache(memory_cache_bytes)
 
         # Ensure the cache folder exists
         if not os.path.exists(self.cache_folder):
             os.makedirs(self.cache_folder)
 
-    def getVideoThumbnail(self, video_name: str):
-        video_path = os.path.join(self.output_folder, video_name)
+    def getThumbnailPath(self, video_name: str, variant="large"):
         image_name, _ = os.path.splitext(video_name)
-        thumbnail_path = os.path.join(self.cache_folder, f"{image_name}.jpg")
+        suffix = "" if variant == "large" else f"_{variant}"
+        return os.path.join(self.cache_folder, f"{image_name}{suffix}.jpg")
+
+    def readCachedImage(self, path):
+        image = self.memory_cache.get(path)
+        if image is not None:
+            return image
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "rb") as f:
+            image = f.read()
+        self.memory_cache.put(path, image)
+        return image
+
+    def writeCachedImage(self, path, image: np.ndarray):
+        _, buffer = cv2.imencode(".jpg", image)
+        image_bytes = buffer.tobytes()
+
+        with open(path, "wb") as f:
+            f.write(image_bytes)
+        self.memory_cache.put(path, image_bytes)
+        if self.storage_index:
+            self.storage_index.addCacheFile(path)
+        return image_bytes
+
+    # Called when a segment closes, with frames the recorder already holds, so
+    # the gallery never has to decode a video
+    def saveThumbnails(self, video_name: str, frame: np.ndarray, sprite_frames=None):
+        try:
+            for variant, size in THUMBNAIL_SIZES.items():
+                self.writeCachedImage(
+                    self.getThumbnailPath(video_name, variant),
+                    cv2.resize(frame, size, interpolation=cv2.INTER_AREA),
+                )
+
+            if sprite_frames:
+                sprite = np.hstack(
+                    [
+                        cv2.resize(f, SPRITE_FRAME_SIZE, interpolation=cv2.INTER_AREA)
+                        for f in sprite_frames
+                    ]
+                )
+                self.writeCachedImage(self.getThumbnailPath(video_name, "sprite"), sprite)
+
+            if self.video_catalog:
+                self.video_catalog.setThumbnail(video_name)
+        except Exception as e:
+            print(e)
+            logging.error(e)
+
+    def getVideoThumbnail(self, video_name: str, size="large"):
+        if size not in THUMBNAIL_SIZES:
+            return None
+
+        video_path = os.path.join(self.output_folder, video_name)
+        thumbnail_path = self.getThumbnailPath(video_name, size)
 
         # Check if the thumbnail is already cached
-        if os.path.exists(thumbnail_path):
-            with open(thumbnail_path, "rb") as f:
-                return f.read()
+        thumbnail_bytes = self.readCachedImage(thumbnail_path)
+        if thumbnail_bytes is not None:
+            return thumbnail_bytes
 
         if not os.path.exists(video_path):
             return None
 
-        # Generate the thumbnail if not cached
+        # Generate the thumbnail if not cached, only needed for videos that were
+        # recorded before thumbnails were saved at segment close
         try:
             cap = cv2.VideoCapture(video_path)
             success, frame = cap.read()
@@ -35,16 +151,11 @@ class Storage:
             if not success:
                 return None
 
-            # Resize the frame to 480 x 270
-            resized_frame = cv2.resize(frame, (480, 270))
-
-            # Encode the resized frame as a JPEG image
-            _, buffer = cv2.imencode(".jpg", resized_frame)
-            thumbnail_bytes = buffer.tobytes()
-
-            # Save the thumbnail to the cache folder
-            with open(thumbnail_path, "wb") as f:
-                f.write(thumbnail_bytes)
+            thumbnail_bytes = self.writeCachedImage(
+                thumbnail_path, cv2.resize(frame, THUMBNAIL_SIZES[size])
+            )
+            if self.video_catalog and size == "large":
+                self.video_catalog.setThumbnail(video_name)
 
             return thumbnail_bytes
 
@@ -53,18 +164,33 @@ class Storage:
             # Don't log this exception
             return None
 
+    def getVideoSprite(self, video_name: str):
+        return self.readCachedImage(self.getThumbnailPath(video_name, "sprite"))
+
     def deleteVideoThumbnail(self, video_name: str):
-        image_name, _ = os.path.splitext(video_name)
-        thumbnail_path = os.path.join(self.cache_folder, f"{image_name}.jpg")
+        deleted = False
+        for variant in list(THUMBNAIL_SIZES.keys()) + ["sprite"]:
+            thumbnail_path = self.getThumbnailPath(video_name, variant)
+            self.memory_cache.remove(thumbnail_path)
+
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+                if self.storage_index:
+                    self.storage_index.removeCacheFile(os.path.basename(thumbnail_path))
+                deleted = True
 
-        if os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
-            return True
-        return False
+        if deleted and self.video_catalog:
+            self.video_catalog.setThumbnail(video_name, False)
+        return deleted
 
     def deleteCache(self):
+        self.memory_cache.clear()
         if os.path.exists(self.cache_folder):
             shutil.rmtree(self.cache_folder)
+            if self.storage_index:
+                self.storage_index.clearCache()
+            if self.video_catalog:
+                self.video_catalog.clearThumbnails()
             print(f"Cache folder '{self.cache_folder}' deleted successfully.")
             os.makedirs(self.cache_folder)
             print(f"Cache folder '{self.cache_folder}' recreated successfully.")
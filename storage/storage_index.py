@@ -0,0 +1,191 @@
+import heapq
+import json
+import logging
+import os
+import threading
+from datetime import date
+from constants import STORAGE_INDEX_FILE
+
+
+class StorageIndex:
+    def __init__(self, outputFolder, cacheFolder, indexFile=STORAGE_INDEX_FILE):
+        self.outputFolder = outputFolder
+        self.cacheFolder = cacheFolder
+        self.indexFile = indexFile
+        self.lock = threading.RLock()
+
+        # name -> (size, mtime)
+        self.recordings = {}
+        # name -> size
+        self.cache = {}
+        # (mtime, name) ordered by age, stale entries are skipped when popped
+        self.heap = []
+        # ISO date -> bytes of recordings last written that day
+        self.dailyUsage = {}
+        self.recordingsSize = 0
+        self.cacheSize = 0
+
+    def load(self):
+        try:
+            with open(self.indexFile, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        with self.lock:
+            self.recordings = {
+                name: tuple(entry) for name, entry in data["recordings"].items()
+            }
+            self.cache = dict(data["cache"])
+            self.rebuild()
+        return True
+
+    # The lock is held for the whole write, concurrent saves would otherwise
+    # share the temporary file or publish an older state over a newer one
+    def save(self):
+        with self.lock:
+            data = {"recordings": self.recordings, "cache": self.cache}
+            try:
+                temporaryFile = self.indexFile + ".tmp"
+                with open(temporaryFile, "w") as f:
+                    json.dump(data, f)
+                os.replace(temporaryFile, self.indexFile)
+            except OSError as e:
+                print(e)
+                logging.error(e)
+
+    @staticmethod
+    def scanFolder(folder, known=None):
+        # Entries already in the index are trusted, only new files are stat'ed.
+        # Finished recordings and thumbnails are never modified in place.
+        known = known or {}
+        files = {}
+        if not os.path.exists(folder):
+            return files
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for f in filenames:
+                name = os.path.relpath(os.path.join(dirpath, f), folder)
+                if name in known:
+                    files[name] = known[name]
+                    continue
+                stat = os.stat(os.path.join(dirpath, f))
+                files[name] = (stat.st_size, stat.st_mtime)
+        return files
+
+    # Walk both folders and bring the index in line with the disk, only needed
+    # once at startup. Call load() first to skip stat calls for known files.
+    def reconcile(self):
+        with self.lock:
+            knownRecordings = dict(self.recordings)
+            knownCache = {name: (size, 0) for name, size in self.cache.items()}
+
+        recordings = self.scanFolder(self.outputFolder, knownRecordings)
+        cache = {
+            name: size
+            for name, (size, _) in self.scanFolder(self.cacheFolder, knownCache).items()
+        }
+        with self.lock:
+            self.recordings = recordings
+            self.cache = cache
+            self.rebuild()
+        self.save()
+
+    def rebuild(self):
+        self.heap = [(mtime, name) for name, (_, mtime) in self.recordings.items()]
+        heapq.heapify(self.heap)
+        self.dailyUsage = {}
+        for size, mtime in self.recordings.values():
+            self.updateDailyUsage(mtime, size)
+        self.recordingsSize = sum(size for size, _ in self.recordings.values())
+        self.cacheSize = sum(self.cache.values())
+
+    def updateDailyUsage(self, mtime, size):
+        day = date.fromtimestamp(mtime).isoformat()
+        usage = self.dailyUsage.get(day, 0) + size
+        if usage > 0:
+            self.dailyUsage[day] = usage
+        else:
+            self.dailyUsage.pop(day, None)
+
+    # Returns the size of the recording in bytes
+    def addRecording(self, path):
+        name = os.path.basename(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 0
+        with self.lock:
+            previous = self.recordings.get(name)
+            if previous:
+                self.recordingsSize -= previous[0]
+                self.updateDailyUsage(previous[1], -previous[0])
+            self.recordings[name] = (stat.st_size, stat.st_mtime)
+            self.recordingsSize += stat.st_size
+            self.updateDailyUsage(stat.st_mtime, stat.st_size)
+            heapq.heappush(self.heap, (stat.st_mtime, name))
+        return stat.st_size
+
+    def removeRecording(self, name):
+        with self.lock:
+            entry = self.recordings.pop(name, None)
+            if entry:
+                self.recordingsSize -= entry[0]
+                self.updateDailyUsage(entry[1], -entry[0])
+            return entry
+
+    # Removes the oldest recording from the index and returns its name
+    def popOldestRecording(self):
+        with self.lock:
+            while self.heap:
+                mtime, name = heapq.heappop(self.heap)
+                entry = self.recordings.get(name)
+                if entry is None or entry[1] != mtime:
+                    continue
+                self.removeRecording(name)
+                return name
+            return None
+
+    def addCacheFile(self, path):
+        name = os.path.basename(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self.lock:
+            self.cacheSize += size - self.cache.get(name, 0)
+            self.cache[name] = size
+
+    def removeCacheFile(self, name):
+        with self.lock:
+            self.cacheSize -= self.cache.pop(name, 0)
+
+    def clearCache(self):
+        with self.lock:
+            self.cache = {}
+            self.cacheSize = 0
+
+    def getRecordingsSize(self):
+        return self.recordingsSize
+
+    def getCacheSize(self):
+        return self.cacheSize
+
+    def getTotalSize(self):
+        with self.lock:
+            return self.recordingsSize + self.cacheSize
+
+    def getRecordingsCount(self):
+        return len(self.recordings)
+
+    def getDailyUsage(self):
+        with self.lock:
+            return dict(sorted(self.dailyUsage.items()))
+
+
+if __name__ == "__main__":
+    storageIndex = StorageIndex("recordings", "cache", "test_storage_index.json")
+    storageIndex.reconcile()
+    print(f"Recordings: {len(storageIndex.recordings)}, {storageIndex.getRecordingsSize()} bytes")
+    print(f"Cache: {len(storageIndex.cache)}, {storageIndex.getCacheSize()} bytes")
+    print(f"Oldest recording: {storageIndex.popOldestRecording()}")
+    os.remove("test_storage_index.json")
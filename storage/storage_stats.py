@@ -0,0 +1,98 @@
+import os
+import shutil
+import threading
+import time
+from storage.storage_index import StorageIndex
+
+
+class StorageStats:
+    # Read side of the storage index for /info. Sizes are kept up to date by
+    # the index, free space is sampled at most every freeSpaceInterval seconds.
+    def __init__(
+        self,
+        storageIndex: StorageIndex,
+        targetSizeBytes: int,
+        freeSpaceInterval: float = 30,
+        bitrateSmoothing: float = 0.2,
+    ) -> None:
+        self.storageIndex = storageIndex
+        self.targetSizeBytes = targetSizeBytes
+        self.freeSpaceInterval = freeSpaceInterval
+        self.bitrateSmoothing = bitrateSmoothing
+        self.lock = threading.Lock()
+
+        self.freeBytes = None
+        self.freeBytesTime = 0
+        # Bytes per recorded second, averaged over the latest segments
+        self.bitrate = None
+        # Set by the owner, cleanup starts at its high watermark, not the quota
+        self.quotaEnforcer = None
+
+    def getFreeBytes(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.freeBytes is None or now - self.freeBytesTime > self.freeSpaceInterval:
+                try:
+                    self.freeBytes = shutil.disk_usage(self.storageIndex.outputFolder).free
+                except OSError:
+                    self.freeBytes = None
+                self.freeBytesTime = now
+            return self.freeBytes
+
+    # Called for every finished segment
+    def recordSegment(self, size: int, duration: float):
+        if not duration or duration <= 0 or size <= 0:
+            return
+        with self.lock:
+            bitrate = size / duration
+            if self.bitrate is None:
+                self.bitrate = bitrate
+            else:
+                self.bitrate += self.bitrateSmoothing * (bitrate - self.bitrate)
+
+    # Starts the bitrate estimate from the latest recordings, so projections
+    # are available right after startup
+    def seedFromCatalog(self, videoCatalog, segments: int = 10):
+        videos, _ = videoCatalog.query(limit=segments)
+        for video in reversed(videos):
+            self.recordSegment(video["size"], video["duration"])
+
+    def getHours(self, sizeBytes):
+        if not self.bitrate or sizeBytes is None:
+            return None
+        return max(0, sizeBytes) / self.bitrate / 3600
+
+    def getStats(self):
+        recordingsSize = self.storageIndex.getRecordingsSize()
+        totalSize = self.storageIndex.getTotalSize()
+        freeBytes = self.getFreeBytes()
+
+        # Space recordings can still grow into before cleanup starts deleting
+        limitBytes = self.targetSizeBytes
+        if self.quotaEnforcer:
+            limitBytes = self.quotaEnforcer.highWatermarkBytes
+        availableBytes = limitBytes - totalSize
+        if freeBytes is not None:
+            availableBytes = min(availableBytes, freeBytes)
+
+        return {
+            "recordingsSize": recordingsSize,
+            "recordingsCount": self.storageIndex.getRecordingsCount(),
+            "cacheSize": self.storageIndex.getCacheSize(),
+            "maxRecordingsSize": self.targetSizeBytes,
+            "freeBytes": freeBytes,
+            "bytesPerSecond": self.bitrate,
+            "hoursRemaining": self.getHours(availableBytes),
+            # Hours of footage kept once the quota is full
+            "retentionHours": self.getHours(self.targetSizeBytes),
+            "dailyUsage": self.storageIndex.getDailyUsage(),
+        }
+
+
+if __name__ == "__main__":
+    storageIndex = StorageIndex("recordings", "cache", "test_storage_index.json")
+    storageIndex.reconcile()
+    storageStats = StorageStats(storageIndex, 32 * 1024 * 1024 * 1024)
+    storageStats.recordSegment(100 * 1024 * 1024, 600)
+    print(storageStats.getStats())
+    os.remove("test_storage_index.json")
@@ -0,0 +1,243 @@
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import cv2
+from constants import CATALOG_FILE
+
+
+def probeVideo(path):
+    # Fallback for files the recorder did not report, e.g. after an upgrade
+    capture = cv2.VideoCapture(path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0
+        frameCount = capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+        fourcc = int(capture.get(cv2.CAP_PROP_FOURCC))
+        return {
+            "duration": frameCount / fps if fps else None,
+            "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "codec": "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip(
+                "\0"
+            ),
+        }
+    finally:
+        capture.release()
+
+
+class VideoCatalog:
+    def __init__(self, outputFolder, catalogFile=CATALOG_FILE):
+        self.outputFolder = outputFolder
+        self.catalogFile = catalogFile
+        self.lock = threading.RLock()
+        # name -> entry
+        self.entries = {}
+        # (startTimestamp, name) in ascending order
+        self.order = []
+        # Bumped on every change, used as the ETag of catalog responses. The
+        # version restarts at every boot, the nonce keeps an ETag from a
+        # previous run from matching a different catalog.
+        self.version = 0
+        self.bootId = os.urandom(4).hex()
+
+    @staticmethod
+    def getStartTimestamp(name, path=None):
+        match = re.match(r"(\d+)", name)
+        if match:
+            return int(match.group(1))
+        return int(os.path.getmtime(path)) if path else 0
+
+    def load(self):
+        try:
+            with open(self.catalogFile, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        with self.lock:
+            self.entries = {entry["name"]: entry for entry in entries}
+            self.rebuild()
+        return True
+
+    # The lock is held for the whole write, concurrent saves would otherwise
+    # share the temporary file or publish an older state over a newer one
+    def save(self):
+        with self.lock:
+            entries = [self.entries[name] for _, name in self.order]
+            try:
+                temporaryFile = self.catalogFile + ".tmp"
+                with open(temporaryFile, "w") as f:
+                    json.dump(entries, f)
+                os.replace(temporaryFile, self.catalogFile)
+            except OSError as e:
+                print(e)
+                logging.error(e)
+
+    def rebuild(self):
+        self.order = sorted(
+            (entry["startTimestamp"], name) for name, entry in self.entries.items()
+        )
+        self.version += 1
+
+    # One directory listing at startup, unknown files are probed once
+    def reconcile(self, thumbnailFolder=None):
+        if not os.path.exists(self.outputFolder):
+            return
+        names = set(os.listdir(self.outputFolder))
+        with self.lock:
+            for name in list(self.entries.keys()):
+                if name not in names:
+                    del self.entries[name]
+            unknown = [name for name in names if name not in self.entries]
+
+        for name in unknown:
+            path = os.path.join(self.outputFolder, name)
+            try:
+                self.addVideo(path, save=False, **probeVideo(path))
+            except Exception as e:
+                print(e)
+                logging.error(e)
+
+        if thumbnailFolder:
+            thumbnails = set()
+            if os.path.exists(thumbnailFolder):
+                thumbnails = set(os.listdir(thumbnailFolder))
+            with self.lock:
+                for name, entry in self.entries.items():
+                    entry["hasThumbnail"] = f"{os.path.splitext(name)[0]}.jpg" in thumbnails
+
+        with self.lock:
+            self.rebuild()
+        self.save()
+
+    def addVideo(
+        self,
+        path,
+        startTimestamp=None,
+        duration=None,
+        width=None,
+        height=None,
+        codec=None,
+        hasThumbnail=False,
+        save=True,
+    ):
+        name = os.path.basename(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+
+        if startTimestamp is None:
+            startTimestamp = self.getStartTimestamp(name, path)
+
+        entry = {
+            "name": name,
+            "startTimestamp": startTimestamp,
+            "duration": duration,
+            "size": size,
+            "width": width,
+            "height": height,
+            "codec": codec,
+            "hasThumbnail": hasThumbnail,
+        }
+        with self.lock:
+            previous = self.entries.get(name)
+            if previous:
+                self.order.remove((previous["startTimestamp"], name))
+                entry["hasThumbnail"] = entry["hasThumbnail"] or previous["hasThumbnail"]
+            self.entries[name] = entry
+            bisect.insort(self.order, (startTimestamp, name))
+            self.version += 1
+
+        if save:
+            self.save()
+        return entry
+
+    def removeVideo(self, name, save=False):
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is None:
+                return
+            index = bisect.bisect_left(self.order, (entry["startTimestamp"], name))
+            if index < len(self.order) and self.order[index][1] == name:
+                del self.order[index]
+            self.version += 1
+        if save:
+            self.save()
+
+    def setThumbnail(self, name, hasThumbnail=True):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry and entry["hasThumbnail"] != hasThumbnail:
+                entry["hasThumbnail"] = hasThumbnail
+                self.version += 1
+
+    def clearThumbnails(self):
+        with self.lock:
+            for entry in self.entries.values():
+                entry["hasThumbnail"] = False
+            self.version += 1
+
+    def getNames(self):
+        with self.lock:
+            return [name for _, name in self.order]
+
+    def getETag(self):
+        return f'"catalog-{self.bootId}-{self.version}"'
+
+    @staticmethod
+    def encodeCursor(key):
+        return f"{key[0]}:{key[1]}"
+
+    @staticmethod
+    def decodeCursor(cursor):
+        timestamp, name = cursor.split(":", 1)
+        return float(timestamp), name
+
+    # Newest first by default. The cursor is the key of the last entry returned,
+    # the next page starts right after it.
+    def query(
+        self,
+        limit=50,
+        cursor=None,
+        fromTimestamp=None,
+        toTimestamp=None,
+        newestFirst=True,
+    ):
+        with self.lock:
+            order = self.order
+            low, high = 0, len(order)
+            if fromTimestamp is not None:
+                low = bisect.bisect_left(order, (fromTimestamp,))
+            if toTimestamp is not None:
+                high = bisect.bisect_right(order, (toTimestamp, "\uffff"))
+
+            if cursor:
+                key = self.decodeCursor(cursor)
+                if newestFirst:
+                    high = min(high, bisect.bisect_left(order, key))
+                else:
+                    low = max(low, bisect.bisect_right(order, key))
+
+            if newestFirst:
+                keys = order[max(low, high - limit):high][::-1]
+            else:
+                keys = order[low:min(high, low + limit)]
+
+            videos = [dict(self.entries[name]) for _, name in keys]
+            remaining = (high - low) > len(keys)
+
+        nextCursor = self.encodeCursor(keys[-1]) if keys and remaining else None
+        return videos, nextCursor
+
+
+if __name__ == "__main__":
+    catalog = VideoCatalog("recordings", "test_catalog.json")
+    catalog.reconcile("cache")
+    videos, nextCursor = catalog.query(limit=5)
+    for video in videos:
+        print(video)
+    print(f"Next cursor: {nextCursor}")
+    os.remove("test_catalog.json")
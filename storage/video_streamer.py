@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+import time
+from email.utils import formatdate
+from flask import Request, Response
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class TokenBucket:
+    # Shared by every download, so the total rate stays bounded however many
+    # clients are connected
+    def __init__(self, bytesPerSecond: int, burstBytes: int = None) -> None:
+        self.rate = bytesPerSecond
+        self.capacity = burstBytes or bytesPerSecond
+        self.tokens = self.capacity
+        self.lastTime = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.lastTime) * self.rate
+                )
+                self.lastTime = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                waitTime = (amount - self.tokens) / self.rate
+            time.sleep(waitTime)
+
+
+class VideoStreamer:
+    def __init__(
+        self,
+        folder: str,
+        chunkSize: int = 256 * 1024,
+        maxBytesPerSecond: int = None,
+        mimetype: str = "video/mkv",
+        stopEvent: threading.Event = None,
+    ) -> None:
+        self.folder = folder
+        # Ends running downloads when the server shuts down
+        self.stopEvent = stopEvent
+        self.chunkSize = chunkSize
+        self.mimetype = mimetype
+        self.bucket = None
+        if maxBytesPerSecond:
+            self.bucket = TokenBucket(maxBytesPerSecond, max(chunkSize, maxBytesPerSecond))
+
+    @staticmethod
+    def getETag(stat):
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    # Returns (start, end) inclusive, None for a full response, raises ValueError
+    # when the range cannot be satisfied. Only the first range of a list is used.
+    @staticmethod
+    def parseRange(header: str, size: int):
+        if not header:
+            return None
+        match = _RANGE_PATTERN.match(header.split(",")[0].strip())
+        if not match:
+            return None
+
+        first, last = match.groups()
+        if first == "" and last == "":
+            return None
+        if size == 0:
+            # No byte of an empty file can be served, not even a suffix
+            raise ValueError("Empty file")
+        if first == "":
+            length = int(last)
+            if length == 0:
+                raise ValueError("Empty suffix range")
+            return max(0, size - length), size - 1
+
+        start = int(first)
+        end = size - 1 if last == "" else min(int(last), size - 1)
+        if start >= size or start > end:
+            raise ValueError("Range not satisfiable")
+        return start, end
+
+    def readChunks(self, path: str, start: int, length: int):
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                if self.stopEvent and self.stopEvent.is_set():
+                    return
+                size = min(self.chunkSize, remaining)
+                if self.bucket:
+                    self.bucket.consume(size)
+                data = f.read(size)
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+
+    def createResponse(self, videoName: str, request: Request):
+        if os.path.basename(videoName) != videoName:
+            return Response("Video not found", status=404)
+
+        path = os.path.join(self.folder, videoName)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return Response("Video not found", status=404)
+
+        size = stat.st_size
+        etag = self.getETag(stat)
+        lastModified = formatdate(stat.st_mtime, usegmt=True)
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Last-Modified": lastModified,
+            "Cache-Control": "no-cache",
+        }
+
+        ifNoneMatch = request.headers.get("If-None-Match")
+        if ifNoneMatch and etag in [tag.strip() for tag in ifNoneMatch.split(",")]:
+            return Response(status=304, headers=headers)
+
+        rangeHeader = request.headers.get("Range")
+        ifRange = request.headers.get("If-Range")
+        if ifRange and ifRange.strip() not in (etag, lastModified):
+            # The file changed since the client's partial copy, send all of it
+            rangeHeader = None
+
+        try:
+            byteRange = self.parseRange(rangeHeader, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+
+        if byteRange is None:
+            start, end, status = 0, size - 1, 200
+        else:
+            start, end = byteRange
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+        length = end - start + 1
+        headers["Content-Length"] = str(length)
+
+        fileWrapper = request.environ.get("wsgi.file_wrapper")
+        if status == 200 and self.bucket is None and fileWrapper is not None:
+            # Servers that implement wsgi.file_wrapper can use sendfile here
+            body = fileWrapper(open(path, "rb"), self.chunkSize)
+        else:
+            body = self.readChunks(path, start, length)
+
+        return Response(
+            body,
+            status=status,
+            headers=headers,
+            mimetype=self.mimetype,
+            direct_passthrough=True,
+        )
@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import deque
+from werkzeug.serving import make_server
+
+try:
+    from cheroot import wsgi as cherootWsgi
+except ImportError:
+    cherootWsgi = None
+
+
+class StreamLimiter:
+    # WSGI middleware that caps the responses which stay open for minutes
+    # (event streams, followed logs). Each one holds a server thread, so past
+    # maxStreams they get a 503 instead of starving the other requests.
+    # Everything else, video range requests included, is left to the pool.
+    def __init__(self, app, maxStreams: int, isStreamingRequest) -> None:
+        self.app = app
+        self.maxStreams = maxStreams
+        self.isStreamingRequest = isStreamingRequest
+        self.lock = threading.Lock()
+        self.openStreams = 0
+        self.rejectedStreams = 0
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        query = environ.get("QUERY_STRING", "")
+        if not self.isStreamingRequest(f"{path}?{query}" if query else path):
+            return self.app(environ, start_response)
+
+        with self.lock:
+            if self.openStreams >= self.maxStreams:
+                self.rejectedStreams += 1
+                start_response(
+                    "503 Service Unavailable",
+                    [("Content-Type", "text/plain"), ("Retry-After", "5")],
+                )
+                return [b"Too many open streams"]
+            self.openStreams += 1
+        try:
+            return StreamResponse(self.app(environ, start_response), self.release)
+        except Exception:
+            self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            self.openStreams -= 1
+
+
+class StreamResponse:
+    # Response iterable that frees its stream once the server closes it, which
+    # WSGI servers do when the body ends or the client goes away
+    def __init__(self, iterable, onClose) -> None:
+        self.iterable = iterable
+        self.onClose = onClose
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, "close"):
+                self.iterable.close()
+        finally:
+            if self.onClose:
+                self.onClose()
+                self.onClose = None
+
+
+class PooledServer:
+    # cheroot's thread pool server: a fixed number of workers, idle keep-alive
+    # connections wait in its selector instead of holding a worker, and
+    # connections it cannot queue get a 503. Streams are capped by the
+    # StreamLimiter and get threads of their own on top of the workers, so
+    # they can never take all of them.
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        app,
+        workers: int = 8,
+        maxConnections: int = 32,
+        keepAliveTimeout: float = 5,
+        maxStreams: int = 4,
+    ) -> None:
+        if cherootWsgi is None:
+            raise RuntimeError(
+                "The pooled API server needs cheroot: pip install cheroot"
+            )
+        self.workers = workers
+        self.maxConnections = maxConnections
+        self.server = cherootWsgi.Server(
+            (host, port),
+            app,
+            numthreads=workers + maxStreams,
+            max=workers + maxStreams,
+            timeout=keepAliveTimeout,
+            accepted_queue_size=maxConnections,
+            accepted_queue_timeout=1,
+        )
+        self.server.keep_alive_conn_limit = maxConnections
+
+    def serve_forever(self):
+        self.server.safe_start()
+
+    # Stops accepting, lets the requests in flight finish and waits for the
+    # workers, up to the server's shutdown timeout
+    def shutdown(self):
+        self.server.stop()
+
+    def getStats(self):
+        pool = self.server.requests
+        return {
+            "workers": self.workers,
+            "idleWorkers": pool.idle,
+            "queuedConnections": pool.qsize,
+            "maxConnections": self.maxConnections,
+        }
+
+
+def createServer(
+    backend: str,
+    app,
+    host: str = "0.0.0.0",
+    port: int = 5000,
+    workers: int = 8,
+    maxConnections: int = 32,
+    keepAliveTimeout: float = 5,
+    maxStreams: int = 4,
+):
+    if backend == "pooled":
+        return PooledServer(
+            host, port, app, workers, maxConnections, keepAliveTimeout, maxStreams
+        )
+    if backend == "werkzeug":
+        # One thread per connection, as with app.run(threaded=True)
+        return make_server(host, port, app, threaded=True)
+    raise ValueError(f"Unknown server backend: {backend}")
+
+
+class RequestMetrics:
+    # Per route counters and a window of recent latencies for percentiles
+    def __init__(self, window: int = 256) -> None:
+        self.window = window
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route: str, status: int, latency: float):
+        with self.lock:
+            metrics = self.routes.get(route)
+            if metrics is None:
+                metrics = {
+                    "count": 0,
+                    "errors": 0,
+                    "totalLatency": 0,
+                    "maxLatency": 0,
+                    "latencies": deque(maxlen=self.window),
+                }
+                self.routes[route] = metrics
+            metrics["count"] += 1
+            if status >= 500:
+                metrics["errors"] += 1
+            metrics["totalLatency"] += latency
+            metrics["maxLatency"] = max(metrics["maxLatency"], latency)
+            metrics["latencies"].append(latency)
+
+    @staticmethod
+    def getPercentile(values, percentile):
+        if not values:
+            return None
+        index = min(len(values) - 1, int(len(values) * percentile))
+        return values[index]
+
+    def getMetrics(self):
+        with self.lock:
+            snapshot = {
+                route: (dict(metrics), sorted(metrics["latencies"]))
+                for route, metrics in self.routes.items()
+            }
+        result = {}
+        for route, (metrics, latencies) in snapshot.items():
+            result[route] = {
+                "count": metrics["count"],
+                "errors": metrics["errors"],
+                "meanLatency": metrics["totalLatency"] / metrics["count"],
+                "maxLatency": metrics["maxLatency"],
+                "p50Latency": self.getPercentile(latencies, 0.5),
+                "p95Latency": self.getPercentile(latencies, 0.95),
+            }
+        return result
+
+
+if __name__ == "__main__":
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "2")])
+        return [b"ok"]
+
+    server = createServer("pooled", app, "127.0.0.1", 5001)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    print("Serving on http://127.0.0.1:5001 for 10 seconds")
+    time.sleep(10)
+    server.shutdown()
+    thread.join()
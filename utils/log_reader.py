@@ -0,0 +1,130 @@
+import os
+import time
+
+
+class LogReader:
+    # Reads the log in bounded blocks, so the cost of a request depends on how
+    # much is asked for, not on how large the log is
+    def __init__(self, path: str, blockSize: int = 8192) -> None:
+        self.path = path
+        self.blockSize = blockSize
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def getSize(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    # Returns (offset, data) with the last `lines` lines of the log, offset is
+    # where the returned data starts
+    def tail(self, lines: int):
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            position = end
+            blocks = []
+            newlines = 0
+            while position > 0 and newlines <= lines:
+                size = min(self.blockSize, position)
+                position -= size
+                f.seek(position)
+                block = f.read(size)
+                blocks.insert(0, block)
+                newlines += block.count(b"\n")
+
+        data = b"".join(blocks)
+        # A trailing newline ends the last line, it does not start a new one
+        parts = data.split(b"\n")
+        if parts and parts[-1] == b"":
+            parts.pop()
+            suffix = b"\n"
+        else:
+            suffix = b""
+        kept = parts[-lines:] if lines > 0 else []
+        result = b"\n".join(kept) + suffix if kept else b""
+        return end - len(result), result
+
+    def readRange(self, offset: int, length: int = None):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                size = self.blockSize if remaining is None else min(self.blockSize, remaining)
+                data = f.read(size)
+                if not data:
+                    return
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    # Yields (offset, nextOffset, line) for every complete line written after
+    # `offset`, both raw byte offsets in the file (the decoded line can have
+    # another length, e.g. after invalid bytes are replaced), and
+    # None every heartbeatInterval seconds without new lines so the caller can
+    # keep the connection alive. Starts over when the log is rotated.
+    def follow(
+        self,
+        offset: int = None,
+        stopEvent=None,
+        pollInterval: float = 0.5,
+        heartbeatInterval: float = 15,
+    ):
+        f = None
+        inode = None
+        partial = b""
+        lastYield = time.monotonic()
+        try:
+            while stopEvent is None or not stopEvent.is_set():
+                if f is None:
+                    try:
+                        f = open(self.path, "rb")
+                    except FileNotFoundError:
+                        time.sleep(pollInterval)
+                        continue
+                    inode = os.fstat(f.fileno()).st_ino
+                    size = os.fstat(f.fileno()).st_size
+                    if offset is None or offset > size:
+                        offset = size
+                    f.seek(offset)
+
+                data = f.read(self.blockSize)
+                if data:
+                    partial += data
+                    while b"\n" in partial:
+                        line, partial = partial.split(b"\n", 1)
+                        nextOffset = offset + len(line) + 1
+                        yield offset, nextOffset, line.decode(errors="replace")
+                        offset = nextOffset
+                    lastYield = time.monotonic()
+                    continue
+
+                try:
+                    stat = os.stat(self.path)
+                    rotated = stat.st_ino != inode or stat.st_size < offset
+                except FileNotFoundError:
+                    rotated = True
+                if rotated:
+                    f.close()
+                    f = None
+                    offset = 0
+                    partial = b""
+                    continue
+
+                if time.monotonic() - lastYield >= heartbeatInterval:
+                    lastYield = time.monotonic()
+                    yield None
+                time.sleep(pollInterval)
+        finally:
+            if f:
+                f.close()
+
+
+if __name__ == "__main__":
+    logReader = LogReader("logs/error.log")
+    if logReader.exists():
+        offset, data = logReader.tail(10)
+        print(f"Last 10 lines from offset {offset}:")
+        print(data.decode(errors="replace"))
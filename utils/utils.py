@@ -1,6 +1,9 @@
 import cv2
+import logging
 import numpy as np
+import os
 import pygame
+import threading
 import time
 from tflite_support.task import processor
 
@@ -23,6 +26,15 @@ def playSound(source: str, wait=False):
             continue
 
 
+# Lower the CPU (and on Linux the derived I/O) priority of the calling thread,
+# used for background work that must not disturb capture and recording
+def lowerThreadPriority(niceness=10):
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError) as e:
+        logging.error(f"Could not lower thread priority: {e}")
+
+
 def putText(
     image: np.ndarray,
     text,